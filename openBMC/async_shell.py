@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import logging
+import threading
+
+import serial
+
+from openBMC.serial_shell import ushell
+
+SHELL_PROMPT = "uart>"
+SHELL_HISTORY_SIZE = 100
+
+# escape sequences of the keys a VT100 terminal sends
+KEY_SEQUENCES = {"\x1b[A": "up", "\x1b[B": "down", "\x1b[C": "right", "\x1b[D": "left",
+                 "\x1b[H": "home", "\x1b[F": "end", "\x1bOH": "home", "\x1bOF": "end",
+                 "\x1b[1~": "home", "\x1b[4~": "end", "\x1b[3~": "delete"}
+CONTROL_KEYS = {"\x01": "home", "\x02": "left", "\x04": "delete", "\x05": "end", "\x06": "right",
+                "\x08": "backspace", "\x7f": "backspace", "\x0b": "kill_end", "\x15": "kill_start",
+                "\x17": "kill_word", "\x10": "up", "\x0e": "down", "\x0c": "redraw", "\t": "complete"}
+
+
+class CommandCancelled(BaseException):
+    '''raised in a command writing output after Ctrl-C; not an Exception, so
+    the error handling of the commands lets it through'''
+
+
+class LineEditor(object):
+    '''the line being typed, its cursor and the history of entered lines'''
+
+    def __init__(self, history_size=SHELL_HISTORY_SIZE):
+        self.line = ""
+        self.cursor = 0
+        self.history = []
+        self.history_size = history_size
+        self._browse = None
+        self._draft = ""
+
+    def insert(self, text):
+        self.line = self.line[:self.cursor] + text + self.line[self.cursor:]
+        self.cursor += len(text)
+
+    def backspace(self):
+        if self.cursor:
+            self.line = self.line[:self.cursor - 1] + self.line[self.cursor:]
+            self.cursor -= 1
+
+    def delete(self):
+        self.line = self.line[:self.cursor] + self.line[self.cursor + 1:]
+
+    def left(self):
+        self.cursor = max(0, self.cursor - 1)
+
+    def right(self):
+        self.cursor = min(len(self.line), self.cursor + 1)
+
+    def home(self):
+        self.cursor = 0
+
+    def end(self):
+        self.cursor = len(self.line)
+
+    def kill_end(self):
+        self.line = self.line[:self.cursor]
+
+    def kill_start(self):
+        self.line = self.line[self.cursor:]
+        self.cursor = 0
+
+    def kill_word(self):
+        start = len(self.line[:self.cursor].rstrip())
+        start = self.line.rfind(" ", 0, start) + 1
+        self.line = self.line[:start] + self.line[self.cursor:]
+        self.cursor = start
+
+    def up(self):
+        if not self.history:
+            return
+        if self._browse is None:
+            self._draft = self.line
+            self._browse = len(self.history)
+        self._browse = max(0, self._browse - 1)
+        self.line = self.history[self._browse]
+        self.cursor = len(self.line)
+
+    def down(self):
+        if self._browse is None:
+            return
+        self._browse += 1
+        if self._browse >= len(self.history):
+            self._browse = None
+            self.line = self._draft
+        else:
+            self.line = self.history[self._browse]
+        self.cursor = len(self.line)
+
+    def clear(self):
+        self.line = ""
+        self.cursor = 0
+        self._browse = None
+
+    def accept(self):
+        '''return the entered line and start a new one'''
+        line = self.line.rstrip()
+        if line and (not self.history or self.history[-1] != line):
+            self.history.append(line)
+            del self.history[:-self.history_size]
+        self.clear()
+        return line
+
+
+class ConsoleWriter(object):
+    '''serial look-alike handed to the commands, thread-safe'''
+
+    # a write raises CommandCancelled after Ctrl-C
+    cancellable = True
+
+    def __init__(self, shell, job=None):
+        self.shell = shell
+        self.job = job
+
+    @property
+    def out_waiting(self):
+        '''bytes waiting for the UART, like pyserial'''
+        return len(self.shell._out)
+
+    def write(self, string):
+        if self.job is not None and self.job.cancelled:
+            raise CommandCancelled()
+        if string:
+            self.shell.post(str(string), self.job)
+
+
+class _Job(object):
+    def __init__(self, loop, line):
+        self.line = line
+        self.cancelled = False
+        self.interrupt = loop.create_future()
+
+
+class AsyncShell(ushell):
+    '''Serial shell on an asyncio loop.
+
+    The UART is read and written non-blocking from the loop: typing, line
+    editing (arrows, Ctrl-A/E/K/U/W, Tab completion) and history (up/down)
+    stay live while a command runs. A command runs in a worker thread, its
+    output streams to the port as it is written; keys typed meanwhile are
+    kept and replayed at the next prompt. Ctrl-C drops the command's output
+    at once and its next write raises CommandCancelled; the prompt comes
+    back once the command has stopped, "cancelling..." is shown meanwhile,
+    so the next command never overlaps it on the shared bus and D-Bus
+    handles.
+    Background tasks write through post() or console(), which erase and
+    redraw the line being typed around their output.
+    '''
+
+    def __init__(self, port='/dev/serial0', baudrate=115200, cmd=None, ser=None):
+        self._ser = ser
+        ushell.__init__(self, port, baudrate, cmd)
+        self.editor = LineEditor()
+        self.loop = None
+        self._loop_thread = None
+        self._out = bytearray()
+        self._writing = False
+        self._esc = ""
+        self._last = ""
+        self._prompt_shown = False
+        self._job = None
+        self._typeahead = ""
+        self._lines = None
+
+    def uart_init(self,):
+        if self._ser is not None:
+            return self._ser
+        # timeouts 0: reads return what arrived, writes what the driver took
+        return serial.Serial(
+            port=self.port,
+            baudrate=self.baudrate,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            timeout=0,
+            write_timeout=0,
+        )
+
+    # output
+
+    def _write(self, text):
+        '''queue text for the port, the loop drains it as the UART takes it'''
+        self._out += text.replace("\r\n", "\n").replace("\n", "\r\n").encode("utf-8", "replace")
+        self._flush()
+
+    def _flush(self):
+        while self._out:
+            try:
+                written = self.ser.write(bytes(self._out))
+            except (serial.SerialTimeoutException, BlockingIOError):
+                written = 0
+            if not written:
+                break
+            del self._out[:written]
+        if self._out and not self._writing:
+            self.loop.add_writer(self.ser.fileno(), self._flush)
+            self._writing = True
+        elif not self._out and self._writing:
+            self.loop.remove_writer(self.ser.fileno())
+            self._writing = False
+
+    def _redraw(self):
+        line = self.editor.line
+        back = len(line) - self.editor.cursor
+        self._write("\r" + SHELL_PROMPT + line + "\x1b[K" + ("\x1b[{}D".format(back) if back else ""))
+
+    def _show_prompt(self):
+        self._prompt_shown = True
+        self._redraw()
+        # keys typed while the last command ran
+        typeahead, self._typeahead = self._typeahead, ""
+        self._keys(typeahead)
+
+    def _print(self, text, job=None):
+        if job is not None and (job.cancelled or job is not self._job):
+            return
+        if self._prompt_shown:
+            self._write("\r\x1b[K" + text + ("" if text.endswith("\n") else "\n"))
+            self._redraw()
+        else:
+            self._write(text)
+
+    def post(self, text, job=None):
+        '''print text from any thread, around the line being typed'''
+        if self.loop is None:
+            return
+        if threading.current_thread() is self._loop_thread:
+            self._print(text, job)
+        else:
+            self.loop.call_soon_threadsafe(self._print, text, job)
+
+    def console(self):
+        '''return a serial look-alike for background output'''
+        return ConsoleWriter(self)
+
+    def spawn(self, coro):
+        '''run a background coroutine on the shell loop, from any thread'''
+        if threading.current_thread() is self._loop_thread:
+            return self.loop.create_task(coro)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def show_banner(self):
+        # the banner of ushell, written through the output queue
+        banner = []
+        class Collect(object):
+            def write(self, string):
+                banner.append(string)
+        ser, self.ser = self.ser, Collect()
+        try:
+            ushell.show_banner(self)
+        finally:
+            self.ser = ser
+        self._write("".join(banner))
+
+    # input
+
+    def _on_readable(self):
+        data = self.ser.read(self.ser.in_waiting or 1)
+        if data:
+            self._keys(data.decode("latin-1"))
+
+    def _keys(self, keys):
+        for i, key in enumerate(keys):
+            if key == "\x03":
+                self._interrupt()
+            elif not self._prompt_shown:
+                self._typeahead += key
+            else:
+                self._key(key)
+                if not self._prompt_shown:
+                    # a command was entered, the rest waits for the next prompt
+                    self._typeahead += keys[i + 1:]
+                    return
+
+    def _key(self, key):
+        last, self._last = self._last, key
+        if self._esc:
+            self._esc += key
+            if len(self._esc) == 2 and key not in "[O":
+                self._esc = ""
+            elif len(self._esc) > 2 and (key.isalpha() or key == "~"):
+                action, self._esc = KEY_SEQUENCES.get(self._esc), ""
+                if action:
+                    self._edit(action)
+            return
+        if key == "\x1b":
+            self._esc = key
+        elif key == "\r" or (key == "\n" and last != "\r"):
+            self._enter()
+        elif key in CONTROL_KEYS:
+            self._edit(CONTROL_KEYS[key])
+        elif key >= " " and key != "\n":
+            at_end = self.editor.cursor == len(self.editor.line)
+            self.editor.insert(key)
+            if at_end:
+                self._write(key)
+            else:
+                self._redraw()
+
+    def _edit(self, action):
+        if action == "complete":
+            self._complete()
+        elif action != "redraw":
+            getattr(self.editor, action)()
+        self._redraw()
+
+    def _complete(self):
+        if " " in self.editor.line[:self.editor.cursor]:
+            return
+        prefix = self.editor.line[:self.editor.cursor]
+        names = sorted(name for name in self.cmd.cmd_list if name.startswith(prefix))
+        if len(names) == 1:
+            self.editor.insert(names[0][len(prefix):] + " ")
+        elif names:
+            self._print("  ".join(names))
+
+    def _enter(self):
+        line = self.editor.accept()
+        self._write("\r\n")
+        if not line.split():
+            self._redraw()
+            return
+        self._prompt_shown = False
+        self._lines.put_nowait(line)
+
+    def _interrupt(self):
+        self._typeahead = ""
+        self.editor.clear()
+        self._esc = ""
+        if self._job is not None:
+            self._job.cancelled = True
+            if not self._job.interrupt.done():
+                self._job.interrupt.set_result(None)
+        self._write("^C\r\n")
+        if self._prompt_shown:
+            self._redraw()
+
+    # commands
+
+    def _apply(self, line, writer):
+        words = line.split()
+        try:
+            self.cmd.apply_cmd(words[0], writer, *words[1:])
+        except CommandCancelled:
+            pass
+
+    async def _dispatch(self):
+        while True:
+            line = await self._lines.get()
+            job = _Job(self.loop, line)
+            self._job = job
+            done = self.loop.run_in_executor(None, self._apply, line, ConsoleWriter(self, job))
+            await asyncio.wait([done, job.interrupt], return_when=asyncio.FIRST_COMPLETED)
+            if not done.done():
+                # it stops at its next write, e.g. after a slow SMBPBI read
+                self._write("cancelling...\r\n")
+                await asyncio.wait([done])
+            self._job = None
+            if job.cancelled:
+                logging.warning("[async_shell]{} cancelled".format(line))
+            else:
+                self._write("\r\n")
+            self._show_prompt()
+
+    async def main(self):
+        self.loop = asyncio.get_event_loop()
+        self._loop_thread = threading.current_thread()
+        self._lines = asyncio.Queue()
+        self.loop.add_reader(self.ser.fileno(), self._on_readable)
+        self.show_banner()
+        self._show_prompt()
+        await self._dispatch()
+
+    def run(self,):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.main())
+        finally:
+            loop.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="openBMC serial shell on asyncio")
+    parser.add_argument('-p','--port',default='/dev/serial0',help='serial port of the shell')
+    parser.add_argument('-b','--baudrate',type=int,default=115200,help='baudrate of the serial shell')
+    args = parser.parse_args()
+    AsyncShell(args.port,args.baudrate).run()
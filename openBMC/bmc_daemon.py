@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+import os
+import sys
+import threading
+
+try:
+    import gobject
+except ImportError:
+    # python3, see dbus_backend
+    from gi.repository import GObject as gobject
+import dbus.glib
+
+from openBMC.dbus_backend import Backend,DBusClient
+from openBMC.fan_control import fan_control,i2c1_init,tmp451_init,load_config,FAN_CONTROL_CONFIG
+from openBMC.terminal_cmd import CMDManager
+from openBMC.cmd_server import CmdServer,CMD_SERVER_PATH
+
+
+class BmcDaemon(object):
+    '''Backend, fan control and serial shell hosted in one process.
+
+    The backend is still exported on D-Bus for outside clients, while the
+    fan control and the shell call it in process through a DBusClient on the
+    Backend object, so the control path has no IPC. The glib main loop of
+    the backend runs in the main thread, the fan loop, the shell and the
+    optional command and shell servers in their own threads. If one of
+    them dies the whole process exits so the service manager restarts it
+    with the fans back under control.
+    '''
+
+    def __init__(self, backend, fan=None, shell=None, cmd_server=None, shell_server=None):
+        self.backend = backend
+        self.fan = fan
+        self.shell = shell
+        self.cmd_server = cmd_server
+        self.shell_server = shell_server
+        self.threads = []
+
+    def _guard(self, name, target):
+        def run():
+            try:
+                target()
+            except Exception:
+                logging.exception("{} stopped".format(name))
+            else:
+                logging.error("{} returned".format(name))
+            os._exit(1)
+        return run
+
+    def start(self):
+        # glib and dbus are entered from the worker threads too
+        gobject.threads_init()
+        dbus.glib.init_threads()
+        if self.fan:
+            self.threads.append(threading.Thread(target=self._guard("fan control",self.fan.fan_ctrl_loop),name="fan_control"))
+        if self.shell:
+            self.threads.append(threading.Thread(target=self._guard("serial shell",self.shell.run),name="serial_shell"))
+        if self.cmd_server:
+            self.threads.append(threading.Thread(target=self._guard("command server",self.cmd_server.serve_forever),name="cmd_server"))
+        if self.shell_server:
+            self.threads.append(threading.Thread(target=self._guard("shell server",self.shell_server.run),name="shell_server"))
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def run(self):
+        self.start()
+        self.backend.run_dbus_service()
+
+
+def parse_argv():
+    parser = argparse.ArgumentParser(description="openBMC daemon: backend, fan control and serial shell in one process")
+    parser.add_argument('-c','--config',default=None,
+                        help='fan control config in JSON, for example: {}'.format(FAN_CONTROL_CONFIG))
+    parser.add_argument('-p','--port',default='/dev/serial0',help='serial port of the shell')
+    parser.add_argument('-b','--baudrate',type=int,default=115200,help='baudrate of the serial shell')
+    parser.add_argument('--no-shell',action='store_true',help='do not run the serial shell')
+    parser.add_argument('--no-fan-control',action='store_true',help='do not run the fan control')
+    parser.add_argument('--cmd-server',nargs='?',const=CMD_SERVER_PATH,default=None,metavar='SOCKET',
+                        help='serve the shell commands on a Unix socket(default {})'.format(CMD_SERVER_PATH))
+    parser.add_argument('--shell-server',nargs='?',const='/run/openBMC-shell.sock',default=None,metavar='SOCKET',
+                        help='serve shell sessions on a Unix socket(default /run/openBMC-shell.sock), python3 only')
+    parser.add_argument('--shell-port',type=int,default=None,metavar='PORT',
+                        help='also serve shell sessions on this TCP port of 127.0.0.1')
+    parser.add_argument('-s','--state-plane',default=None,metavar='FILE',
+                        help='also publish the board state to a shared memory FILE, e.g. /dev/shm/openBMC-state')
+    parser.add_argument('-i','--signal-interval',type=int,default=0,metavar='MS',
+                        help='minimum time between two PropertiesChanged signals')
+    parser.add_argument('--session-bus',action='store_true',help='use the session bus (for testing)')
+    parser.add_argument('--debug',action='store_true',help='enable debugging messages')
+    parser.add_argument('-l','--logfile',default=None,metavar='FILE',
+                        help='write logging messages to a file instead to stderr')
+    args = parser.parse_args()
+    if (args.shell_server or args.shell_port) and sys.version_info[0] < 3:
+        # the shell server runs on asyncio, refuse before anything is started
+        parser.error("--shell-server and --shell-port need python3, this is python {}".format(sys.version.split()[0]))
+    return args
+
+
+def main():
+    args = parse_argv()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING,filename=args.logfile,
+                        format='%(asctime)s %(threadName)s %(levelname)s: %(message)s')
+    backend = Backend.create_dbus_server(args.session_bus,args.state_plane,args.signal_interval)
+    if not backend:
+        logging.error("Error spawning DBUS server")
+        sys.exit(10)
+    fan = None
+    if not args.no_fan_control:
+        i2c1 = i2c1_init()
+        tmp451_init(i2c1)
+        fan = fan_control(i2c1,config=load_config(args.config),dbus_client=DBusClient(backend))
+    # the serial shell and the command server share one set of commands
+    manager = CMDManager(dbus_client=DBusClient(backend))
+    shell = None
+    if not args.no_shell:
+        # imported here, the serial module is only needed with a shell; the
+        # asyncio shell is python3 only, python2 runs the line shell
+        try:
+            from openBMC.async_shell import AsyncShell as shell_class
+        except (ImportError, SyntaxError):
+            from openBMC.serial_shell import ushell as shell_class
+        shell = shell_class(args.port,args.baudrate,manager)
+    cmd_server = CmdServer(manager,args.cmd_server) if args.cmd_server else None
+    shell_server = None
+    if args.shell_server or args.shell_port:
+        # python3 only, parse_argv refused the flags on python2
+        from openBMC.shell_server import ShellServer
+        shell_server = ShellServer(manager,args.shell_server,args.shell_port)
+    BmcDaemon(backend,fan,shell,cmd_server,shell_server).run()
+
+
+if __name__ == '__main__':
+    main()
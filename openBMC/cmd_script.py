@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import json
+import re
+import time
+
+# repeat <count> [every <interval> [ms]] [: commands]
+REPEAT_PATTERN = re.compile(r"^repeat\s+(\d+)(?:\s+every\s+(\d+)(?:\s*ms)?)?\s*(?::(.*))?$")
+
+
+def _commands(text, line_number):
+    return [("cmd", command.split(), line_number) for command in text.split(";") if command.split()]
+
+
+def parse_script(text):
+    '''parse a script into steps, ("cmd", words, line) or
+    ("repeat", count, interval_ms, steps).
+
+    Commands are separated by newlines or ";", "#" starts a comment.
+    "repeat N every T ms: cmd; cmd" repeats the rest of its line, a repeat
+    ending its line repeats the lines up to the matching "end".
+    '''
+    stack = [[]]
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if line == "end":
+            if len(stack) == 1:
+                raise ValueError("line {}: end without repeat".format(line_number))
+            stack.pop()
+            continue
+        segments = line.split(";")
+        for i, segment in enumerate(segments):
+            if segment.split()[:1] != ["repeat"]:
+                stack[-1].extend(_commands(segment, line_number))
+                continue
+            # a repeat takes the rest of the line
+            repeat = REPEAT_PATTERN.match(";".join(segments[i:]).strip())
+            if not repeat:
+                raise ValueError("line {}: expected repeat <count> every <interval> ms".format(line_number))
+            count, interval, rest = repeat.groups()
+            step = ("repeat", int(count), int(interval or 0), [])
+            stack[-1].append(step)
+            if rest is not None:
+                step[3].extend(_commands(rest, line_number))
+            else:
+                stack.append(step[3])
+            break
+    if len(stack) > 1:
+        raise ValueError("repeat without end")
+    return stack[0]
+
+
+class OutputCapture(object):
+    '''serial look-alike collecting the output of one command'''
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, string):
+        self.chunks.append(str(string))
+
+    def text(self):
+        return "".join(self.chunks)
+
+
+class ScriptRunner(object):
+    '''Run script steps in one CMDManager session.
+
+    Every command shares the bus and D-Bus handles of the manager, so a
+    script pays the process start and connections once. Output is written
+    to serial as the commands print it, or as JSON lines, one per command
+    run: {"line", "iteration", "cmd", "args", "ok", "ms", "output"}, and a
+    final {"summary": {"commands", "failed", "ms"}}.
+    '''
+
+    def __init__(self, manager, serial=None, json_lines=False, stop_on_error=False):
+        self.manager = manager
+        self.serial = serial
+        self.json_lines = json_lines
+        self.stop_on_error = stop_on_error
+        self.commands = 0
+        self.failed = 0
+
+    def _write(self, string):
+        if self.serial:
+            self.serial.write(string)
+        else:
+            print(string.rstrip("\n"))
+
+    def _run_cmd(self, words, line_number, iteration):
+        start = time.time()
+        if self.json_lines:
+            capture = OutputCapture()
+            ok = self.manager.apply_cmd(words[0], capture, *words[1:])
+            self._write(json.dumps({"line": line_number, "iteration": iteration, "cmd": words[0],
+                                    "args": words[1:], "ok": ok, "ms": round((time.time() - start) * 1000, 3),
+                                    "output": capture.text()}) + "\n")
+        else:
+            ok = self.manager.apply_cmd(words[0], self.serial, *words[1:])
+        self.commands += 1
+        if not ok:
+            self.failed += 1
+        return ok
+
+    def _run(self, steps, iteration):
+        for step in steps:
+            if step[0] == "cmd":
+                if not self._run_cmd(step[1], step[2], iteration) and self.stop_on_error:
+                    return False
+                continue
+            count, interval, body = step[1:]
+            deadline = time.time()
+            for i in range(count):
+                if not self._run(body, i):
+                    return False
+                if interval and i + 1 < count:
+                    deadline = max(deadline + interval / 1000.0, time.time() - interval / 1000.0)
+                    time.sleep(max(0, deadline - time.time()))
+        return True
+
+    def run(self, steps):
+        '''run the steps, return True when every command succeeded'''
+        start = time.time()
+        self._run(steps, 0)
+        if self.json_lines:
+            self._write(json.dumps({"summary": {"commands": self.commands, "failed": self.failed,
+                                                "ms": round((time.time() - start) * 1000, 3)}}) + "\n")
+        return not self.failed
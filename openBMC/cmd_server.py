@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import socket
+
+try:
+    import socketserver
+except ImportError:
+    # python2
+    import SocketServer as socketserver
+
+# the resident command server of the shell commands
+CMD_SERVER_PATH = "/run/openBMC-cmd.sock"
+# ends the output of every command
+CMD_END = b"\0"
+# seconds a client may stay idle between two commands before it is dropped
+CMD_SERVER_IDLE_TIMEOUT = 10
+# commands a server doesn't run for its clients: batch opens a file as the
+# server user, relative to the server's cwd; a client reads the script and
+# sends its text with run
+CMD_SERVER_REFUSED = {"batch": "batch reads the script on the server, send its text with run"}
+
+
+class CmdWriter(object):
+    '''serial look-alike handed to the commands, sends their output to the client'''
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, string):
+        if not isinstance(string, bytes):
+            string = str(string).encode("utf-8")
+        self.wfile.write(string.replace(CMD_END, b""))
+
+
+class CmdRequestHandler(socketserver.StreamRequestHandler):
+    '''one client connection: every line is a JSON array [cmd_name, arg, ...],
+    the output of the command is sent back followed by CMD_END. A client
+    idle for CMD_SERVER_IDLE_TIMEOUT seconds is disconnected.'''
+
+    timeout = CMD_SERVER_IDLE_TIMEOUT
+
+    def handle(self):
+        try:
+            self._handle()
+        except socket.timeout:
+            logging.warning("[cmd_server]idle client dropped")
+
+    def _handle(self):
+        writer = CmdWriter(self.wfile)
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+                if request[0] in CMD_SERVER_REFUSED:
+                    raise ValueError(CMD_SERVER_REFUSED[request[0]])
+                self.server.manager.apply_cmd(request[0], writer, *[str(arg) for arg in request[1:]])
+            except Exception as err:
+                logging.error("[cmd_server]ERROR is {}".format(str(err)))
+                writer.write("error: {}\n".format(err))
+            self.wfile.write(CMD_END)
+            self.wfile.flush()
+
+
+class CmdServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''Resident command server on a Unix socket.
+
+    It runs the CMDManager commands for thin clients, so they pay neither
+    the interpreter start nor the imports and connections of the commands.
+    Every client has its own thread, so an idle or long running one (a
+    watch) doesn't hold back the others; their bus transactions go through
+    the arbiter of the shared manager.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, manager, path=CMD_SERVER_PATH):
+        self.manager = manager
+        self.path = path
+        if os.path.exists(path):
+            # a socket left behind by a server which is gone
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, CmdRequestHandler)
+        os.chmod(path, 0o660)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class CmdClient(object):
+    '''thin client of CmdServer, raises socket.error when no server runs'''
+
+    def __init__(self, path=CMD_SERVER_PATH, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self._buffer = b""
+
+    def run(self, cmd_name, *args):
+        '''run one command on the server, return its output'''
+        self.sock.sendall((json.dumps([cmd_name] + list(args)) + "\n").encode("utf-8"))
+        while CMD_END not in self._buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise socket.error("command server closed the connection")
+            self._buffer += data
+        output, self._buffer = self._buffer.split(CMD_END, 1)
+        return output.decode("utf-8")
+
+    def close(self):
+        self.sock.close()
@@ -3,8 +3,13 @@
 
 import logging, os, signal
 
-import glib
-import gobject
+try:
+    import glib
+    import gobject
+except ImportError:
+    # python3 has the static bindings no more, PyGObject has the same calls
+    from gi.repository import GLib as glib
+    from gi.repository import GObject as gobject
 
 import dbus
 import dbus.glib
@@ -13,9 +18,26 @@ import dbus.mainloop.glib
 import subprocess
 
 import sys
+import time
+import threading
+
+from openBMC.history import BoardHistory
+from openBMC.state_plane import StatePlane
+from openBMC.sensor_cache import SensorCache
+
+try:
+    unicode
+except NameError:
+    # python3
+    unicode = str
 
 DBUS_BUS_NAME = 'com.openBMC.RPI'
 DBUS_INTERFACE_NAME = 'com.openBMC.RPI'
+PROPERTIES_INTERFACE_NAME = 'org.freedesktop.DBus.Properties'
+# the board state is recorded in the history every second
+HISTORY_SAMPLE_INTERVAL = 1000
+# seconds a client call may wait for the backend reply
+DBUS_CALL_TIMEOUT = 5
 
 class Backend(dbus.service.Object):
     '''Backend manager.
@@ -29,7 +51,7 @@ class Backend(dbus.service.Object):
     # D-BUS control API
     #
 
-    def __init__(self,):
+    def __init__(self, state_plane=None, signal_interval=0):
         dbus.service.Object.__init__(self)
 
         #initialize variables that will be used during create and run
@@ -39,6 +61,25 @@ class Backend(dbus.service.Object):
 
         # e4700_board instance
         self.e4700_board = e4700_board(1.0,)
+        # time series of every sensor and PWM value
+        self.history = BoardHistory(self.e4700_board.history_series())
+        # latest reading of every sensor published by the control loop
+        self.sensors = SensorCache()
+        # bulk updates are applied as a whole, also against in-process callers
+        self._state_lock = threading.Lock()
+        # PropertiesChanged is sent at most every signal_interval ms, the
+        # changes in between are coalesced into one signal
+        self.signal_interval = signal_interval
+        self._emitted = self._properties()
+        self._last_emit = 0
+        self._emit_pending = False
+        # in-process subscribers, called with the changed properties
+        self._listeners = []
+        # optional shared memory copy of the board state for lock-free readers
+        self.state_plane = None
+        if state_plane:
+            self.state_plane = StatePlane(state_plane, writer=True)
+            self._publish_state()
 
 
     def run_dbus_service(self, timeout=None, send_usr1=False):
@@ -55,6 +96,7 @@ class Backend(dbus.service.Object):
 
         dbus.service.Object.__init__(self, self.bus, '/RPI')
         self.main_loop = glib.MainLoop()
+        glib.timeout_add(HISTORY_SAMPLE_INTERVAL, self._sample_history)
 
         # send parent process a signal that we are ready now
         if send_usr1:
@@ -65,14 +107,16 @@ class Backend(dbus.service.Object):
             self.main_loop.run()
 
     @classmethod
-    def create_dbus_server(cls, session_bus=False):
+    def create_dbus_server(cls, session_bus=False, state_plane=None, signal_interval=0):
         '''Return a D-BUS server backend instance.
 
         Normally this connects to the system bus. Set session_bus to True to
-        connect to the session bus (for testing).
+        connect to the session bus (for testing). state_plane is the path of
+        a shared memory file the board state is also published to,
+        signal_interval the minimum time in ms between two PropertiesChanged.
 
         '''
-        backend = Backend()
+        backend = Backend(state_plane, signal_interval)
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
         if session_bus:
             backend.bus = dbus.SessionBus()
@@ -87,6 +131,63 @@ class Backend(dbus.service.Object):
             return None
         return backend
 
+    def _sample_history(self):
+        try:
+            self.history.sample(time.time())
+        except Exception as e:
+            logging.error("[history]ERROR is {}".format(str(e)))
+        # keep the glib timeout running
+        return True
+
+    def _publish_state(self):
+        # called with the state lock held after every change of the board state,
+        # updates the state plane and schedules the PropertiesChanged signal
+        if self.state_plane is not None:
+            try:
+                self.state_plane.publish(self.e4700_board.state())
+            except Exception as e:
+                logging.error("[state_plane]ERROR is {}".format(str(e)))
+        if not self._emit_pending:
+            self._emit_pending = True
+            delay = self._last_emit + self.signal_interval / 1000.0 - time.time()
+            if delay > 0:
+                glib.timeout_add(int(delay * 1000) + 1, self._emit_properties_changed)
+            else:
+                glib.idle_add(self._emit_properties_changed)
+
+    def _properties(self):
+        return dict((name, list(getattr(self.e4700_board, attr)))
+                    for name, attr in self.e4700_board.STATE_FIELDS)
+
+    def _emit_properties_changed(self):
+        with self._state_lock:
+            self._emit_pending = False
+            current = self._properties()
+        changed = dict((name, values) for name, values in current.items()
+                       if self._emitted.get(name) != values)
+        self._last_emit = time.time()
+        if changed:
+            self._emitted.update(changed)
+            self.PropertiesChanged(DBUS_INTERFACE_NAME,
+                                   dict((name, dbus.Array(values, signature='n'))
+                                        for name, values in changed.items()),
+                                   [])
+            for listener in list(self._listeners):
+                try:
+                    listener(changed)
+                except Exception as e:
+                    logging.error("[PropertiesChanged]ERROR is {}".format(str(e)))
+        # one shot glib source
+        return False
+
+    def add_listener(self, listener):
+        '''call listener({name: values}) in process on every PropertiesChanged'''
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
 
     #
     # Client API (through D-BUS)
@@ -99,14 +200,7 @@ class Backend(dbus.service.Object):
         #need root privillege to get info
         data = -1
         try:
-            if request == "percent":
-                data = self.e4700_board.get_percent(index)
-            elif request == "temp":
-                data = self.e4700_board.get_temp(index)
-            elif request == "power":
-                data = self.e4700_board.get_power(index)
-            elif request == "user":
-                data = self.e4700_board.get_user_set(index)
+            data = self.e4700_board.get_value(request,index)
         except Exception as e:
             logging.error("[get_data]ERROR is {}".format(str(e)))
         return (data)
@@ -117,22 +211,187 @@ class Backend(dbus.service.Object):
                          connection_keyword='conn')
     def set_data(self, data, type, index, sender=None, conn=None):
         try:
-            if type == "percent":
-                self.e4700_board.set_percent(index,data)
-            elif type == "temp":
-                self.e4700_board.set_temp(index,data)
-            elif type == "power":
-                self.e4700_board.set_power(index,data)
-            elif type == "user":
-                self.e4700_board.set_user_set(index,data)
+            with self._state_lock:
+                self.e4700_board.set_value(type,index,data)
+                self._publish_state()
         except Exception as e:
             logging.error("[set_data]ERROR is {}".format(str(e)))
 
 
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+                         in_signature='', out_signature='a(syn)', sender_keyword='sender',
+                         connection_keyword='conn')
+    def get_all(self, sender=None, conn=None):
+        """return the whole share data as (type, index, value)"""
+        with self._state_lock:
+            return self.e4700_board.state()
+
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+                         in_signature='a(sy)', out_signature='an', sender_keyword='sender',
+                         connection_keyword='conn')
+    def get_many(self, requests, sender=None, conn=None):
+        """return the share data of every (type, index) request, -1 for the invalid ones"""
+        with self._state_lock:
+            return self._get_many(requests)
+
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+                         in_signature='a(syn)', out_signature='', sender_keyword='sender',
+                         connection_keyword='conn')
+    def set_many(self, updates, sender=None, conn=None):
+        """set every (type, index, value), all of them or none if one is invalid"""
+        with self._state_lock:
+            self._set_many(updates)
+            self._publish_state()
+
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+                         in_signature='a(syn)a(sy)', out_signature='an', sender_keyword='sender',
+                         connection_keyword='conn')
+    def exchange(self, updates, requests, sender=None, conn=None):
+        """set_many(updates) then get_many(requests) in one call"""
+        with self._state_lock:
+            if updates:
+                self._set_many(updates)
+                self._publish_state()
+            return self._get_many(requests)
+
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+                         in_signature='a(ynn)', out_signature='a(bn)', sender_keyword='sender',
+                         connection_keyword='conn')
+    def cas_user(self, swaps, sender=None, conn=None):
+        """compare and swap the user set status of groups.
+        swaps is (index, expected, new), an expected of -1 matches any value;
+        return (swapped, previous value) of each"""
+        with self._state_lock:
+            board = self.e4700_board
+            for index, expected, new in swaps:
+                board.check("user", index)
+            results = []
+            for index, expected, new in swaps:
+                previous = board.get_user_set(index)
+                swapped = expected == -1 or previous == expected
+                if swapped:
+                    board.set_user_set(index, new)
+                results.append((swapped, previous))
+            self._publish_state()
+            return results
+
+    def _get_many(self, requests):
+        values = []
+        for request, index in requests:
+            try:
+                values.append(self.e4700_board.get_value(request, index))
+            except Exception as e:
+                logging.error("[get_many]ERROR is {}".format(str(e)))
+                values.append(-1)
+        return values
+
+    def _set_many(self, updates):
+        # validate everything first so a bad entry leaves the data untouched
+        for type, index, data in updates:
+            self.e4700_board.check(type, index)
+        for type, index, data in updates:
+            self.e4700_board.set_value(type, index, data)
+
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+                         in_signature='a(sdd)', out_signature='', sender_keyword='sender',
+                         connection_keyword='conn')
+    def publish_sensors(self, readings, sender=None, conn=None):
+        """store (name, value, monotonic timestamp) sensor readings in the cache"""
+        for name, value, timestamp in readings:
+            self.sensors.update(name, value, timestamp)
+
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+                         in_signature='asd', out_signature='a(bdd)', sender_keyword='sender',
+                         connection_keyword='conn')
+    def get_sensors(self, names, max_age, sender=None, conn=None):
+        """return (fresh, value, age in ms) of the cached sensors, fresh when
+        not older than max_age ms; value and age are -1 for unknown sensors"""
+        return [self.sensors.get(name, max_age) for name in names]
+
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+                         in_signature='', out_signature='as', sender_keyword='sender',
+                         connection_keyword='conn')
+    def get_sensor_names(self, sender=None, conn=None):
+        """return the names of the cached sensors"""
+        return self.sensors.names()
+
+
+    #
+    # board state as read-only properties of com.openBMC.RPI, one int16 array
+    # per data type: percent, temp, power, user, rpm and fan_status
+    #
+    @dbus.service.method(PROPERTIES_INTERFACE_NAME,
+                         in_signature='ss', out_signature='v')
+    def Get(self, interface_name, property_name):
+        properties = self.GetAll(interface_name)
+        if property_name not in properties:
+            raise InvalidRequest("unknown property {}".format(property_name))
+        return properties[property_name]
+
+    @dbus.service.method(PROPERTIES_INTERFACE_NAME,
+                         in_signature='s', out_signature='a{sv}')
+    def GetAll(self, interface_name):
+        if interface_name not in (DBUS_INTERFACE_NAME, ''):
+            raise InvalidRequest("unknown interface {}".format(interface_name))
+        with self._state_lock:
+            properties = self._properties()
+        return dict((name, dbus.Array(values, signature='n')) for name, values in properties.items())
+
+    @dbus.service.method(PROPERTIES_INTERFACE_NAME,
+                         in_signature='ssv')
+    def Set(self, interface_name, property_name, value):
+        raise InvalidRequest("{} is read-only, use set_data or set_many".format(property_name))
+
+    @dbus.service.signal(PROPERTIES_INTERFACE_NAME,
+                         signature='sa{sv}as')
+    def PropertiesChanged(self, interface_name, changed_properties, invalidated_properties):
+        """only the board state properties which changed since the last signal"""
+        pass
+
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+                         in_signature='', out_signature='as', sender_keyword='sender',
+                         connection_keyword='conn')
+    def get_history_names(self, sender=None, conn=None):
+        """return the names of the recorded series"""
+        return self.history.names()
+
+
+    @dbus.service.method(DBUS_INTERFACE_NAME,
+                         in_signature='sddd', out_signature='a(dddd)', sender_keyword='sender',
+                         connection_keyword='conn')
+    def get_history(self, name, start, end, resolution, sender=None, conn=None):
+        """return the (time, min, avg, max) buckets of a series between start and end,
+        times are seconds since the epoch and resolution the minimum bucket length"""
+        try:
+            return self.history.query(name, start, end, resolution)
+        except Exception as e:
+            logging.error("[get_history]ERROR is {}".format(str(e)))
+        return []
+
+
 
 
 
 class e4700_board(object):
+    # share data type -> attribute holding its per index values
+    STATE_FIELDS = [("percent", "duty_cycle_percent"),
+                    ("temp", "temperature"),
+                    ("power", "power"),
+                    ("user", "user_set"),
+                    ("rpm", "fan_rpm"),
+                    ("fan_status", "fan_status"),
+                    ("hsc_power", "hsc_power"),
+                    ("hsc_temp", "hsc_temp"),
+                    ("hsc_status", "hsc_status")]
+
     def __init__(self, version, bus=None,**kwargs):
         # board version
         self.version = version 
@@ -148,6 +407,51 @@ class e4700_board(object):
         self.power = [-1,-1,-1]
         # group(GPU0,GPU1,LR) user set status : 0 is not set while 1 is set
         self.user_set = [0,0,0]
+        # MAX31790 fan(1-6) speed in RPM, -1 represent it has not been read yet
+        self.fan_rpm = [-1,-1,-1,-1,-1,-1]
+        # MAX31790 fan(1-6) status : 0 is ok, 1 is stalled, 2 is failed (too slow for its duty cycle)
+        self.fan_status = [0,0,0,0,0,0]
+        # HSC(0-3) input power in W and temperature in C, -1 represent it has not been read yet
+        self.hsc_power = [-1,-1,-1,-1]
+        self.hsc_temp = [-1,-1,-1,-1]
+        # HSC(0-3) PMBus STATUS_WORD, as int16
+        self.hsc_status = [0,0,0,0]
+
+    def history_series(self):
+        '''return {series name: callable returning its current value} for the history'''
+        series = {}
+        for i in range(len(self.temperature)):
+            series["temp{}".format(i)] = lambda i=i: self.temperature[i]
+            series["power{}".format(i)] = lambda i=i: self.power[i]
+            series["percent{}".format(i)] = lambda i=i: self.duty_cycle_percent[i]
+        for i in range(len(self.fan_rpm)):
+            series["rpm{}".format(i)] = lambda i=i: self.fan_rpm[i]
+        for i in range(len(self.hsc_power)):
+            series["hsc_power{}".format(i)] = lambda i=i: self.hsc_power[i]
+        return series
+
+    def _field(self,type):
+        for name, attr in self.STATE_FIELDS:
+            if name == type:
+                return getattr(self, attr)
+        raise InvalidRequest("unknown data type {}".format(type))
+
+    def check(self,type,index):
+        if not 0 <= index < len(self._field(type)):
+            raise InvalidRequest("invalid {0} index {1}".format(type,index))
+
+    def get_value(self,type,index):
+        self.check(type,index)
+        return self._field(type)[index]
+
+    def set_value(self,type,index,value):
+        self.check(type,index)
+        self._field(type)[index] = value
+
+    def state(self):
+        '''return every share data value as (type, index, value)'''
+        return [(name, index, value) for name, attr in self.STATE_FIELDS
+                for index, value in enumerate(getattr(self, attr))]
 
     def set_percent(self,index,percent):
         self.duty_cycle_percent[index] = percent
@@ -161,6 +465,12 @@ class e4700_board(object):
     def set_user_set(self,index,status):
         self.user_set[index] = status
 
+    def set_fan_rpm(self,index,rpm):
+        self.fan_rpm[index] = rpm
+
+    def set_fan_status(self,index,status):
+        self.fan_status[index] = status
+
     def get_percent(self,index):
         return self.duty_cycle_percent[index]
 
@@ -173,6 +483,12 @@ class e4700_board(object):
     def get_user_set(self,index):
         return self.user_set[index]
 
+    def get_fan_rpm(self,index):
+        return self.fan_rpm[index]
+
+    def get_fan_status(self,index):
+        return self.fan_status[index]
+
     
 ##                ##
 ## Common Classes ##
@@ -190,50 +506,144 @@ class PermissionDeniedByPolicy(dbus.DBusException):
     """Exception Raised if policy kit denied the user access"""
     _dbus_error_name = 'com.openBMC.RPI.PermissionDeniedByPolicy'
 
+class InvalidRequest(dbus.DBusException):
+    """Exception Raised if a data type or index of a request is not known"""
+    _dbus_error_name = 'com.openBMC.RPI.InvalidRequest'
+
 class BackendCrashError(SystemError):
     """Exception Raised if the backend crashes"""
     pass
 
 
 
+class _PendingCall(object):
+    """reply slot of one asynchronous call, filled by the reply/error handler"""
+
+    def __init__(self, on_done=None):
+        self.done = False
+        self.result = None
+        self.error = None
+        self.on_done = on_done
+
+    def reply(self, *args):
+        self.result = args
+        self._finish()
+
+    def fail(self, exception=None):
+        self.error = exception
+        self._finish()
+
+    def _finish(self):
+        self.done = True
+        if self.on_done:
+            self.on_done()
+
+
+class DBusClient(object):
+    '''Persistent client of the backend.
+
+    One connection, one proxy and cached method objects are kept for the
+    life of the client. call_many() sends all its calls asynchronously at
+    once and then iterates the glib main context until every reply or error
+    arrived, so N calls cost about one round trip. Each call has a timeout
+    (DBUS_CALL_TIMEOUT by default) after which it fails instead of blocking
+    the caller. Replies are kept per call, and the main context is only
+    iterated by one thread at a time, so a client can be shared by threads.
+
+    target may also be a plain object (e.g. a Backend in the same process),
+    its methods are then called directly.
+    '''
+
+    def __init__(self, target=None, timeout=DBUS_CALL_TIMEOUT, session_bus=False):
+        if target is None:
+            dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+            bus = dbus.SessionBus() if session_bus else dbus.SystemBus()
+            target = dbus.Interface(bus.get_object(DBUS_BUS_NAME, '/RPI'), DBUS_INTERFACE_NAME)
+        self.target = target
+        self.timeout = timeout
+        self.is_dbus = hasattr(target, 'connect_to_signal')
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def _method(self, name):
+        method = self._methods.get(name)
+        if method is None:
+            if self.is_dbus:
+                method = self.target.get_dbus_method(name)
+            else:
+                method = getattr(self.target, name)
+            self._methods[name] = method
+        return method
+
+    def call_many(self, calls, timeout=None):
+        '''run [(method, args), ...] pipelined, return the unwrapped results in order'''
+        if not self.is_dbus:
+            return [self._method(method)(*args) for method, args in calls]
+        timeout = self.timeout if timeout is None else timeout
+        pending = []
+        for method, args in calls:
+            call = _PendingCall()
+            self._method(method)(*args, reply_handler=call.reply,
+                                 error_handler=call.fail, timeout=timeout)
+            pending.append(call)
+        self._wait(pending)
+        results = []
+        for call in pending:
+            if call.error is not None:
+                raise call.error
+            results.append(unwrap(call.result[0]) if call.result else None)
+        return results
+
+    def call(self, method, *args, **kwargs):
+        '''run one method, return its unwrapped result'''
+        return self.call_many([(method, args)], kwargs.get('timeout'))[0]
+
+    def subscribe(self, handler):
+        '''call handler({name: values}) with the board state properties which
+        changed, instead of polling them; handlers run from the glib main loop'''
+        if not self.is_dbus:
+            self.target.add_listener(handler)
+            return
+        def on_changed(interface_name, changed, invalidated):
+            if unwrap(interface_name) == DBUS_INTERFACE_NAME:
+                handler(unwrap(changed))
+        self.target.connect_to_signal('PropertiesChanged', on_changed,
+                                      dbus_interface=PROPERTIES_INTERFACE_NAME)
+
+    def _wait(self, pending):
+        # every pending call completes, the dbus timeout turns into an error reply
+        context = glib.main_context_default()
+        with self._lock:
+            while not all(call.done for call in pending):
+                context.iteration(True)
+
+
 def dbus_sync_call_signal_wrapper(dbus_iface, func, handler_map, *args, **kwargs):
     '''Run a D-BUS method call while receiving signals.
     This function is an Ugly Hack™, since a normal synchronous dbus_iface.fn()
     call does not cause signals to be received until the method returns. Thus
     it calls func asynchronously and sets up a temporary main loop to receive
     signals and call their handlers; these are assigned in handler_map (signal
-    name → signal handler).
+    name → signal handler). The call fails after DBUS_CALL_TIMEOUT seconds
+    unless a timeout keyword is given; use DBusClient for plain calls.
     '''
     if not hasattr(dbus_iface, 'connect_to_signal'):
         # not a D-BUS object
         return getattr(dbus_iface, func)(*args, **kwargs)
 
-    def _h_reply(*args, **kwargs):
-        """protected method to send a reply"""
-        global _h_reply_result
-        _h_reply_result = args
-        loop.quit()
-
-    def _h_error(exception=None):
-        """protected method to send an error"""
-        global _h_exception_exc
-        _h_exception_exc = exception
-        loop.quit()
-
     loop = glib.MainLoop()
-    global _h_reply_result, _h_exception_exc
-    _h_reply_result = None
-    _h_exception_exc = None
-    kwargs['reply_handler'] = _h_reply
-    kwargs['error_handler'] = _h_error
-    kwargs['timeout'] = 86400
+    call = _PendingCall(loop.quit)
+    kwargs['reply_handler'] = call.reply
+    kwargs['error_handler'] = call.fail
+    kwargs.setdefault('timeout', DBUS_CALL_TIMEOUT)
     for signame, sighandler in handler_map.items():
         dbus_iface.connect_to_signal(signame, sighandler)
     dbus_iface.get_dbus_method(func)(*args, **kwargs)
-    loop.run()
-    if _h_exception_exc:
-        raise _h_exception_exc
-    return _h_reply_result
+    if not call.done:
+        loop.run()
+    if call.error:
+        raise call.error
+    return call.result
 
 def unwrap(val):
     if isinstance(val, dbus.ByteArray):
@@ -1,16 +1,19 @@
 #!/usr/bin/env python
 
 import argparse
-import smbus
 import time
-from openBMC.smbpbi import smbpbi_read
-from openBMC.dbus_backend import Backend,dbus_sync_call_signal_wrapper,unwrap
-from datetime import datetime
-from datetime import timedelta
-from threading import Thread
+from openBMC.smbpbi import smbpbi_session,SMBPBI_STATUS_SUCCESS
+from openBMC.dbus_backend import DBusClient
+from openBMC.scheduler import PeriodicScheduler
+from openBMC.sensor_poll import Sensor,PollingEngine
+from openBMC.max31790 import MAX31790_7bit_ADDR,MAX31790_CHANNELS,FAN_OK,FAN_STATUS_NAMES,max31790_device
+from openBMC.fpga import FpgaStatus,read_fpga_status
+from openBMC.thermal_zone import ThermalZone,ThermalEngine
+from openBMC.fan_curve import compile_curves,zone_controller
+from openBMC.i2c_arbiter import i2c_arbiter,ArbitratedBus,PRIORITY_CONTROL,PRIORITY_TELEMETRY
+from openBMC.pmbus import HscTelemetry,HSC_ADDRESSES
 import logging
-import dbus
-import sys
+import json
 
 ##                ##
 ##Common Variables##
@@ -20,20 +23,22 @@ I2C_BUS_NUM =1
 TMP451_7bit_ADDR = 0x48
 GPU0_7bit_ADDR = 0x4C
 GPU1_7bit_ADDR = 0x4D
-MAX31790_7bit_ADDR = 0x2C
+SMBPBI_GPU_ADDR = [GPU0_7bit_ADDR,GPU1_7bit_ADDR]
 
 gpu_temp_command = 0x80000002
 hbm_temp_command = 0x80000502
+gpu_power_command = 0x80000004
+
+# fan speed changes smaller than this are not published to the dbus server
+RPM_PUBLISH_DEADBAND = 50
+# polled sensors whose readings are published to the backend sensor cache
+CACHED_SENSORS = ["LR_TEMP"] + ["GPU{0}_{1}".format(i,kind) for i in range(SMPBI_MAX_GPUS)
+                                for kind in ("TEMP","HBM","POWER")]
 
 def led_red_ylw_control():
     '''leverage from E4714 which need to validate on RPI'''
     pass
 
-def interval_millis(start_time):
-    dt = datetime.now() - start_time
-    ms = (dt.days * 24 * 60 * 60 + dt.seconds) * 1000 + dt.microseconds/1000.0
-    return ms
-
 def tmp451_init(bus):
     #set TMP451 WARN and OVERT to 90+64C and 95+64C
     bus.write_byte_data(TMP451_7bit_ADDR, 0x0d, 0x9f)
@@ -48,17 +53,32 @@ def tmp451_init(bus):
     bus.write_byte_data(TMP451_7bit_ADDR, 0x09, 0x04)
     time .sleep(0.001)
 
+def smbpbi_temp(data,status):
+    '''convert the signed 24.8 fixed point SMBPBI temperature to integer C'''
+    if status != SMBPBI_STATUS_SUCCESS:
+        return -1
+    if data & 0x80000000:
+        data -= 1 << 32
+    return data >> 8
+
+def smbpbi_power(data,status):
+    '''convert the SMBPBI total power in mW to W'''
+    if status != SMBPBI_STATUS_SUCCESS:
+        return -1
+    return data // 1000
+
 def get_temp(GPU_type,bus=None):
+    session = smbpbi_session(bus)
     if GPU_type == "GPU0_TEMP":
-        temp,status = smbpbi_read(GPU0_7bit_ADDR,gpu_temp_command,bus)
+        temp = smbpbi_temp(*session.read(GPU0_7bit_ADDR,gpu_temp_command))
     elif GPU_type == "GPU0_HBM":
-        temp,status = smbpbi_read(GPU0_7bit_ADDR,hbm_temp_command,bus)
+        temp = smbpbi_temp(*session.read(GPU0_7bit_ADDR,hbm_temp_command))
     elif GPU_type == "GPU1_TEMP":
-        temp,status = smbpbi_read(GPU1_7bit_ADDR,gpu_temp_command,bus)
+        temp = smbpbi_temp(*session.read(GPU1_7bit_ADDR,gpu_temp_command))
     elif GPU_type == "GPU1_HBM":
-        temp,status = smbpbi_read(GPU1_7bit_ADDR,hbm_temp_command,bus)
+        temp = smbpbi_temp(*session.read(GPU1_7bit_ADDR,hbm_temp_command))
     elif GPU_type == "LR_TEMP":
-        temp = bus.read_byte_data(TMP451_7bit_ADDR,0x01)
+        temp = session.bus.read_byte_data(TMP451_7bit_ADDR,0x01)
         # minus the offset 60c because of extend mode
         temp = temp - 64
     else:
@@ -66,224 +86,315 @@ def get_temp(GPU_type,bus=None):
         temp = -1
     return temp
 
+def get_gpu_temps(gpu_list,bus=None):
+    '''read GPU core and HBM temperature of every GPU index in gpu_list in one
+    interleaved SMBPBI pass, return {gpu index: (gpu temp, hbm temp)}'''
+    requests = []
+    for index in gpu_list:
+        requests.append((SMBPBI_GPU_ADDR[index],gpu_temp_command,0x0))
+        requests.append((SMBPBI_GPU_ADDR[index],hbm_temp_command,0x0))
+    results = smbpbi_session(bus).read_many(requests)
+    temps = {}
+    for i,index in enumerate(gpu_list):
+        temps[index] = (smbpbi_temp(*results[2 * i]),smbpbi_temp(*results[2 * i + 1]))
+    return temps
+
+# thermal zones in backend group order(GPU0,GPU1,LR), power_good is the
+# index in FpgaStatus.pwr_good_set() and channels the MAX31790 PWM outputs
+THERMAL_ZONES = [
+    {"name": "GPU0", "sensors": ["GPU0_TEMP","GPU0_HBM"], "channels": [0,1], "power_good": 0},
+    {"name": "GPU1", "sensors": ["GPU1_TEMP","GPU1_HBM"], "channels": [2,3], "power_good": 1},
+    {"name": "LR", "sensors": ["LR_TEMP"], "channels": [4], "power_good": 2},
+]
+# default fan control config, a JSON file given with --config overrides its
+# sections. The default curve is the former profile_get_value one: 60% of the
+# temperature below 35C, 120% above, clamped to 10-90%
+FAN_CONTROL_CONFIG = "/etc/openBMC/fan_control.json"
+DEFAULT_CONFIG = {
+    "curves": {"default": {"points": [[16,10],[17,10.2],[34,20.4],[35,42],[75,90]]}},
+    "zones": THERMAL_ZONES,
+}
+# MAX31790 PWM channels driven by each group(GPU0,GPU1,LR)
+PWM_GROUP_CHANNELS = [zone["channels"] for zone in THERMAL_ZONES]
+
 def max31790_set_pwm(slave_addr,offset,duty_cycle_percent,bus):
-    # full-scale is 511, see at MAX31790 spec P.35.
-    duty_cycle = duty_cycle_percent * 511 / 100
-    duty_cycle_word = duty_cycle << 7
-    bus.write_word_data(slave_addr,offset,duty_cycle_word)
-
-
-def pwm_reqest_set(GPU_type,duty_cycle_percent,bus,dbus_iface):
-    if GPU_type == 0:
-        # set pwm out1
-        max31790_set_pwm(MAX31790_7bit_ADDR, 0x40,duty_cycle_percent,bus)
-        time.sleep(0.001)
-        # set pwm out2
-        max31790_set_pwm(MAX31790_7bit_ADDR, 0x42,duty_cycle_percent,bus)
-        time.sleep(0.001)
-        set_dbus_data(0,"percent",duty_cycle_percent,dbus_iface)
-    elif GPU_type == 1:
-        # set pwm out3
-        max31790_set_pwm(MAX31790_7bit_ADDR, 0x44,duty_cycle_percent,bus)
-        time.sleep(0.001)
-        # set pwm out4
-        max31790_set_pwm(MAX31790_7bit_ADDR, 0x46,duty_cycle_percent,bus)
-        time.sleep(0.001)
-        set_dbus_data(1,"percent",duty_cycle_percent,dbus_iface)
-    elif GPU_type == 2:
-        # set pwm out5
-        max31790_set_pwm(MAX31790_7bit_ADDR, 0x48,duty_cycle_percent,bus)
-        time.sleep(0.001)
-        set_dbus_data(2,"percent",duty_cycle_percent,dbus_iface)
-    elif GPU_tyepe == 3:
-        # set pwm out1
-        max31790_set_pwm(MAX31790_7bit_ADDR, 0x40,duty_cycle_percent,bus)
-        time.sleep(0.001)
-        # set pwm out2
-        max31790_set_pwm(MAX31790_7bit_ADDR, 0x42,duty_cycle_percent,bus)
-        time.sleep(0.001)
-        # set pwm out3
-        max31790_set_pwm(MAX31790_7bit_ADDR, 0x44,duty_cycle_percent,bus)
-        time.sleep(0.001)
-        # set pwm out4
-        max31790_set_pwm(MAX31790_7bit_ADDR, 0x46,duty_cycle_percent,bus)
-        time.sleep(0.001)
-        # set pwm out5
-        max31790_set_pwm(MAX31790_7bit_ADDR, 0x48,duty_cycle_percent,bus)
-        time.sleep(0.001)
-        for i in range(3):
-            set_dbus_data(i,"percent",duty_cycle_percent,dbus_iface)
+    # write the channel of the register offset
+    channel = (offset - 0x40) // 2
+    fan = max31790_device(bus,slave_addr)
+    fan.set_pwm(channel,duty_cycle_percent)
+    fan.invalidate([channel])
+    fan.flush(bus)
+
 
+def pwm_reqest_set(GPU_type,duty_cycle_percent,bus,dbus_iface,user=None):
+    # GPU_type 0:GPU0, 1:GPU1, 2:LR, 3:ALL
+    # an interactive request: another writer may have changed the fans since,
+    # so the channels are always written and the percent always published.
+    # The shadow is shared with the control loop, the publish caches are its own.
+    groups = range(len(PWM_GROUP_CHANNELS)) if GPU_type == 3 else [GPU_type]
+    fan = max31790_device(bus,MAX31790_7bit_ADDR)
+    channels = [channel for group in groups for channel in PWM_GROUP_CHANNELS[group]]
+    for channel in channels:
+        fan.set_pwm(channel,duty_cycle_percent)
+    fan.invalidate(channels)
+    # the channels go out in as few block writes as possible, at the priority of bus
+    fan.flush(bus)
+    updates = [(group,"percent",duty_cycle_percent) for group in groups]
+    if user is not None:
+        updates += [(group,"user",user) for group in groups]
+    set_dbus_data_many(updates,dbus_iface)
+
+
+def dbus_client(dbus_iface):
+    # accept a DBusClient or a bare dbus interface
+    if isinstance(dbus_iface,DBusClient):
+        return dbus_iface
+    return DBusClient(dbus_iface)
 
 def set_dbus_data(GPU_index,type,data,dbus_iface):
     # set the data to dbus server database which can share with different threads
-    dbus_data = dbus_sync_call_signal_wrapper(dbus_iface,"set_data",{},data,type,GPU_index)
+    dbus_client(dbus_iface).call("set_data",data,type,GPU_index)
 
 def get_dbus_data(GPU_index,type,dbus_iface):
     # get the data from dbus server database which can share with different threads
-    dbus_data = dbus_sync_call_signal_wrapper(dbus_iface,"get_data",{},type,GPU_index)
-    if dbus_data:
-        val = unwrap(dbus_data)
-        # the return value is a list
-        return val[0]
+    return dbus_client(dbus_iface).call("get_data",type,GPU_index)
+
+def set_dbus_data_many(updates,dbus_iface):
+    # set a list of (GPU_index,type,data) atomically in one call
+    dbus_client(dbus_iface).call("set_many",[(type,index,data) for index,type,data in updates])
+
+def get_dbus_data_many(requests,dbus_iface):
+    # get a list of (GPU_index,type) in one call
+    return dbus_client(dbus_iface).call("get_many",[(type,index) for index,type in requests])
+
+def exchange_dbus_data(updates,requests,dbus_iface):
+    # set_dbus_data_many(updates) then get_dbus_data_many(requests) in one round trip
+    return dbus_client(dbus_iface).call("exchange",
+                                        [(type,index,data) for index,type,data in updates],
+                                        [(type,index) for index,type in requests])
+
+def get_all_dbus_data(dbus_iface):
+    # get every share data as {(GPU_index,type): data} in one call
+    return dict(((index,type),data) for type,index,data in dbus_client(dbus_iface).call("get_all"))
+
+def cas_dbus_user(swaps,dbus_iface):
+    # compare and swap a list of (GPU_index,expected,new) user set status, expected -1 matches any,
+    # return (swapped,previous) of each
+    return [(bool(swapped),previous) for swapped,previous in dbus_client(dbus_iface).call("cas_user",swaps)]
 
 
 def check_sxm_master_pwr_good(bus):
     '''check_sxm_master_pwr_gd() is used to check whether Mother Board power and FPGA_MASTER_PWM_EN are on to avoid throw out error message even if sxm is not ready.
         Out: 
-        -1 read FPGA failed.
-         0 SXM is ready.
-         1 SXM is not ready.
-         2 FPGA_MASTER_PWM_EN is not ready.
+        GPU0, GPU1 and LR pwr_good_set, all 0 when FPGA_MASTER_PWM_EN is low or the FPGA read failed.
+        The status window is read in a single block transaction, use read_fpga_status for the full snapshot.
     '''
-    pwr_good_set = [0,0,0] # represents GPU0, GPU1 and LR's pwr_good_set status
-    fpga_data = 0
-    try:
-        fpga_data = bus.read_byte_data(0x12,0x11)
-    except Exception as err:
-        print("Failed to read FPGA_MASTER_PWM_EN\n{}".format(str(err)))
-    #FPGA_MASTER_PWM_EN is low
-    FPGA_MASTER_PWM_EN = fpga_data & 0x01
-    if not FPGA_MASTER_PWM_EN:
-       return pwr_good_set[0],pwr_good_set[1],pwr_good_set[2]
-    #Check LR_PRSNT
-    lr_data = 0
-    try:
-        lr_data = bus.read_byte_data(0x12,0x0f)
-    except Exception as err:
-        print("Failed to read LR_PRSNT\n{}".format(str(err)))
-    pwr_good_set[2] = lr_data & 0x04
-    #Check GPU_PWR_GD
-    sxm_data = 0
-    try:
-        sxm_data = bus.read_byte_data(0x12,0x0d)
-    except Exception as err:
-        print("Failed to read GPU_PWR_GD\n{}".format(str(err)))
-    pwr_good_set[0] = sxm_data & 0x05
-    pwr_good_set[1] = sxm_data & 0x0a
-
-    return pwr_good_set[0],pwr_good_set[1],pwr_good_set[2]
-
-
-def profile_get_value(temp):
-    '''return the pwm percent based on input temperature'''
-    percent = 90 # profile's max value
-    if temp < 35:
-        percent = 60 * temp / 100
-        if percent > 90:
-            percent = 90
-        elif percent < 10:
-            percent = 10
-    else:
-        if temp < 100:
-            percent = 120 * temp / 100
-            if percent > 90:
-                percent = 90
-            elif percent < 10:
-                percent = 10
-    return percent
+    return read_fpga_status(bus).pwr_good_set()
+
+
+def sensor_table(poller_value,fan):
+    '''return the default polled sensors: FPGA status at 4 Hz, GPU temperature
+    at 2 Hz, LR temperature, fan tach and the HSC telemetry sweep at 1 Hz and
+    GPU power at 10 Hz. The GPU sensors are only read while the FPGA reports
+    the GPU as powered. The tachs are read through fan, the MAX31790 of the
+    control loop, whose shadow tells a stalled fan from a stopped one.'''
+    def gpu_powered(index):
+        return lambda: poller_value("FPGA_STATUS",FpgaStatus()).pwr_good_set()[index] != 0
+    sensors = [Sensor("FPGA_STATUS",0.25,read=read_fpga_status),
+               Sensor("LR_TEMP",1.0,read=lambda bus: bus.read_byte_data(TMP451_7bit_ADDR,0x01) - 64),
+               Sensor("FAN_TACH",1.0,read=lambda bus: fan.read_tach()),
+               Sensor("HSC",1.0,read=HscTelemetry().sweep)]
+    for index in range(SMPBI_MAX_GPUS):
+        address = SMBPBI_GPU_ADDR[index]
+        sensors.append(Sensor("GPU{}_TEMP".format(index),0.5,smbpbi=(address,gpu_temp_command),
+                              convert=smbpbi_temp,enabled=gpu_powered(index)))
+        sensors.append(Sensor("GPU{}_HBM".format(index),0.5,smbpbi=(address,hbm_temp_command),
+                              convert=smbpbi_temp,enabled=gpu_powered(index)))
+        sensors.append(Sensor("GPU{}_POWER".format(index),0.1,smbpbi=(address,gpu_power_command),
+                              convert=smbpbi_power,enabled=gpu_powered(index)))
+    return sensors
+
+
+def load_config(path=None):
+    '''return the fan control config, DEFAULT_CONFIG updated with the JSON file at path'''
+    config = dict(DEFAULT_CONFIG)
+    if path:
+        try:
+            with open(path) as f:
+                config.update(json.load(f))
+        except (IOError, ValueError) as err:
+            logging.error("failed to load fan control config {0}: {1}".format(path,err))
+    return config
 
 
 def i2c1_init():
-    return smbus.SMBus(I2C_BUS_NUM)
+    # the fan control runs at the highest priority of the bus arbiter
+    return i2c_arbiter(I2C_BUS_NUM).client(PRIORITY_CONTROL)
 
 class fan_control(object):
-    def __init__(self, bus=None,polling=True):
+    def __init__(self, bus=None,polling=True,interval=1000,thredhold=900,config=None,dbus_client=None):
         self.polling = polling
         self.bus = bus
-        self.thredhold = 900 # 900 ms to finish one 
-        # dbus client instance
-        self._dbus_iface = dbus.Interface(dbus.SystemBus().get_object('com.openBMC.RPI','/RPI'),'com.openBMC.RPI')
+        self.interval = interval # control period in ms
+        self.thredhold = thredhold # 900 ms to finish one 
+        # sensors are polled at their own rate while the control loop idles,
+        # at the telemetry priority; the control priority of bus is kept for
+        # the MAX31790 writes and tach reads of the control cycle
+        if isinstance(bus,ArbitratedBus):
+            self.poller = PollingEngine(bus.arbiter.client(PRIORITY_TELEMETRY))
+        else:
+            self.poller = PollingEngine(bus)
+        self.fan = max31790_device(bus if bus is not None else self.poller.session.bus,MAX31790_7bit_ADDR)
+        for sensor in sensor_table(self.poller.value,self.fan):
+            self.poller.add(sensor)
+        self.scheduler = PeriodicScheduler(self.interval / 1000.0,self.thredhold / 1000.0,
+                                           sleep=self.poller.sleep)
+        # dbus client instance, an in-process one in the daemon mode
+        self._dbus = dbus_client if dbus_client is not None else DBusClient()
+        # every zone of the table is evaluated in one pass per cycle, the fan
+        # curves are compiled once into lookup tables
+        self.config = config if config is not None else DEFAULT_CONFIG
+        curves = compile_curves(self.config)
+        zones = [ThermalZone.from_config(zone,zone_controller(zone,curves,self.interval / 1000.0,
+                                                              self._zone_rpm(zone["channels"])))
+                 for zone in self.config["zones"]]
+        self._published_rpm = [None] * MAX31790_CHANNELS
+        self._published_fan_status = [None] * MAX31790_CHANNELS
+        self._published_hsc = {}
+        # timestamp of the last reading published to the sensor cache
+        self._published_sample = {}
+        # power good of GPU0, GPU1 and LR seen by the last cycle
+        self._pwr_good = FpgaStatus().pwr_good_set()
+        self.engine = ThermalEngine(zones,
+                                    self.fan,
+                                    self.backend_exchange,
+                                    self.backend_set_many,
+                                    self.scheduler.expired)
+
 
+    def backend_exchange(self,updates,requests):
+        # a backend which doesn't answer must not stop the fans control,
+        # fall back to auto control with no previous duty cycle
+        try:
+            readings = self.sensor_readings()
+            if not readings:
+                return exchange_dbus_data(updates,requests,self._dbus)
+            # the new sensor readings are pipelined with the state exchange
+            return self._dbus.call_many([
+                ("publish_sensors",(readings,)),
+                ("exchange",([(type,index,data) for index,type,data in updates],
+                             [(type,index) for index,type in requests]))])[1]
+        except Exception as err:
+            logging.error("failed to exchange data with dbus server: {}".format(err))
+            return [0 if type == "user" else -1 for index,type in requests]
+
+    def backend_set_many(self,updates):
+        try:
+            set_dbus_data_many(updates,self._dbus)
+        except Exception as err:
+            logging.error("failed to set data to dbus server: {}".format(err))
+
+    def _zone_rpm(self,channels):
+        # measured speed of the zone fans for the zones in closed-loop RPM mode
+        def zone_rpm():
+            tach = self.poller.value("FAN_TACH",None)
+            return tach.zone_rpm(channels) if tach else -1
+        return zone_rpm
+
+    def sensor_readings(self):
+        # (name,value,timestamp) of the readings polled since the last publish
+        readings = []
+        for name in CACHED_SENSORS:
+            value,timestamp = self.poller.sample(name)
+            if timestamp is not None and timestamp != self._published_sample.get(name):
+                readings.append((name,float(value),timestamp))
+                self._published_sample[name] = timestamp
+        # the decoded HSC telemetry, HSC<index>_<VIN,VOUT,IOUT,PIN,TEMP,STATUS>
+        hsc,timestamp = self.poller.sample("HSC")
+        if timestamp is not None and timestamp != self._published_sample.get("HSC"):
+            readings += hsc.readings()
+            self._published_sample["HSC"] = timestamp
+        return readings
+
+    def fan_tach_updates(self,tach):
+        # dbus server updates of the fan speeds which moved and the status which changed
+        updates = []
+        for channel in range(MAX31790_CHANNELS):
+            status = tach.status[channel]
+            if self._published_fan_status[channel] != status:
+                if status != FAN_OK:
+                    print("FAN{0} is {1}, {2} RPM\n".format(channel,FAN_STATUS_NAMES[status],tach.rpm[channel]))
+                updates.append((channel,"fan_status",status))
+                self._published_fan_status[channel] = status
+            rpm = min(tach.rpm[channel],0x7fff)
+            last = self._published_rpm[channel]
+            if last is None or abs(rpm - last) >= RPM_PUBLISH_DEADBAND:
+                updates.append((channel,"rpm",rpm))
+                self._published_rpm[channel] = rpm
+        return updates
+
+    def hsc_updates(self,hsc):
+        # dbus server updates of the HSC power, temperature and STATUS_WORD which changed
+        updates = []
+        for index in range(len(HSC_ADDRESSES)):
+            values = hsc.values[index]
+            if values is None:
+                continue
+            status = int(values["STATUS"])
+            for type,value in (("hsc_power",int(round(values["PIN"]))),
+                               ("hsc_temp",int(round(values["TEMP"]))),
+                               ("hsc_status",status - 0x10000 if status & 0x8000 else status)):
+                if self._published_hsc.get((type,index)) != value:
+                    updates.append((index,type,value))
+                    self._published_hsc[(type,index)] = value
+        return updates
 
     def fan_ctrl_loop(self,):
-        start_point = datetime.now()
-        fail_times = [0,0,0] # GPU0 GPU1 LR fail time counter
+        self.poller.poll()
         while self.polling:
-            if interval_millis(start_point) >= 900:
-                GPU0_pwr_good_set,GPU1_pwr_good_set,LR_pwr_good_set = check_sxm_master_pwr_good(self.bus)
-                #print(GPU0_pwr_good_set,GPU1_pwr_good_set,LR_pwr_good_set)
-                ## GPU0 fan control ###########################################
-                duty_cycle_percent = get_dbus_data(0,"percent",self._dbus_iface) 
-                if GPU0_pwr_good_set == 0 :
-                    duty_cycle_percent = 20
-                elif get_dbus_data(0,"user",self._dbus_iface) == 0:
-                    # get GPU0 temp
-                    gpu = get_temp("GPU0_TEMP",self.bus)
-                    # get GPU0 HBM
-                    hbm = get_temp("GPU0_HBM",self.bus)
-                    if (gpu == -1) and (hbm == -1):
-                        fail_times[0] = fail_times[0] + 1
-                        if fail_times[0] == 5:
-                            print("GPU0 reading failed 5 times, set fan speed to 80%\n")
-                            duty_cycle_percent = 80
-                    else:
-                        temp = gpu if gpu >= hbm else hbm
-                        print("GPU0 temp is {}".format(temp))
-                        duty_cycle_percent = profile_get_value(temp)
-                        if fail_times[0] > 0:
-                            fail_times[0] = 0
-                            print("GPU0 reading recovered, and fan control enabled again!\n")
-                print("GPU0 duty percent is {}".format(duty_cycle_percent))
-                # update the percent to dbus server
-                pwm_reqest_set(0,duty_cycle_percent,self.bus,self._dbus_iface)
-
-                ## GPU1 fan control ############################################
-                duty_cycle_percent = get_dbus_data(1,"percent",self._dbus_iface) 
-                if GPU1_pwr_good_set == 0 :
-                    duty_cycle_percent = 20
-                elif get_dbus_data(1,"user",self._dbus_iface) == 0:
-                    # get GPU1 temp
-                    gpu = get_temp("GPU1_TEMP",self.bus)
-                    # get GPU1 HBM
-                    hbm = get_temp("GPU1_HBM",self.bus)
-                    if (gpu == -1) and (hbm == -1):
-                        fail_times[1] = fail_times[1] + 1
-                        if fail_times[1] == 5:
-                            print("GPU1 reading failed 5 times, set fan speed to 80%\n")
-                            duty_cycle_percent = 80
-                    else:
-                        temp = gpu if gpu >= hbm else hbm
-                        print("GPU1 temp is {}".format(temp))
-                        duty_cycle_percent = profile_get_value(temp)
-                        if fail_times[1] > 0:
-                            fail_times[1] = 0
-                            print("GPU1 reading recovered, and fan control enabled again!\n")
-                print("GPU1 duty percent is {}".format(duty_cycle_percent))
-                # update the percent to dbus server
-                pwm_reqest_set(1,duty_cycle_percent,self.bus,self._dbus_iface)
-                
-                ## LR fan control ##############################################
-                duty_cycle_percent = get_dbus_data(2,"percent",self._dbus_iface) 
-                if LR_pwr_good_set == 0 :
-                    duty_cycle_percent = 20
-                elif get_dbus_data(2,"user",self._dbus_iface) == 0:
-                    # get LR temp
-                    gpu = get_temp("LR_TEMP",self.bus)
-                    if (gpu == -1):
-                        fail_times[2] = fail_times[2] + 1
-                        if fail_times[2] == 5:
-                            print("LR reading failed 5 times, set fan speed to 80%\n")
-                            duty_cycle_percent = 80
-                    else:
-                        temp = gpu
-                        print("LR temp is {}".format(temp))
-                        duty_cycle_percent = profile_get_value(temp)
-                        if fail_times[2] > 0:
-                            fail_times[2] = 0
-                            print("LR reading recovered, and fan control enabled again!\n")
-                print("LR duty percent is {}".format(duty_cycle_percent))
-                # update the percent to dbus server
-                pwm_reqest_set(2,duty_cycle_percent,self.bus,self._dbus_iface)
-                
-                #update start point
-                start_point = datetime.now()
-
+            # sleep until the next tick of the fixed rate control period
+            tick = self.scheduler.wait()
+            if tick and tick % 60 == 0:
+                logging.info("fan control loop stats: {0}, temperatures deferred: {1}".format(
+                    self.scheduler.stats(),self.engine.deferred))
+                logging.info("sensor polling stats: {}".format(self.poller.stats()))
+                arbiter = getattr(self.poller.session.bus,"arbiter",None)
+                if arbiter:
+                    logging.info("i2c bus arbiter stats: {}".format(arbiter.stats()))
+            # latest values from the sensor poller, stale ones read back as -1
+            fpga_status = self.poller.value("FPGA_STATUS",FpgaStatus())
+            pwr_good = fpga_status.pwr_good_set()
+            for i in range(SMPBI_MAX_GPUS):
+                if pwr_good[i] and not self._pwr_good[i]:
+                    # what the GPU refused while it was booting is asked again
+                    self.poller.session.forget_unsupported(SMBPBI_GPU_ADDR[i])
+            self._pwr_good = pwr_good
+            # GPU power and fan tach ride on the exchange which reads the zones state
+            updates = []
+            for i in range(SMPBI_MAX_GPUS):
+                power = self.poller.value("GPU{}_POWER".format(i))
+                if power != -1:
+                    updates.append((i,"power",power))
+            tach = self.poller.value("FAN_TACH",None)
+            if tach:
+                updates += self.fan_tach_updates(tach)
+            hsc = self.poller.value("HSC",None)
+            if hsc:
+                updates += self.hsc_updates(hsc)
+            self.engine.evaluate(pwr_good,self.poller.value,updates)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="openBMC fan control")
+    parser.add_argument('-c','--config',default=None,
+                        help='fan control config in JSON, for example: {}'.format(FAN_CONTROL_CONFIG))
+    parser.add_argument('--debug',action='store_true',help='enable debugging messages')
+    args = parser.parse_args()
+    # the loop statistics are logged at info level
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s %(threadName)s %(levelname)s: %(message)s')
     i2c1 = i2c1_init()
     tmp451_init(i2c1)
-    loop_task = fan_control(i2c1)
+    loop_task = fan_control(i2c1,config=load_config(args.config))
     loop_task.fan_ctrl_loop()
    
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+import math
+from array import array
+
+# TMP451 extended range, the widest temperature range on the board
+CURVE_MIN_TEMP = -64
+CURVE_MAX_TEMP = 191
+
+# curve units: value range and array typecode of the compiled table
+CURVE_UNITS = {"percent": (0, 100, 'B'), "rpm": (0, 65535, 'H')}
+
+
+class FanCurve(object):
+    '''Fan curve compiled into a lookup table indexed by integer C.
+
+    points is a list of (temp, value) pairs, the value is linearly
+    interpolated between them, truncated to an integer like the integer
+    arithmetic of the former profile_get_value, and held flat outside of
+    them. value is a duty cycle percentage, or a target RPM with
+    unit="rpm". The table is an array built once, so a lookup is one clamp
+    and one index without any allocation.
+    '''
+
+    def __init__(self, points, min_temp=CURVE_MIN_TEMP, max_temp=CURVE_MAX_TEMP, unit="percent"):
+        points = sorted((float(temp), float(percent)) for temp, percent in points)
+        if not points:
+            raise ValueError("a fan curve needs at least one point")
+        self.points = points
+        self.min_temp = min_temp
+        self.max_temp = max_temp
+        self.unit = unit
+        self.low, self.high, typecode = CURVE_UNITS[unit]
+        self.table = array(typecode, [self._interpolate(temp) for temp in range(min_temp, max_temp + 1)])
+
+    def _interpolate(self, temp):
+        points = self.points
+        if temp <= points[0][0]:
+            percent = points[0][1]
+        elif temp >= points[-1][0]:
+            percent = points[-1][1]
+        else:
+            for (t0, p0), (t1, p1) in zip(points, points[1:]):
+                if t0 <= temp <= t1:
+                    percent = p0 + (p1 - p0) * (temp - t0) / (t1 - t0)
+                    break
+        # truncate, the epsilon keeps 12.0 computed as 11.999... at 12
+        return max(self.low, min(self.high, int(math.floor(percent + 1e-9))))
+
+    def __call__(self, temp):
+        temp = int(temp)
+        if temp < self.min_temp:
+            temp = self.min_temp
+        elif temp > self.max_temp:
+            temp = self.max_temp
+        return self.table[temp - self.min_temp]
+
+
+class HysteresisCurve(object):
+    '''Fan curve with hysteresis.
+
+    A rising temperature is followed at once, a falling one only once it has
+    dropped `hysteresis` degrees below the temperature that set the current
+    duty cycle, so a sensor flapping across a breakpoint does not make the
+    fans hunt.
+    '''
+
+    def __init__(self, curve, hysteresis=0):
+        self.curve = curve
+        self.hysteresis = hysteresis
+        self.temp = None
+
+    def __call__(self, temp):
+        if self.temp is None or temp > self.temp or temp <= self.temp - self.hysteresis:
+            self.temp = temp
+        return self.curve(self.temp)
+
+
+class PidController(object):
+    '''PID controller holding a temperature setpoint.
+
+    The output is the duty cycle percentage clamped to [min_percent,
+    max_percent]. The integral term is clamped to [-integral_limit,
+    integral_limit], max_percent by default, to avoid wind-up; it stays 0
+    with ki=0, so a P or PD controller has no bias. period is the control
+    period in seconds.
+    '''
+
+    def __init__(self, setpoint, kp, ki=0.0, kd=0.0, period=1.0,
+                 min_percent=10, max_percent=100, integral_limit=None):
+        self.setpoint = setpoint
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.period = period
+        self.min_percent = min_percent
+        self.max_percent = max_percent
+        self.integral_limit = max_percent if integral_limit is None else integral_limit
+        self.integral = 0.0
+        self.last_error = None
+
+    def reset(self):
+        self.integral = 0.0
+        self.last_error = None
+
+    def __call__(self, temp):
+        error = temp - self.setpoint
+        self.integral += self.ki * error * self.period
+        self.integral = max(-self.integral_limit, min(self.integral_limit, self.integral))
+        derivative = 0.0
+        if self.last_error is not None:
+            derivative = self.kd * (error - self.last_error) / self.period
+        self.last_error = error
+        percent = self.kp * error + self.integral + derivative
+        return int(round(max(self.min_percent, min(self.max_percent, percent))))
+
+
+class RpmLoop(object):
+    '''Closed loop on fan speed.
+
+    curve maps the temperature to a target RPM, measured() returns the
+    current RPM of the zone (-1 when unknown). The duty cycle is a PI term
+    on the RPM error; while the RPM is unknown the last duty cycle is held,
+    or max_percent before the first measurement.
+    '''
+
+    def __init__(self, curve, measured, kp=0.005, ki=0.002, period=1.0,
+                 min_percent=10, max_percent=100):
+        self.curve = curve
+        self.measured = measured
+        self.kp = kp
+        self.ki = ki
+        self.period = period
+        self.min_percent = min_percent
+        self.max_percent = max_percent
+        self.integral = None
+        self.percent = max_percent
+        self.target = None
+
+    def __call__(self, temp):
+        self.target = self.curve(temp)
+        rpm = self.measured()
+        if rpm == -1:
+            return self.percent
+        error = self.target - rpm
+        if self.integral is None:
+            self.integral = float(self.percent)
+        self.integral += self.ki * error * self.period
+        self.integral = max(self.min_percent, min(self.max_percent, self.integral))
+        percent = self.kp * error + self.integral
+        self.percent = int(round(max(self.min_percent, min(self.max_percent, percent))))
+        return self.percent
+
+
+def compile_curves(config):
+    '''compile the "curves" section of the fan control config, {name: FanCurve}'''
+    return dict((name, FanCurve(curve["points"], unit=curve.get("unit", "percent")))
+                for name, curve in config.get("curves", {}).items())
+
+
+def curve_max_percent(curves, name):
+    '''return the highest duty cycle of the percent curve name, or of the
+    default curve when name is an RPM curve, 100 when there is none'''
+    for curve in (curves.get(name), curves.get("default")):
+        if curve is not None and curve.unit == "percent":
+            return max(curve.table)
+    return 100
+
+
+def zone_controller(zone_config, curves, period=1.0, measured_rpm=None):
+    '''return the temperature -> duty cycle callable of one zone config,
+    measured_rpm() returns the zone RPM for zones in "rpm" mode. The closed
+    loops stay below the ceiling of the zone curve unless the zone config
+    gives its own max_percent.'''
+    ceiling = curve_max_percent(curves, zone_config.get("curve", "default"))
+    if zone_config.get("mode") == "rpm":
+        loop = zone_config.get("rpm_loop", {})
+        return RpmLoop(curves[zone_config["curve"]], measured_rpm,
+                       kp=loop.get("kp", 0.005), ki=loop.get("ki", 0.002), period=period,
+                       min_percent=loop.get("min_percent", 10),
+                       max_percent=loop.get("max_percent", ceiling))
+    pid = zone_config.get("pid")
+    if pid:
+        return PidController(pid["setpoint"], pid["kp"], pid.get("ki", 0.0), pid.get("kd", 0.0),
+                             period=period,
+                             min_percent=pid.get("min_percent", 10),
+                             max_percent=pid.get("max_percent", ceiling),
+                             integral_limit=pid.get("integral_limit"))
+    curve = curves[zone_config.get("curve", "default")]
+    return HysteresisCurve(curve, zone_config.get("hysteresis", 0))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+from openBMC.scheduler import monotonic
+
+FPGA_7bit_ADDR = 0x12
+# status window 0x0d-0x11 read in one block transaction
+FPGA_STATUS_BASE = 0x0d
+FPGA_STATUS_LEN = 5
+FPGA_GPU_PWR_GD_REG = 0x0d
+FPGA_LR_PRSNT_REG = 0x0f
+FPGA_MASTER_PWM_EN_REG = 0x11
+
+# bits of GPU_PWR_GD for GPU0/GPU1 and of LR_PRSNT
+GPU0_PWR_GD_MASK = 0x05
+GPU1_PWR_GD_MASK = 0x0a
+LR_PRSNT_MASK = 0x04
+MASTER_PWM_EN_MASK = 0x01
+
+
+class FpgaStatus(object):
+    '''Decoded snapshot of the FPGA status window.
+
+    raw holds the registers 0x0d-0x11, timestamp is the monotonic time of the
+    read. valid is False when the read failed, every flag is then False.
+    '''
+
+    def __init__(self, raw=None, timestamp=None):
+        self.timestamp = monotonic() if timestamp is None else timestamp
+        self.valid = raw is not None
+        self.raw = list(raw) if raw is not None else [0] * FPGA_STATUS_LEN
+        self.master_pwm_en = bool(self.reg(FPGA_MASTER_PWM_EN_REG) & MASTER_PWM_EN_MASK)
+        self.lr_present = bool(self.reg(FPGA_LR_PRSNT_REG) & LR_PRSNT_MASK)
+        sxm_data = self.reg(FPGA_GPU_PWR_GD_REG)
+        self.gpu_pwr_good = [bool(sxm_data & GPU0_PWR_GD_MASK), bool(sxm_data & GPU1_PWR_GD_MASK)]
+
+    def reg(self, offset):
+        return self.raw[offset - FPGA_STATUS_BASE]
+
+    def age(self, now=None):
+        return (monotonic() if now is None else now) - self.timestamp
+
+    def pwr_good_set(self):
+        '''return the GPU0, GPU1 and LR pwr_good_set values of check_sxm_master_pwr_good'''
+        if not self.master_pwm_en:
+            return 0,0,0
+        sxm_data = self.reg(FPGA_GPU_PWR_GD_REG)
+        return sxm_data & GPU0_PWR_GD_MASK, sxm_data & GPU1_PWR_GD_MASK, self.reg(FPGA_LR_PRSNT_REG) & LR_PRSNT_MASK
+
+    def __repr__(self):
+        return "FpgaStatus(valid={0}, master_pwm_en={1}, lr_present={2}, gpu_pwr_good={3}, raw={4})".format(
+            self.valid, self.master_pwm_en, self.lr_present, self.gpu_pwr_good,
+            " ".join("{0:02x}".format(x) for x in self.raw))
+
+
+def read_fpga_status(bus, address=FPGA_7bit_ADDR):
+    '''read the FPGA status window in a single block transaction'''
+    try:
+        raw = bus.read_i2c_block_data(address, FPGA_STATUS_BASE, FPGA_STATUS_LEN)
+    except Exception as err:
+        print("Failed to read FPGA status\n{}".format(str(err)))
+        raw = None
+    return FpgaStatus(raw)
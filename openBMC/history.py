@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+from array import array
+
+# (bucket length in seconds, number of buckets): 1 hour of 1 s, 1 day of
+# 1 min and 30 days of 1 h buckets per series
+HISTORY_TIERS = [(1, 3600), (60, 1440), (3600, 720)]
+
+
+class HistoryTier(object):
+    '''Fixed size ring of min/avg/max buckets of one resolution.
+
+    Samples are accumulated into the open bucket and the bucket is pushed to
+    the ring once a sample of a later bucket arrives. Storage is four
+    preallocated arrays, so memory is bounded by the capacity.
+    '''
+
+    def __init__(self, resolution, capacity):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.times = array('d', [0.0] * capacity)
+        self.mins = array('f', [0.0] * capacity)
+        self.avgs = array('f', [0.0] * capacity)
+        self.maxs = array('f', [0.0] * capacity)
+        self.head = 0
+        self.count = 0
+        # open bucket
+        self._bucket = None
+        self._min = self._max = self._sum = 0.0
+        self._n = 0
+
+    def add(self, timestamp, value):
+        bucket = int(timestamp // self.resolution)
+        if bucket != self._bucket:
+            self._close()
+            self._bucket = bucket
+            self._min = self._max = self._sum = float(value)
+            self._n = 1
+            return
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+        self._sum += value
+        self._n += 1
+
+    def _close(self):
+        if self._bucket is None:
+            return
+        self.times[self.head] = self._bucket * self.resolution
+        self.mins[self.head] = self._min
+        self.avgs[self.head] = self._sum / self._n
+        self.maxs[self.head] = self._max
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def oldest(self):
+        '''start time of the oldest bucket held, None when empty'''
+        if self._bucket is None:
+            return None
+        if self.count:
+            return self.times[(self.head - self.count) % self.capacity]
+        return self._bucket * self.resolution
+
+    def query(self, start, end):
+        '''return the (time, min, avg, max) buckets starting in [start, end]'''
+        result = []
+        for i in range(self.count):
+            index = (self.head - self.count + i) % self.capacity
+            t = self.times[index]
+            if start <= t <= end:
+                result.append((t, self.mins[index], self.avgs[index], self.maxs[index]))
+        if self._bucket is not None:
+            t = self._bucket * self.resolution
+            if start <= t <= end:
+                result.append((t, self._min, self._sum / self._n, self._max))
+        return result
+
+
+class SeriesHistory(object):
+    '''History of one series kept at every tier resolution.'''
+
+    def __init__(self, tiers=HISTORY_TIERS):
+        self.tiers = [HistoryTier(resolution, capacity) for resolution, capacity in tiers]
+
+    def add(self, timestamp, value):
+        for tier in self.tiers:
+            tier.add(timestamp, value)
+
+    def query(self, start, end, resolution=0):
+        '''return the buckets of [start, end] from the finest tier which is at
+        least `resolution` seconds and still holds data back to start, or
+        everything recorded so far'''
+        candidates = [tier for tier in self.tiers if tier.resolution >= resolution] or self.tiers[-1:]
+        for tier in candidates:
+            oldest = tier.oldest()
+            # a tier which never wrapped still holds everything recorded
+            if oldest is not None and (oldest <= start or tier.count < tier.capacity):
+                return tier.query(start, end)
+        return candidates[-1].query(start, end)
+
+
+class BoardHistory(object):
+    '''Time series store of every sensor and PWM value of the board.
+
+    sample() records the current value of each series; values of -1 (not
+    read yet) are skipped. series maps a name to a callable returning the
+    current value.
+    '''
+
+    def __init__(self, series, tiers=HISTORY_TIERS):
+        self.series = series
+        self.history = dict((name, SeriesHistory(tiers)) for name in series)
+
+    def names(self):
+        return sorted(self.series)
+
+    def sample(self, timestamp):
+        for name, current in self.series.items():
+            value = current()
+            if value != -1:
+                self.history[name].add(timestamp, value)
+
+    def query(self, name, start, end, resolution=0):
+        return self.history[name].query(start, end, resolution)
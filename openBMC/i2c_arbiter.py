@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+import errno
+import fcntl
+import heapq
+import itertools
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from openBMC.scheduler import monotonic
+
+# lower runs first: the fan control loop, then the sensor telemetry, then
+# what a human typed into a shell
+PRIORITY_CONTROL = 0
+PRIORITY_TELEMETRY = 1
+PRIORITY_INTERACTIVE = 2
+PRIORITY_NAMES = {PRIORITY_CONTROL: "control",
+                  PRIORITY_TELEMETRY: "telemetry",
+                  PRIORITY_INTERACTIVE: "interactive"}
+
+# every process using the bus takes this lock around its transactions
+I2C_LOCK_PATH = "/run/lock/openBMC-i2c-{}.lock"
+
+
+class I2cArbiter(object):
+    '''Owner of one I2C bus, granting it to one batch of transactions at a time.
+
+    A batch runs inside hold(priority); waiting batches are granted in
+    priority order, first come first served within a priority. Holds are
+    reentrant per thread, so a multi-step sequence (an SMBPBI request, a
+    MAX31790 flush) wrapping single transactions stays one atomic batch.
+    Between processes the bus is also serialized by an flock on
+    I2C_LOCK_PATH, which gives mutual exclusion but no priority; run the
+    actors in one process for strict priority.
+    '''
+
+    def __init__(self, bus_num=1, bus=None, lock_path=I2C_LOCK_PATH):
+        self.bus_num = bus_num
+        if bus is None:
+            import smbus
+            bus = smbus.SMBus(bus_num)
+        self.bus = bus
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._owner = None
+        self._depth = 0
+        self._held_since = None
+        self._lock_file = None
+        if lock_path:
+            path = lock_path.format(bus_num)
+            try:
+                self._lock_file = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+            except OSError as err:
+                logging.warning("no inter-process lock of i2c-{0}, {1}: {2}".format(bus_num, path, err))
+        # statistics
+        self.max_depth = 0
+        self.batches = dict((priority, 0) for priority in PRIORITY_NAMES)
+        self.wait_total = dict((priority, 0.0) for priority in PRIORITY_NAMES)
+        self.wait_max = dict((priority, 0.0) for priority in PRIORITY_NAMES)
+        self.hold_max = 0.0
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE):
+        me = threading.current_thread()
+        with self._cond:
+            if self._owner is me:
+                self._depth += 1
+                return
+            start = monotonic()
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            if len(self._waiting) > self.max_depth:
+                self.max_depth = len(self._waiting)
+            try:
+                while self._owner is not None or self._waiting[0] != ticket:
+                    self._cond.wait()
+            except BaseException:
+                # leave the queue, the next ticket may be at the head now
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._owner = me
+            self._depth = 1
+        if self._lock_file is not None:
+            try:
+                self._flock(fcntl.LOCK_EX)
+            except BaseException:
+                # give the bus back, or every later client waits forever
+                with self._cond:
+                    self._owner = None
+                    self._depth = 0
+                    self._cond.notify_all()
+                raise
+        now = monotonic()
+        wait = now - start
+        self.batches[priority] = self.batches.get(priority, 0) + 1
+        self.wait_total[priority] = self.wait_total.get(priority, 0.0) + wait
+        if wait > self.wait_max.get(priority, 0.0):
+            self.wait_max[priority] = wait
+        self._held_since = now
+
+    def _flock(self, operation):
+        while True:
+            try:
+                return fcntl.flock(self._lock_file, operation)
+            except (IOError, OSError) as err:
+                # python2 doesn't retry a call interrupted by a signal
+                if err.errno != errno.EINTR:
+                    raise
+
+    def release(self):
+        with self._cond:
+            if self._owner is not threading.current_thread():
+                raise RuntimeError("i2c-{} released by a thread which doesn't hold it".format(self.bus_num))
+            self._depth -= 1
+            if self._depth:
+                return
+            if self._lock_file is not None:
+                self._flock(fcntl.LOCK_UN)
+            held = monotonic() - self._held_since
+            if held > self.hold_max:
+                self.hold_max = held
+            self._owner = None
+            self._cond.notify_all()
+
+    @contextmanager
+    def hold(self, priority=PRIORITY_INTERACTIVE):
+        '''run the enclosed transactions as one batch of the given priority'''
+        self.acquire(priority)
+        try:
+            yield self.bus
+        finally:
+            self.release()
+
+    def run(self, priority, batch, *args):
+        '''run batch(bus, *args) as one batch, return its result'''
+        with self.hold(priority) as bus:
+            return batch(bus, *args)
+
+    def client(self, priority):
+        '''return an smbus compatible view of the bus at the given priority'''
+        return ArbitratedBus(self, priority)
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._waiting)
+
+    def stats(self):
+        '''return the queue depth and, per priority, the batches and wait times in ms'''
+        stats = {"queue_depth": self.queue_depth(),
+                 "max_queue_depth": self.max_depth,
+                 "hold_max": self.hold_max * 1000}
+        for priority, name in PRIORITY_NAMES.items():
+            batches = self.batches.get(priority, 0)
+            stats[name] = {"batches": batches,
+                           "wait_avg": self.wait_total.get(priority, 0.0) * 1000 / batches if batches else 0.0,
+                           "wait_max": self.wait_max.get(priority, 0.0) * 1000}
+        return stats
+
+
+class ArbitratedBus(object):
+    '''smbus.SMBus look-alike running every transaction through an I2cArbiter.
+
+    Code written against a plain bus keeps working; hold() groups several
+    transactions into one batch.
+    '''
+
+    def __init__(self, arbiter, priority):
+        self.arbiter = arbiter
+        self.priority = priority
+
+    def hold(self):
+        return self.arbiter.hold(self.priority)
+
+    def _run(self, name, *args):
+        with self.arbiter.hold(self.priority) as bus:
+            return getattr(bus, name)(*args)
+
+    def write_quick(self, address):
+        return self._run("write_quick", address)
+
+    def read_byte(self, address):
+        return self._run("read_byte", address)
+
+    def write_byte(self, address, value):
+        return self._run("write_byte", address, value)
+
+    def read_byte_data(self, address, register):
+        return self._run("read_byte_data", address, register)
+
+    def write_byte_data(self, address, register, value):
+        return self._run("write_byte_data", address, register, value)
+
+    def read_word_data(self, address, register):
+        return self._run("read_word_data", address, register)
+
+    def write_word_data(self, address, register, value):
+        return self._run("write_word_data", address, register, value)
+
+    def read_i2c_block_data(self, address, register, length=32):
+        return self._run("read_i2c_block_data", address, register, length)
+
+    def write_i2c_block_data(self, address, register, data):
+        return self._run("write_i2c_block_data", address, register, data)
+
+
+@contextmanager
+def bus_hold(bus):
+    '''hold an arbitrated bus for a multi-step sequence, no-op on a plain bus'''
+    hold = getattr(bus, 'hold', None)
+    if hold is None:
+        yield bus
+    else:
+        with hold():
+            yield bus
+
+
+_arbiters = {}
+
+def i2c_arbiter(bus_num=1):
+    '''return the arbiter shared by every user of the given bus in this process'''
+    arbiter = _arbiters.get(bus_num)
+    if arbiter is None:
+        arbiter = I2cArbiter(bus_num)
+        _arbiters[bus_num] = arbiter
+    return arbiter
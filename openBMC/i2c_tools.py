@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import errno
+
+# the range i2cdetect scans by default, 0x00-0x02 and 0x78-0x7f are reserved
+I2C_PROBE_FIRST = 0x03
+I2C_PROBE_LAST = 0x77
+# ranges i2cdetect probes with a read instead of a quick write in auto mode,
+# a quick write could corrupt an EEPROM or lock up some sensors
+I2C_PROBE_READ_RANGES = [(0x30, 0x37), (0x50, 0x5f)]
+# largest SMBus block transfer
+I2C_BLOCK_MAX = 32
+
+I2C_PROBE_MODES = ("auto", "quick", "read")
+I2C_DUMP_MODES = ("b", "w", "i")
+
+
+def i2c_probe(bus, first=I2C_PROBE_FIRST, last=I2C_PROBE_LAST, mode="auto"):
+    '''probe the addresses first-last, return {address: "ack" or "busy"} of
+    those which answered, busy meaning claimed by a kernel driver'''
+    if mode not in I2C_PROBE_MODES:
+        raise ValueError("probe mode must be one of {}".format(", ".join(I2C_PROBE_MODES)))
+    found = {}
+    for address in range(first, last + 1):
+        read = mode == "read" or (mode == "auto" and
+                                  any(low <= address <= high for low, high in I2C_PROBE_READ_RANGES))
+        try:
+            if read:
+                bus.read_byte(address)
+            else:
+                bus.write_quick(address)
+            found[address] = "ack"
+        except (IOError, OSError) as err:
+            if err.errno == errno.EBUSY:
+                found[address] = "busy"
+    return found
+
+
+def i2c_probe_table(found, first=I2C_PROBE_FIRST, last=I2C_PROBE_LAST):
+    '''render a probe result like i2cdetect'''
+    lines = ["     " + "".join("{0:x}  ".format(column) for column in range(16)).rstrip()]
+    for row in range(0, 0x80, 16):
+        cells = []
+        for address in range(row, row + 16):
+            if address < first or address > last:
+                cells.append("  ")
+            elif address in found:
+                cells.append("UU" if found[address] == "busy" else "{0:02x}".format(address))
+            else:
+                cells.append("--")
+        lines.append(("{0:02x}: ".format(row) + " ".join(cells)).rstrip())
+    return "\n".join(lines) + "\n"
+
+
+def i2c_dump(bus, address, first=0x00, last=0xff, mode="b"):
+    '''read the registers first-last of a device, return {register: value},
+    registers which failed to read are missing.
+
+    Like i2cdump, byte mode reads every register with a byte read and word
+    mode with a word read. Block mode "i" reads I2C blocks of up to 32
+    bytes, a chunk whose block read fails is read again byte by byte; only
+    use it on a device which auto-increments its register pointer, on
+    other parts a block read succeeds with the wrong values.
+    '''
+    if mode not in I2C_DUMP_MODES:
+        raise ValueError("dump mode must be one of {}".format(", ".join(I2C_DUMP_MODES)))
+    values = {}
+    if mode != "i":
+        read = bus.read_word_data if mode == "w" else bus.read_byte_data
+        for register in range(first, last + 1):
+            try:
+                values[register] = read(address, register)
+            except (IOError, OSError):
+                pass
+        return values
+    for start in range(first, last + 1, I2C_BLOCK_MAX):
+        length = min(I2C_BLOCK_MAX, last + 1 - start)
+        try:
+            block = bus.read_i2c_block_data(address, start, length)
+            if len(block) != length:
+                raise IOError("short block read")
+            for offset, value in enumerate(block):
+                values[start + offset] = value
+        except (IOError, OSError):
+            for register in range(start, start + length):
+                try:
+                    values[register] = bus.read_byte_data(address, register)
+                except (IOError, OSError):
+                    pass
+    return values
+
+
+def i2c_dump_table(values, first=0x00, last=0xff, mode="b"):
+    '''render a dump result like i2cdump, XX for the registers which failed'''
+    if mode == "w":
+        lines = ["     " + " ".join("{0:x},{1:x} ".format(column, column + 8) for column in range(8)).rstrip()]
+        for row in range(first - first % 8, last + 1, 8):
+            cells = []
+            for register in range(row, row + 8):
+                if register < first or register > last:
+                    cells.append("    ")
+                elif register in values:
+                    cells.append("{0:04x}".format(values[register]))
+                else:
+                    cells.append("XXXX")
+            lines.append("{0:02x}: ".format(row) + " ".join(cells))
+        return "\n".join(lines) + "\n"
+    lines = ["     " + " ".join("{0:x} ".format(column) for column in range(16)) + "   0123456789abcdef"]
+    for row in range(first - first % 16, last + 1, 16):
+        cells = []
+        text = ""
+        for register in range(row, row + 16):
+            if register < first or register > last:
+                cells.append("  ")
+                text += " "
+            elif register in values:
+                value = values[register]
+                cells.append("{0:02x}".format(value))
+                text += chr(value) if 0x20 <= value < 0x7f else "."
+            else:
+                cells.append("XX")
+                text += "X"
+        lines.append("{0:02x}: ".format(row) + " ".join(cells) + "    " + text)
+    return "\n".join(lines) + "\n"
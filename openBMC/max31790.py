@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+from openBMC.scheduler import monotonic
+from openBMC.i2c_arbiter import bus_hold
+
+MAX31790_7bit_ADDR = 0x2C
+MAX31790_CHANNELS = 6
+# PWMOUT target duty cycle registers, two bytes per channel starting at 0x40
+MAX31790_PWM_TARGET_BASE = 0x40
+# full-scale is 511, see at MAX31790 spec P.35.
+MAX31790_PWM_FULL_SCALE = 511
+# fan dynamics registers, speed range in bits 7:5
+MAX31790_FAN_DYNAMICS_BASE = 0x08
+MAX31790_SPEED_RANGES = [1, 2, 4, 8, 16, 32, 32, 32]
+# fan fault status 1 (0x11) up to TACH6 count LSB (0x23) in one block read
+MAX31790_FAULT_STATUS1 = 0x11
+MAX31790_TACH_COUNT_BASE = 0x18
+MAX31790_TACH_WINDOW_LEN = MAX31790_TACH_COUNT_BASE + 2 * MAX31790_CHANNELS - MAX31790_FAULT_STATUS1
+# 11 bits tach count, the maximum means no tach pulse at all
+MAX31790_TACH_COUNT_MAX = 0x7ff
+
+# fan status reported per channel
+FAN_OK = 0
+FAN_STALLED = 1
+FAN_FAILED = 2
+FAN_STATUS_NAMES = {FAN_OK: "ok", FAN_STALLED: "stalled", FAN_FAILED: "failed"}
+
+
+def max31790_pwm_word(duty_cycle_percent):
+    '''return the target duty cycle word of a percentage'''
+    duty_cycle = int(duty_cycle_percent * MAX31790_PWM_FULL_SCALE / 100)
+    return duty_cycle << 7
+
+
+def max31790_tach_rpm(count, speed_range=4, pulses=2):
+    '''convert a tach count to RPM, see at MAX31790 spec P.17.'''
+    if count <= 0 or count >= MAX31790_TACH_COUNT_MAX:
+        return 0
+    return 60 * speed_range * 8192 // (pulses * count)
+
+
+class FanTach(object):
+    '''Snapshot of the six tach inputs: rpm, status and the raw fault bits.'''
+
+    def __init__(self, rpm, status, fault, timestamp=None):
+        self.rpm = rpm
+        self.status = status
+        self.fault = fault
+        self.timestamp = monotonic() if timestamp is None else timestamp
+
+    def zone_rpm(self, channels):
+        '''return the average RPM of the given channels, -1 if none is ok'''
+        rpm = [self.rpm[channel] for channel in channels if self.status[channel] == FAN_OK]
+        return sum(rpm) // len(rpm) if rpm else -1
+
+    def __repr__(self):
+        return "FanTach(rpm={0}, status={1})".format(self.rpm, [FAN_STATUS_NAMES[x] for x in self.status])
+
+
+class MAX31790(object):
+    '''MAX31790 fan controller with a shadow copy of the PWM target registers.
+
+    set_pwm() only stages a value; flush() writes the channels whose value
+    differs from what was last written. Dirty channels that are adjacent, or
+    separated by a single clean channel, are written as one auto-incrementing
+    block transaction carrying the same bytes the per-channel word writes
+    would have sent. The shadow is dropped every `resync_every` flushes so a
+    fan board which lost its registers is brought back in line.
+    '''
+
+    def __init__(self, bus, address=MAX31790_7bit_ADDR, resync_every=60,
+                 pulses=2, min_rpm=500, min_percent=30):
+        self.bus = bus
+        self.address = address
+        self.resync_every = resync_every
+        # tach pulses per revolution of the fans
+        self.pulses = pulses
+        # a fan driven at min_percent or more which runs below min_rpm is failed
+        self.min_rpm = min_rpm
+        self.min_percent = min_percent
+        # speed range of each channel, read from the fan dynamics registers once
+        self.speed_ranges = None
+        # words last written to the part, None is unknown
+        self._shadow = [None] * MAX31790_CHANNELS
+        # words requested but not written yet
+        self._staged = [None] * MAX31790_CHANNELS
+        self._flushes = 0
+        # True when the last flush dropped the shadow and rewrote everything
+        self.resynced = False
+        self.writes = 0
+
+    def set_pwm(self, channel, duty_cycle_percent):
+        self._staged[channel] = max31790_pwm_word(duty_cycle_percent)
+
+    def get_pwm(self, channel):
+        '''return the last written duty cycle percentage, None if unknown'''
+        word = self._shadow[channel]
+        if word is None:
+            return None
+        return (word >> 7) * 100.0 / MAX31790_PWM_FULL_SCALE
+
+    def invalidate(self, channels=None):
+        '''forget what was written to the channels, all of them by default,
+        so the next flush writes them whatever their value'''
+        if channels is None:
+            self._shadow = [None] * MAX31790_CHANNELS
+            return
+        for channel in channels:
+            self._shadow[channel] = None
+
+    def _known(self, channel):
+        return self._staged[channel] is not None or self._shadow[channel] is not None
+
+    def _dirty(self):
+        return [channel for channel in range(MAX31790_CHANNELS)
+                if self._staged[channel] is not None and self._staged[channel] != self._shadow[channel]]
+
+    def flush(self, bus=None):
+        '''write the changed channels, return the number of bus transactions.
+        bus is the client to write through, the driver's one by default'''
+        bus = self.bus if bus is None else bus
+        # all the blocks of one flush go out as one batch of an arbitrated bus
+        with bus_hold(bus):
+            return self._flush(bus)
+
+    def _flush(self, bus):
+        self._flushes += 1
+        self.resynced = bool(self.resync_every) and self._flushes % self.resync_every == 0
+        if self.resynced:
+            self.invalidate()
+        dirty = self._dirty()
+        # group dirty channels into runs, bridging gaps of one clean channel
+        runs = []
+        for channel in dirty:
+            gap = channel - runs[-1][1] if runs else None
+            if gap == 1 or (gap == 2 and self._known(channel - 1)):
+                runs[-1][1] = channel
+            else:
+                runs.append([channel, channel])
+        transactions = 0
+        for first, last in runs:
+            words = []
+            for channel in range(first, last + 1):
+                word = self._staged[channel]
+                if word is None:
+                    word = self._shadow[channel]
+                words.append(word)
+            offset = MAX31790_PWM_TARGET_BASE + 2 * first
+            try:
+                if len(words) == 1:
+                    bus.write_word_data(self.address, offset, words[0])
+                else:
+                    block = []
+                    for word in words:
+                        block.append(word & 0xff)
+                        block.append((word >> 8) & 0xff)
+                    bus.write_i2c_block_data(self.address, offset, block)
+            except Exception:
+                for channel in range(first, last + 1):
+                    self._shadow[channel] = None
+                raise
+            for channel, word in zip(range(first, last + 1), words):
+                self._shadow[channel] = word
+            transactions += 1
+        self.writes += transactions
+        return transactions
+
+
+    def _read_speed_ranges(self):
+        try:
+            dynamics = self.bus.read_i2c_block_data(self.address, MAX31790_FAN_DYNAMICS_BASE, MAX31790_CHANNELS)
+            self.speed_ranges = [MAX31790_SPEED_RANGES[(x >> 5) & 0x07] for x in dynamics]
+        except Exception as err:
+            print("Failed to read MAX31790 fan dynamics, assume speed range 4\n{}".format(str(err)))
+            self.speed_ranges = [4] * MAX31790_CHANNELS
+
+    def read_tach(self):
+        '''read the fault status and all tach counts in one block, return a FanTach'''
+        if self.speed_ranges is None:
+            self._read_speed_ranges()
+        window = self.bus.read_i2c_block_data(self.address, MAX31790_FAULT_STATUS1, MAX31790_TACH_WINDOW_LEN)
+        fault = window[0] & 0x3f
+        rpm = []
+        status = []
+        for channel in range(MAX31790_CHANNELS):
+            offset = MAX31790_TACH_COUNT_BASE - MAX31790_FAULT_STATUS1 + 2 * channel
+            count = ((window[offset] << 8) | window[offset + 1]) >> 5
+            rpm.append(max31790_tach_rpm(count, self.speed_ranges[channel], self.pulses))
+            percent = self.get_pwm(channel)
+            if fault & (1 << channel) or (count >= MAX31790_TACH_COUNT_MAX and percent):
+                status.append(FAN_STALLED)
+            elif percent is not None and percent >= self.min_percent and rpm[-1] < self.min_rpm:
+                status.append(FAN_FAILED)
+            else:
+                status.append(FAN_OK)
+        return FanTach(rpm, status, fault)
+
+
+_devices = {}
+
+def _bus_key(bus):
+    # the clients of one arbiter, whatever their priority, are one bus
+    arbiter = getattr(bus, "arbiter", None)
+    return bus if arbiter is None else arbiter.bus_num
+
+
+def max31790_device(bus, address=MAX31790_7bit_ADDR):
+    '''return the MAX31790 driver shared by every caller of the given bus.
+
+    The clients of one arbiter share one driver and so one shadow; the
+    driver keeps the client of its first caller, other callers pass theirs
+    to flush() to write at their own priority.
+    '''
+    key = (_bus_key(bus), address)
+    device = _devices.get(key)
+    if device is None:
+        device = MAX31790(bus, address)
+        _devices[key] = device
+    return device
+
+
+def max31790_invalidate(address=MAX31790_7bit_ADDR):
+    '''drop the shadow of every driver of the part in this process after its
+    registers were written behind their back'''
+    for (bus, device_address), device in list(_devices.items()):
+        if device_address == address:
+            device.invalidate()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+from openBMC.i2c_arbiter import bus_hold
+from openBMC.scheduler import monotonic
+
+# PMBus commands
+PMBUS_VOUT_MODE = 0x20
+PMBUS_STATUS_WORD = 0x79
+PMBUS_READ_VIN = 0x88
+PMBUS_READ_VOUT = 0x8b
+PMBUS_READ_IOUT = 0x8c
+PMBUS_READ_TEMPERATURE_1 = 0x8d
+PMBUS_READ_PIN = 0x97
+
+# hot-swap controllers of the board, HSC0-HSC3
+HSC_ADDRESSES = [0x40, 0x42, 0x44, 0x46]
+# decoded readings of a HSC: name, command, unit; VOUT is LINEAR16, the
+# others LINEAR11
+HSC_READINGS = [("VIN", PMBUS_READ_VIN, "V"),
+                ("VOUT", PMBUS_READ_VOUT, "V"),
+                ("IOUT", PMBUS_READ_IOUT, "A"),
+                ("PIN", PMBUS_READ_PIN, "W"),
+                ("TEMP", PMBUS_READ_TEMPERATURE_1, "C")]
+# sensor cache names of a HSC are HSC<index>_<kind>
+HSC_SENSOR_KINDS = [reading[0] for reading in HSC_READINGS] + ["STATUS"]
+# STATUS_WORD bits, high byte first
+STATUS_WORD_BITS = [(15, "VOUT"), (14, "IOUT_POUT"), (13, "INPUT"), (12, "MFR"),
+                    (11, "POWER_GOOD#"), (10, "FANS"), (9, "OTHER"), (8, "UNKNOWN"),
+                    (7, "BUSY"), (6, "OFF"), (5, "VOUT_OV"), (4, "IOUT_OC"),
+                    (3, "VIN_UV"), (2, "TEMPERATURE"), (1, "CML"), (0, "NONE_OF_THE_ABOVE")]
+
+
+def _signed(value, bits):
+    return value - (1 << bits) if value & (1 << (bits - 1)) else value
+
+
+def linear11(word):
+    '''decode a PMBus LINEAR11 word: 5 bits signed exponent, 11 bits signed mantissa'''
+    return _signed(word & 0x7ff, 11) * 2.0 ** _signed(word >> 11, 5)
+
+
+def linear16(word, vout_mode):
+    '''decode a PMBus LINEAR16 word, the unsigned mantissa of VOUT scaled by
+    the signed exponent in the low 5 bits of VOUT_MODE'''
+    if vout_mode >> 5:
+        raise ValueError("VOUT_MODE 0x{0:02x} is not linear".format(vout_mode))
+    return word * 2.0 ** _signed(vout_mode & 0x1f, 5)
+
+
+def status_names(word):
+    '''return the names of the STATUS_WORD bits which are set'''
+    return [name for bit, name in STATUS_WORD_BITS if word & (1 << bit)]
+
+
+def read_hsc(bus, address, vout_mode=None):
+    '''read one HSC in one bus batch, return {reading: value} with STATUS the
+    raw STATUS_WORD and VOUT_MODE the mode used for VOUT'''
+    with bus_hold(bus):
+        if vout_mode is None:
+            vout_mode = bus.read_byte_data(address, PMBUS_VOUT_MODE)
+        values = {"VOUT_MODE": vout_mode,
+                  "STATUS": bus.read_word_data(address, PMBUS_STATUS_WORD)}
+        for name, command, unit in HSC_READINGS:
+            word = bus.read_word_data(address, command)
+            values[name] = linear16(word, vout_mode) if command == PMBUS_READ_VOUT else linear11(word)
+    return values
+
+
+class HscTelemetry(object):
+    '''Telemetry of every HSC of the board, read in one sweep.
+
+    sweep(bus) reads VIN, VOUT, IOUT, PIN, temperature and STATUS_WORD of
+    each controller, one bus batch per controller, and keeps the decoded
+    values with the time they were read. VOUT_MODE is read once per
+    controller. A controller which doesn't answer keeps its last values and
+    timestamp; the sweep fails only when none answered, so it can be a
+    PollingEngine sensor.
+    '''
+
+    def __init__(self, addresses=HSC_ADDRESSES, clock=monotonic):
+        self.addresses = addresses
+        self.clock = clock
+        self.values = [None] * len(addresses)
+        self.timestamps = [None] * len(addresses)
+        self.failures = [0] * len(addresses)
+        self._vout_mode = [None] * len(addresses)
+
+    def sweep(self, bus):
+        errors = []
+        for index, address in enumerate(self.addresses):
+            try:
+                values = read_hsc(bus, address, self._vout_mode[index])
+            except (IOError, OSError, ValueError) as err:
+                self.failures[index] += 1
+                errors.append("HSC{0} 0x{1:02x}: {2}".format(index, address, err))
+                continue
+            self._vout_mode[index] = values["VOUT_MODE"]
+            self.values[index] = values
+            self.timestamps[index] = self.clock()
+        if len(errors) == len(self.addresses):
+            raise IOError("; ".join(errors))
+        return self
+
+    def readings(self):
+        '''return (sensor name, value, timestamp) of every reading, e.g. HSC0_PIN'''
+        readings = []
+        for index, values in enumerate(self.values):
+            if values is None:
+                continue
+            for kind in HSC_SENSOR_KINDS:
+                readings.append(("HSC{0}_{1}".format(index, kind), float(values[kind]), self.timestamps[index]))
+        return readings
+
+    def total_power(self):
+        '''input power of the board in W, the sum of the HSCs read so far'''
+        return sum(values["PIN"] for values in self.values if values is not None)
+
+
+def format_hsc(index, address, values):
+    '''render the readings of one HSC'''
+    lines = "HSC{0} 0x{1:02x}:".format(index, address)
+    for name, command, unit in HSC_READINGS:
+        lines += "  {0} {1:.3f} {2}".format(name, values[name], unit)
+    status = int(values["STATUS"])
+    lines += "\n      STATUS_WORD 0x{0:04x} {1}\n".format(status, " ".join(status_names(status)) or "ok")
+    return lines
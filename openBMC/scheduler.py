@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import time
+
+# clock id of clock_gettime(2) on Linux
+CLOCK_MONOTONIC = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def _clock_gettime_monotonic():
+    '''return a CLOCK_MONOTONIC reader through clock_gettime of the C
+    library, for python2 which has no time.monotonic'''
+    libc = ctypes.CDLL(ctypes.util.find_library("rt") or ctypes.util.find_library("c"), use_errno=True)
+    clock_gettime = libc.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+    def monotonic():
+        # one timespec per call, the clock is read from several threads
+        ts = _timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic
+
+
+# monotonic clock, immune to wall clock steps from NTP or the user
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    try:
+        monotonic = _clock_gettime_monotonic()
+        monotonic()
+    except (OSError, AttributeError, TypeError) as err:
+        logging.warning("no monotonic clock ({}), the control loops follow wall clock steps".format(err))
+        monotonic = time.time
+
+
+class PeriodicScheduler(object):
+    '''Fixed rate, drift free tick source for the control loops.
+
+    Tick n is due at start + n * period, computed from the start point rather
+    than from the end of the previous cycle, so the period never drifts. The
+    caller sleeps in wait() instead of spinning. A cycle that runs past its
+    budget is counted as an overrun, and ticks that were missed entirely are
+    skipped instead of being run back to back. Wake-up jitter (actual wake
+    time minus the scheduled tick) is recorded for stats().
+    '''
+
+    def __init__(self, period, budget=None, clock=monotonic, sleep=time.sleep):
+        # period and budget are in seconds, budget defaults to the whole period
+        self.period = float(period)
+        self.budget = float(budget) if budget else self.period
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+        self.tick = 0
+        self.deadline = None
+        self._cycle_start = None
+        # statistics
+        self.cycles = 0
+        self.overruns = 0
+        self.missed_ticks = 0
+        self.jitter_min = None
+        self.jitter_max = None
+        self.jitter_sum = 0.0
+        self.work_max = 0.0
+
+    def next_tick_time(self):
+        return self.start + self.tick * self.period
+
+    def wait(self):
+        '''sleep until the next tick, return the tick number'''
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+        else:
+            self._end_cycle(now)
+            self.tick += 1
+            due = self.next_tick_time()
+            if now >= due + self.period:
+                # skip the ticks which already passed instead of bursting
+                missed = int((now - due) // self.period)
+                self.tick += missed
+                self.missed_ticks += missed
+                logging.warning("control loop missed {} tick(s)".format(missed))
+            delay = self.next_tick_time() - now
+            if delay > 0:
+                self.sleep(delay)
+            now = self.clock()
+        self._record_jitter(now - self.next_tick_time())
+        self._cycle_start = now
+        self.deadline = self.next_tick_time() + self.budget
+        return self.tick
+
+    def remaining(self):
+        '''seconds left in the budget of the current cycle'''
+        if self.deadline is None:
+            return self.budget
+        return self.deadline - self.clock()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def _end_cycle(self, now):
+        if self._cycle_start is None:
+            return
+        self.cycles += 1
+        work = now - self._cycle_start
+        if work > self.work_max:
+            self.work_max = work
+        if now > self.deadline:
+            self.overruns += 1
+            logging.warning("control loop overrun: cycle took {0:.1f} ms, budget is {1:.1f} ms".format(
+                work * 1000, self.budget * 1000))
+        self._cycle_start = None
+
+    def _record_jitter(self, jitter):
+        if self.jitter_min is None or jitter < self.jitter_min:
+            self.jitter_min = jitter
+        if self.jitter_max is None or jitter > self.jitter_max:
+            self.jitter_max = jitter
+        self.jitter_sum += jitter
+
+    def stats(self):
+        '''return loop statistics, times are in milliseconds'''
+        ticks = self.cycles + 1 if self.start is not None else 0
+        return {"period": self.period * 1000,
+                "budget": self.budget * 1000,
+                "cycles": self.cycles,
+                "overruns": self.overruns,
+                "missed_ticks": self.missed_ticks,
+                "work_max": self.work_max * 1000,
+                "jitter_min": (self.jitter_min or 0.0) * 1000,
+                "jitter_max": (self.jitter_max or 0.0) * 1000,
+                "jitter_avg": (self.jitter_sum / ticks * 1000) if ticks else 0.0}
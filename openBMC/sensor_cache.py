@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import logging
+from openBMC.scheduler import monotonic
+
+# default freshness asked by interactive tools, in milliseconds
+SENSOR_CACHE_MAX_AGE = 2000
+
+
+class SensorCache(object):
+    '''Timestamped cache of the sensor readings, kept by the backend.
+
+    Timestamps are monotonic seconds, the clock is system wide so readings
+    published by another process compare correctly. A reading older than
+    the max age asked by a reader is stale; the reader then reads the
+    sensor itself and publishes the new value back for the others.
+    '''
+
+    def __init__(self, clock=monotonic):
+        self.clock = clock
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def update(self, name, value, timestamp=None):
+        timestamp = self.clock() if timestamp is None else timestamp
+        entry = self.entries.get(name)
+        # an older reading arriving late never replaces a newer one
+        if entry is None or timestamp >= entry[1]:
+            self.entries[name] = (value, timestamp)
+
+    def get(self, name, max_age):
+        '''return (fresh, value, age) of name, max_age and age in milliseconds.
+        value and age are -1 when the sensor was never published'''
+        entry = self.entries.get(name)
+        if entry is None:
+            self.misses += 1
+            return False, -1, -1
+        value, timestamp = entry
+        age = max(0.0, (self.clock() - timestamp) * 1000)
+        fresh = age <= max_age
+        if fresh:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return fresh, value, age
+
+    def names(self):
+        return sorted(self.entries)
+
+
+def read_through(client, name, read, max_age=SENSOR_CACHE_MAX_AGE):
+    '''return the value of sensor name no older than max_age ms.
+
+    The backend cache is asked first through client (a DBusClient); only when
+    it has nothing fresh enough read() is called, and its value is published
+    back to the cache.
+    '''
+    try:
+        fresh, value, age = client.call("get_sensors", [name], max_age)[0]
+        if fresh:
+            return value
+    except Exception as err:
+        logging.error("failed to get sensor {0} from dbus server: {1}".format(name, err))
+    value = read()
+    if value is not None and value != -1:
+        try:
+            client.call("publish_sensors", [(name, float(value), monotonic())])
+        except Exception as err:
+            logging.error("failed to publish sensor {0} to dbus server: {1}".format(name, err))
+    return value
+
+
+def read_through_many(client, names, read, max_age=SENSOR_CACHE_MAX_AGE):
+    '''return the values of the sensors names no older than max_age ms.
+
+    Like read_through for sensors read together: when any of them is not
+    fresh in the backend cache, read() returns {name: value} of all of them
+    and they are published back in one call.
+    '''
+    try:
+        cached = client.call("get_sensors", list(names), max_age)
+        if all(fresh for fresh, value, age in cached):
+            return [value for fresh, value, age in cached]
+    except Exception as err:
+        logging.error("failed to get sensors {0} from dbus server: {1}".format(",".join(names), err))
+    values = read()
+    now = monotonic()
+    try:
+        client.call("publish_sensors", [(name, float(values[name]), now) for name in names])
+    except Exception as err:
+        logging.error("failed to publish sensors {0} to dbus server: {1}".format(",".join(names), err))
+    return [values[name] for name in names]
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+import logging
+import time
+from openBMC.scheduler import monotonic
+from openBMC.smbpbi import smbpbi_session,SMBPBI_STATUS_SUCCESS
+
+
+class Sensor(object):
+    '''One polled sensor.
+
+    A sensor is read either by a plain callable taking the bus, or through
+    SMBPBI by giving smbpbi=(address, command[, datain]) and a convert
+    callable turning (data, status) into a value. period and max_age are in
+    seconds; a value older than max_age is stale and reads back as the
+    default. Lower priority numbers run first, sensors of equal priority are
+    ordered rate monotonic (shortest period first). enabled, when given, is
+    called before every read and the sensor is skipped while it returns False.
+    '''
+
+    def __init__(self, name, period, read=None, smbpbi=None, convert=None,
+                 priority=0, max_age=None, enabled=None):
+        self.name = name
+        self.period = float(period)
+        self.read = read
+        self.smbpbi = None
+        if smbpbi:
+            self.smbpbi = tuple(smbpbi) if len(smbpbi) == 3 else (smbpbi[0], smbpbi[1], 0x0)
+        self.convert = convert
+        self.priority = priority
+        self.max_age = float(max_age) if max_age else 3 * self.period
+        self.enabled = enabled
+        # runtime state
+        self.due = None
+        self.value = None
+        self.timestamp = None
+        self.reads = 0
+        self.failures = 0
+        self.skipped = 0
+        self.max_latency = 0.0
+
+    def order(self):
+        return (self.priority, self.period)
+
+
+class PollingEngine(object):
+    '''Multi rate sensor poller sharing one I2C bus.
+
+    Each sensor is due every `period` seconds on its own drift free
+    timeline. Whenever sensors are due they run in rate monotonic order,
+    the SMBPBI ones batched into one interleaved SmbpbiSession pass. At most
+    `slot` seconds of bus time are spent per wake-up; sensors left over are
+    deferred to the next wake-up so a long tail of slow sensors never delays
+    the fast ones.
+
+    sleep() is a drop-in replacement for time.sleep which keeps polling
+    while it waits, so it can be handed to PeriodicScheduler to fill the
+    idle time of the control loop; no read starts once the sleep is over.
+    '''
+
+    def __init__(self, bus=None, sensors=(), slot=0.05, clock=monotonic, sleep=time.sleep):
+        self.bus = bus
+        self.session = smbpbi_session(bus)
+        self.slot = slot
+        self.clock = clock
+        self._sleep = sleep
+        self.sensors = []
+        self._by_name = {}
+        for sensor in sensors:
+            self.add(sensor)
+
+    def add(self, sensor):
+        self.sensors.append(sensor)
+        self.sensors.sort(key=Sensor.order)
+        self._by_name[sensor.name] = sensor
+
+    def sensor(self, name):
+        return self._by_name[name]
+
+    def sample(self, name):
+        '''return (value, timestamp) of the last good read, (None, None) if never read'''
+        sensor = self._by_name[name]
+        return sensor.value, sensor.timestamp
+
+    def value(self, name, default=-1):
+        '''return the latest value if it is within the staleness budget'''
+        sensor = self._by_name[name]
+        if sensor.timestamp is None or self.clock() - sensor.timestamp > sensor.max_age:
+            return default
+        return sensor.value
+
+    def next_due(self):
+        if not self.sensors:
+            return None
+        now = self.clock()
+        return min(now if sensor.due is None else sensor.due for sensor in self.sensors)
+
+    def poll(self, until=None):
+        '''read the due sensors within one slot, ending at until at the latest,
+        return the next due time'''
+        now = self.clock()
+        slot_end = now + self.slot if until is None else min(now + self.slot, until)
+        due = [sensor for sensor in self.sensors if sensor.due is None or sensor.due <= now]
+        batch = []
+        for sensor in due:
+            if self.clock() > slot_end:
+                # keep it due, it runs first on the next wake-up
+                break
+            if sensor.enabled and not sensor.enabled():
+                sensor.skipped += 1
+                self._advance(sensor, now)
+                continue
+            if sensor.smbpbi:
+                batch.append(sensor)
+                continue
+            self._flush(batch, now)
+            batch = []
+            try:
+                self._store(sensor, sensor.read(self.session.bus), now)
+            except Exception as err:
+                self._fail(sensor, err, now)
+        self._flush(batch, now)
+        return self.next_due()
+
+    def sleep(self, delay):
+        '''keep polling the sensors for delay seconds'''
+        end = self.clock() + delay
+        while True:
+            # no sensor read starts once the control tick is due
+            next_due = self.poll(end)
+            now = self.clock()
+            if now >= end:
+                return
+            wake = end if next_due is None else min(end, next_due)
+            if wake > now:
+                self._sleep(wake - now)
+
+    def _flush(self, batch, now):
+        if not batch:
+            return
+        results = self.session.read_many([sensor.smbpbi for sensor in batch])
+        for sensor, result in zip(batch, results):
+            try:
+                if result[1] != SMBPBI_STATUS_SUCCESS:
+                    raise IOError("smbpbi status 0x{0:02x}".format(result[1] & 0xff))
+                value = sensor.convert(*result) if sensor.convert else result[0]
+                self._store(sensor, value, now)
+            except Exception as err:
+                self._fail(sensor, err, now)
+
+    def _store(self, sensor, value, now):
+        sensor.value = value
+        sensor.timestamp = self.clock()
+        sensor.reads += 1
+        if sensor.due is not None and now - sensor.due > sensor.max_latency:
+            sensor.max_latency = now - sensor.due
+        self._advance(sensor, now)
+
+    def _fail(self, sensor, err, now):
+        sensor.failures += 1
+        logging.debug("polling sensor {0} failed: {1}".format(sensor.name, err))
+        self._advance(sensor, now)
+
+    def _advance(self, sensor, now):
+        if sensor.due is None:
+            sensor.due = now
+        sensor.due += sensor.period
+        if sensor.due <= now:
+            # fell more than one period behind, realign instead of catching up
+            sensor.due = now + sensor.period
+
+    def stats(self):
+        '''return {name: statistics} of every sensor, times in milliseconds'''
+        stats = {}
+        for sensor in self.sensors:
+            stats[sensor.name] = {"period": sensor.period * 1000,
+                                  "reads": sensor.reads,
+                                  "failures": sensor.failures,
+                                  "skipped": sensor.skipped,
+                                  "max_latency": sensor.max_latency * 1000}
+        return stats
@@ -4,10 +4,11 @@ import serial
 from openBMC.terminal_cmd import CMDManager
 
 class ushell(object):
-    def __init__(self, port='/dev/serial0', baudrate=115200,):
+    def __init__(self, port='/dev/serial0', baudrate=115200, cmd=None):
         self.port = port
         self.baudrate = baudrate
-        self.cmd = CMDManager()
+        # the daemon mode hands in a CMDManager talking to the backend in process
+        self.cmd = cmd if cmd is not None else CMDManager()
         self.ser = self.uart_init()
 
 
@@ -20,7 +21,7 @@ class ushell(object):
             bytesize=serial.EIGHTBITS,
         )
 
-    def show_banner():
+    def show_banner(self):
         self.ser.write("\r\n")
         self.ser.write("     '##::: ##'##::::'##'####'########:'####:::'###::::\r\n");
         self.ser.write("      ###:: ##:##:::: ##. ##::##.... ##. ##:::'## ##:::\r\n");
@@ -46,8 +47,10 @@ class ushell(object):
         while True:
             self.ser.write('\r\nuart>')
             recv_str = self.ser.read_until("\r")
-            self.ser.write(cmd)
+            self.ser.write(recv_str)
             # deal with the cmd
+            if not recv_str.split():
+                continue
             cmd_name = recv_str.split()[0]
             args = tuple(recv_str.split()[1:])
             self.cmd.apply_cmd(cmd_name,self.ser,*args)
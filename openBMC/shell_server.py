@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from openBMC.async_shell import CommandCancelled
+from openBMC.cmd_server import CMD_SERVER_REFUSED
+from openBMC.terminal_cmd import CMDManager
+
+SHELL_SERVER_PATH = "/run/openBMC-shell.sock"
+SHELL_SERVER_HOST = "127.0.0.1"
+SHELL_SERVER_PROMPT = "openBMC> "
+SHELL_SERVER_MAX_SESSIONS = 16
+# commands of all the sessions running at the same time
+SHELL_SERVER_WORKERS = 8
+# output a session buffers before the command writing it waits for the client
+SHELL_SESSION_BUFFER = 64 * 1024
+SHELL_READ_CHUNK = 1024
+CTRL_C = b"\x03"
+
+
+class SessionWriter(object):
+    '''serial look-alike handed to the commands of a session, called from a
+    worker thread; a write waits while the session buffer is full'''
+
+    # a write raises CommandCancelled after Ctrl-C or once the client is gone
+    cancellable = True
+
+    def __init__(self, session):
+        self.session = session
+
+    @property
+    def out_waiting(self):
+        '''bytes buffered for the client, like pyserial'''
+        return self.session.buffered()
+
+    def write(self, string):
+        if self.session.stopped():
+            raise CommandCancelled()
+        if not string:
+            return
+        future = asyncio.run_coroutine_threadsafe(self.session.send(str(string)), self.session.loop)
+        try:
+            future.result()
+        except (ConnectionError, OSError):
+            raise CommandCancelled()
+
+
+class ShellSession(object):
+    '''one client: reads a command per line, runs it, sends a prompt.
+    While a command runs the client is still read: Ctrl-C cancels the
+    command, end of file closes the session, other input waits for the
+    next prompt'''
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.loop = server.loop
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+        self.interrupted = False
+        self.commands = 0
+        self._pending = b""
+        self._line_start = True
+        peer = writer.get_extra_info("peername")
+        self.peer = "{0}:{1}".format(*peer[:2]) if isinstance(peer, tuple) else "unix"
+        writer.transport.set_write_buffer_limits(high=SHELL_SESSION_BUFFER)
+
+    def buffered(self):
+        return self.writer.transport.get_write_buffer_size()
+
+    def stopped(self):
+        '''True when the command of the session should stop, called from the worker'''
+        return self.closed or self.interrupted or self.writer.transport.is_closing()
+
+    def _received(self, data):
+        if not data:
+            self.closed = True
+            return
+        if CTRL_C in data:
+            # Ctrl-C drops what was typed before it
+            self.interrupted = True
+            self._pending = b""
+            data = data[data.rindex(CTRL_C) + 1:]
+        self._pending += data
+
+    async def _readline(self):
+        '''return the next line, b"" at end of file'''
+        while b"\n" not in self._pending and not self.closed:
+            self._received(await self.reader.read(SHELL_READ_CHUNK))
+        line, newline, self._pending = self._pending.partition(b"\n")
+        return line + newline
+
+    async def _watch_client(self):
+        while not self.closed:
+            self._received(await self.reader.read(SHELL_READ_CHUNK))
+
+    async def send(self, string):
+        self._line_start = string.endswith("\n")
+        self.writer.write(string.encode("utf-8", "replace"))
+        await self.writer.drain()
+
+    def _apply(self, words):
+        try:
+            self.server.manager.apply_cmd(words[0], SessionWriter(self), *words[1:])
+        except CommandCancelled:
+            pass
+
+    def _sessions(self):
+        lines = ""
+        for session in self.server.sessions:
+            lines += "{0:22s} commands: {1:6d}  buffered: {2:6d}{3}\n".format(
+                session.peer, session.commands, session.buffered(), "  (this)" if session is self else "")
+        return lines
+
+    async def run(self):
+        await self.send("openBMC shell, type help to list the commands, exit to quit\n" + SHELL_SERVER_PROMPT)
+        while True:
+            line = await self._readline()
+            if not line:
+                break
+            words = line.decode("utf-8", "replace").split()
+            if words and words[0] in ("exit", "quit"):
+                break
+            if words and words[0] == "sessions":
+                await self.send(self._sessions())
+            elif words and words[0] in CMD_SERVER_REFUSED:
+                await self.send("error: {}\n".format(CMD_SERVER_REFUSED[words[0]]))
+            elif words:
+                self.commands += 1
+                self._line_start = True
+                self.interrupted = False
+                watcher = asyncio.ensure_future(self._watch_client())
+                try:
+                    await self.loop.run_in_executor(self.server.executor, self._apply, words)
+                finally:
+                    # a read cancelled while waiting loses no data
+                    watcher.cancel()
+                    await asyncio.wait([watcher])
+                if self.closed:
+                    break
+                if not self._line_start:
+                    await self.send("\n")
+            await self.send(SHELL_SERVER_PROMPT)
+
+
+class ShellServer(object):
+    '''Shell sessions on a Unix socket and an optional local TCP port.
+
+    Every session shares the one CMDManager, so its I2C client, SMBPBI
+    session and D-Bus connection, and the sessions of all clients run on
+    one asyncio loop. A command runs in a worker pool, several sessions
+    can run theirs at once with the bus arbitrated; a session runs its own
+    commands one after the other. Output is buffered per session up to
+    SHELL_SESSION_BUFFER, then the command writing it waits for the client
+    to read, so a slow client holds back only its own commands; watch sees
+    the backlog and drops samples.
+    '''
+
+    def __init__(self, manager=None, path=SHELL_SERVER_PATH, port=None, host=SHELL_SERVER_HOST,
+                 max_sessions=SHELL_SERVER_MAX_SESSIONS):
+        self.manager = manager if manager is not None else CMDManager()
+        self.path = path
+        self.port = port
+        self.host = host
+        self.max_sessions = max_sessions
+        self.sessions = []
+        self.executor = ThreadPoolExecutor(SHELL_SERVER_WORKERS)
+        self.loop = None
+        self.servers = []
+
+    async def _session(self, reader, writer):
+        if len(self.sessions) >= self.max_sessions:
+            writer.write(b"too many sessions\n")
+            writer.close()
+            return
+        session = ShellSession(self, reader, writer)
+        self.sessions.append(session)
+        try:
+            await session.run()
+        except (ConnectionError, OSError) as err:
+            logging.warning("[shell_server]{0} lost: {1}".format(session.peer, err))
+        finally:
+            session.closed = True
+            self.sessions.remove(session)
+            writer.close()
+
+    async def start(self):
+        self.loop = asyncio.get_event_loop()
+        if self.path:
+            if os.path.exists(self.path):
+                # a socket left behind by a server which is gone
+                os.unlink(self.path)
+            self.servers.append(await asyncio.start_unix_server(self._session, self.path))
+            os.chmod(self.path, 0o660)
+        if self.port:
+            self.servers.append(await asyncio.start_server(self._session, self.host, self.port))
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+        self.executor.shutdown(wait=False)
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.start())
+            loop.run_forever()
+        finally:
+            self.close()
+            loop.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="openBMC shell server on a Unix socket and a local TCP port")
+    parser.add_argument('-u','--unix',default=SHELL_SERVER_PATH,metavar='SOCKET',help='Unix socket of the sessions')
+    parser.add_argument('-t','--tcp-port',type=int,default=None,metavar='PORT',
+                        help='also serve sessions on this TCP port of {}'.format(SHELL_SERVER_HOST))
+    args = parser.parse_args()
+    ShellServer(path=args.unix,port=args.tcp_port).run()
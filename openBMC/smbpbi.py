@@ -1,60 +1,243 @@
 #!/usr/bin/env python
 
 import argparse
-import smbus
 import time
+from openBMC.i2c_arbiter import i2c_arbiter,bus_hold,PRIORITY_INTERACTIVE
+from openBMC.scheduler import monotonic
 
 
-def smbpbi_read(address,command,bus=None,datain=0x0):
-    # parse datain list
-    datain_list=[0x04]
-    datain_list.append(int(datain & 0xff))
-    datain_list.append(int((datain & 0xff00)>> 8))
-    datain_list.append(int((datain & 0xff0000) >> 16))
-    datain_list.append(int((datain & 0xff000000) >> 24))
-    # parse command list
-    command_list=[0x04]
-    command_list.append(int(command & 0xff))
-    command_list.append(int((command & 0xff00)>> 8))
-    command_list.append(int((command & 0xff0000) >> 16))
-    command_list.append(int((command & 0xff000000) >> 24))
-
-#    print("command list:",command_list)
-    try:
+SMBPBI_STATUS_SUCCESS = 0x1f
+SMBPBI_STATUS_ACCEPTED = 0x1e
+SMBPBI_STATUS_NOT_SUPPORTED = 0x08
+
+# time the GPU needs before the first status poll after a request is posted
+SMBPBI_SETTLE_TIME = 0.002
+# interval between the command re-post and status poll while a request is
+# still accepted
+SMBPBI_POLL_INTERVAL = 0.002
+# total time a request may stay in flight before it is given up, the budget
+# of the former one shot read: a settle, four re-posts and the final wait
+SMBPBI_REQUEST_TIMEOUT = 0.028
+# seconds a "not supported" answer is remembered, a GPU still booting
+# answers it to requests it supports once up
+SMBPBI_UNSUPPORTED_TTL = 60
+
+
+def smbpbi_frame(value):
+    '''encode a 32 bits value into the 5 bytes block written to 0x5c/0x5d'''
+    return [0x04,
+            int(value & 0xff),
+            int((value & 0xff00) >> 8),
+            int((value & 0xff0000) >> 16),
+            int((value & 0xff000000) >> 24)]
+
+
+def smbpbi_word(data_back):
+    '''decode the 5 bytes block read back from 0x5d into a 32 bits value'''
+    return data_back[1] | (data_back[2] << 8) | (data_back[3] << 16) | (data_back[4] << 24)
+
+
+class SmbpbiSession(object):
+    '''Long lived SMBPBI context.
+
+    The session keeps the I2C bus handle open, caches the encoded 0x5d/0x5c
+    frames of every (command, datain) pair it has sent, and remembers for
+    unsupported_ttl seconds the commands each device answered with "not
+    supported" (0x08) so they are answered from the cache without touching
+    the bus again. Without a bus it uses the I2C1 arbiter at interactive
+    priority.
+    '''
+
+    def __init__(self, bus=None, bus_num=1, unsupported_ttl=SMBPBI_UNSUPPORTED_TTL, clock=monotonic):
         if not bus:
             # init I2C1
-            bus = smbus.SMBus(1)
-        #Write 5D data
-        bus.write_i2c_block_data(address,0x5d,datain_list)
-        #Write 5C command
-        bus.write_i2c_block_data(address,0x5c,command_list)
-        time.sleep(0.002)
-        #Read 5C reg
-        status= bus.read_i2c_block_data(address,0x5c,5)
-#        print(status)
-        if(status[4] == 0x1f):
-        #Read 5D data
-            data_back = bus.read_i2c_block_data(address,0x5d,5)
-        elif(status[4] == 0x1e):
-            for _ in range(4):
-                time.sleep(0.002)
-                bus.write_i2c_block_data(address,0x5c,command_list)
-                time.sleep(0.002)
-                status= bus.read_i2c_block_data(address,0x5c,5)
-                if status[4] == 0x1f :
-                    break
-                elif status[4] == 0x1e:
-                    continue
-                else:
-                    return -1,status[4]
-            time.sleep(0.01)
-            data_back = bus.read_i2c_block_data(address,0x5d,5)
+            bus = i2c_arbiter(bus_num).client(PRIORITY_INTERACTIVE)
+        self.bus = bus
+        self.unsupported_ttl = unsupported_ttl
+        self.clock = clock
+        # (command, datain) -> (datain frame, command frame)
+        self._frames = {}
+        # address -> {unsupported command: time the answer expires}
+        self.unsupported = {}
+
+    def frames(self, command, datain=0x0):
+        '''return the cached (0x5d frame, 0x5c frame) of a request'''
+        key = (command, datain)
+        frames = self._frames.get(key)
+        if frames is None:
+            frames = (smbpbi_frame(datain), smbpbi_frame(command))
+            self._frames[key] = frames
+        return frames
+
+    def is_supported(self, address, command):
+        expires = self.unsupported.get(address, {}).get(command)
+        if expires is None:
+            return True
+        if self.clock() >= expires:
+            # ask the device again
+            del self.unsupported[address][command]
+            return True
+        return False
+
+    def note_status(self, address, command, status):
+        if status == SMBPBI_STATUS_NOT_SUPPORTED:
+            self.unsupported.setdefault(address, {})[command] = self.clock() + self.unsupported_ttl
+
+    def forget_unsupported(self, address=None):
+        '''drop the negative cache of one device, or of all of them'''
+        if address is None:
+            self.unsupported = {}
         else:
-            return -1,status[4]
-        return data_back[2],status[4]
-    except Exception as err:
-        print("smbpbi read failed, the error info is as follows:\n{}".format(str(err)))
-        return -1,-1
+            self.unsupported.pop(address, None)
+
+    def read(self, address, command, datain=0x0):
+        '''run one request, return (32 bits data, status)'''
+        scheduler = SmbpbiScheduler(self)
+        key = scheduler.add(address, command, datain)
+        return scheduler.run()[key]
+
+    def read_many(self, requests):
+        '''run a list of (address, command, datain) requests interleaved across
+        devices, return the (32 bits data, status) pairs in the same order'''
+        scheduler = SmbpbiScheduler(self)
+        keys = [scheduler.add(address, command, datain, index)
+                for index, (address, command, datain) in enumerate(requests)]
+        results = scheduler.run()
+        return [results[key] for key in keys]
+
+    def close(self):
+        close = getattr(self.bus, 'close', None)
+        if close:
+            close()
+
+
+_sessions = {}
+
+def smbpbi_session(bus=None):
+    '''return the SmbpbiSession shared by every caller of the given bus,
+    bus=None shares one session on I2C1'''
+    session = _sessions.get(bus)
+    if session is None:
+        session = SmbpbiSession(bus)
+        _sessions[bus] = session
+    return session
+
+
+class SmbpbiScheduler(object):
+    '''Interleave SMBPBI transactions across several target devices.
+
+    Every device owns its own 0x5c/0x5d mailbox, so one request can be in
+    flight per device at a time. The scheduler posts the head request of every
+    device first, then sleeps once until the earliest request is due and
+    collects whatever has completed. A request that is still accepted (0x1e)
+    gets its command frame written to 0x5c again, as the one shot read
+    always did, and is polled again until its deadline expires, so the time
+    spent per run follows the slowest device instead of the sum of all of
+    them. An arbitrated bus is held for the whole run, so no other
+    transaction can slip into the middle of a mailbox sequence.
+    '''
+
+    def __init__(self, session, settle=SMBPBI_SETTLE_TIME,
+                 poll_interval=SMBPBI_POLL_INTERVAL, timeout=SMBPBI_REQUEST_TIMEOUT):
+        self.session = session
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        # address -> list of pending [key, command, datain]
+        self._queues = {}
+        self._order = []
+
+    def add(self, address, command, datain=0x0, key=None):
+        '''queue one request, key defaults to (address, command, datain)'''
+        if key is None:
+            key = (address, command, datain)
+        if address not in self._queues:
+            self._queues[address] = []
+            self._order.append(address)
+        self._queues[address].append([key, command, datain])
+        return key
+
+    def _post(self, address, request, now):
+        key, command, datain = request
+        datain_frame, command_frame = self.session.frames(command, datain)
+        self.session.bus.write_i2c_block_data(address, 0x5d, datain_frame)
+        self.session.bus.write_i2c_block_data(address, 0x5c, command_frame)
+        # [key, command, next poll time, deadline, command frame]
+        return [key, command, now + self.settle, now + self.timeout, command_frame]
+
+    def run(self):
+        '''run all queued requests, return {key: (32 bits data, status)}'''
+        with bus_hold(self.session.bus):
+            return self._run()
+
+    def _run(self):
+        results = {}
+        bus = self.session.bus
+        # the session clock is monotonic, a wall clock step can't time out a request
+        clock = self.session.clock
+        inflight = {}
+
+        def post_next(address, now):
+            while self._queues[address]:
+                request = self._queues[address].pop(0)
+                if not self.session.is_supported(address, request[1]):
+                    results[request[0]] = (-1, SMBPBI_STATUS_NOT_SUPPORTED)
+                    continue
+                try:
+                    inflight[address] = self._post(address, request, now)
+                    return
+                except Exception as err:
+                    print("smbpbi read failed, the error info is as follows:\n{}".format(str(err)))
+                    results[request[0]] = (-1, -1)
+            inflight.pop(address, None)
+
+        now = clock()
+        for address in self._order:
+            post_next(address, now)
+
+        while inflight:
+            wake = min(entry[2] for entry in inflight.values())
+            delay = wake - clock()
+            if delay > 0:
+                time.sleep(delay)
+            now = clock()
+            for address in self._order:
+                entry = inflight.get(address)
+                if entry is None or entry[2] > now:
+                    continue
+                key, command = entry[0], entry[1]
+                try:
+                    #Read 5C reg
+                    status = bus.read_i2c_block_data(address, 0x5c, 5)
+                    if status[4] == SMBPBI_STATUS_SUCCESS:
+                        #Read 5D data
+                        data_back = bus.read_i2c_block_data(address, 0x5d, 5)
+                        results[key] = (smbpbi_word(data_back), status[4])
+                    elif status[4] == SMBPBI_STATUS_ACCEPTED and now < entry[3]:
+                        # post the command again, the GPU may have dropped it while busy
+                        bus.write_i2c_block_data(address, 0x5c, entry[4])
+                        entry[2] = min(now + self.poll_interval, entry[3])
+                        continue
+                    else:
+                        self.session.note_status(address, command, status[4])
+                        results[key] = (-1, status[4])
+                except Exception as err:
+                    print("smbpbi read failed, the error info is as follows:\n{}".format(str(err)))
+                    results[key] = (-1, -1)
+                post_next(address, clock())
+
+        self._queues = {}
+        self._order = []
+        return results
+
+
+def smbpbi_read(address,command,bus=None,datain=0x0):
+    # one shot read which keeps returning the second data byte as before,
+    # use SmbpbiSession.read for the full 32 bits word
+    data,status = SmbpbiSession(bus).read(address, command, datain)
+    if status == SMBPBI_STATUS_SUCCESS:
+        data = (data & 0xff00) >> 8
+    return data,status
 
 def main():
     parser = argparse.ArgumentParser(description="Smbpbi command")
@@ -62,7 +245,7 @@ def main():
     parser.add_argument('datain',type=lambda x: int(x,0),help='Data(32bits) to write in 0x5d register. For example: 0x00000000')
     parser.add_argument('command',type=lambda x: int(x,0),help='Command(32bits) to write in 0x5c register. For example: 0x80000002 for GPU temp read')
     args = parser.parse_args()
-    data_back,status = smbpbi_read(args.address,args.command,None,args.datain)   
+    data_back,status = SmbpbiSession().read(args.address,args.command,args.datain)
     #print status
     print("SMBPBI readback: {0}, status: 0x{1:02x}".format(data_back,status))
     #print data_back
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+import struct
+import time
+
+from openBMC.i2c_arbiter import bus_hold
+from openBMC.i2c_tools import i2c_dump
+from openBMC.max31790 import max31790_invalidate
+from openBMC.pmbus import (PMBUS_STATUS_WORD, PMBUS_READ_VIN, PMBUS_READ_VOUT, PMBUS_READ_IOUT,
+                           PMBUS_READ_TEMPERATURE_1, PMBUS_READ_PIN)
+
+SNAPSHOT_MAGIC = b"OBSN"
+SNAPSHOT_VERSION = 1
+# magic, version, capture time, number of entries
+SNAPSHOT_HEADER = struct.Struct("<4sHdI")
+# address, register, kind, value length; followed by the value bytes
+SNAPSHOT_ENTRY = struct.Struct("<BBcB")
+
+# entry kinds: one byte register, one word register, SMBus block register
+KIND_BYTE = b"b"
+KIND_WORD = b"w"
+KIND_BLOCK = b"k"
+
+HSC_REGISTERS = [PMBUS_STATUS_WORD, PMBUS_READ_VIN, PMBUS_READ_VOUT, PMBUS_READ_IOUT,
+                 PMBUS_READ_TEMPERATURE_1, PMBUS_READ_PIN]
+
+# name, address, byte ranges, word registers, block registers and the byte
+# ranges a restore may write back. The byte registers of a device with
+# "auto_increment" are read and written in I2C blocks, those of any other
+# device one byte at a time: a part which doesn't step its register pointer
+# would put a whole block into its first register. A writable range is (first, last) or
+# (first, last, write first) for registers written at another address than
+# they are read at: the TMP451 configuration, conversion rate and limits
+# are read at 0x03-0x08 and written at 0x09-0x0e. Temperatures, status and
+# counters are never written, neither is anything of the FPGA, the HSCs or
+# the SMBPBI mailboxes where a write starts an action.
+SNAPSHOT_DEVICES = [
+    {"name": "TMP451", "address": 0x48,
+     "bytes": [(0x00, 0x08), (0x10, 0x15), (0x19, 0x23), (0xfe, 0xfe)],
+     "writable": [(0x03, 0x08, 0x09), (0x11, 0x14), (0x19, 0x19), (0x20, 0x23)]},
+    {"name": "MAX31790", "address": 0x2c, "auto_increment": True,
+     "bytes": [(0x00, 0x5b)],
+     "writable": [(0x00, 0x0d), (0x12, 0x14), (0x40, 0x4b), (0x50, 0x5b)]},
+    {"name": "FPGA", "address": 0x12, "bytes": [(0x00, 0x1f)]},
+    {"name": "HSC0", "address": 0x40, "words": HSC_REGISTERS},
+    {"name": "HSC1", "address": 0x42, "words": HSC_REGISTERS},
+    {"name": "HSC2", "address": 0x44, "words": HSC_REGISTERS},
+    {"name": "HSC3", "address": 0x46, "words": HSC_REGISTERS},
+    {"name": "GPU0", "address": 0x4c, "blocks": [(0x5c, 5), (0x5d, 5)]},
+    {"name": "GPU1", "address": 0x4d, "blocks": [(0x5c, 5), (0x5d, 5)]},
+]
+
+
+def snapshot_devices(names=None):
+    '''return the device table entries of the given names, all by default'''
+    if not names:
+        return list(SNAPSHOT_DEVICES)
+    wanted = [name.upper() for name in names]
+    unknown = [name for name in wanted if name not in [device["name"] for device in SNAPSHOT_DEVICES]]
+    if unknown:
+        raise ValueError("unknown snapshot device {}".format(", ".join(unknown)))
+    return [device for device in SNAPSHOT_DEVICES if device["name"] in wanted]
+
+
+def i2c_read_words(bus, address, registers):
+    '''word read of each register, return {register: value} of those which answered'''
+    values = {}
+    for register in registers:
+        try:
+            values[register] = bus.read_word_data(address, register)
+        except (IOError, OSError):
+            pass
+    return values
+
+
+class Snapshot(object):
+    '''Register values of a set of devices.
+
+    entries maps (address, register, kind) to the value: an int for byte
+    and word registers, a list of bytes for block registers. Registers
+    which failed to read are missing.
+    '''
+
+    def __init__(self, entries=None, timestamp=None):
+        self.entries = entries if entries is not None else {}
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    @classmethod
+    def capture(cls, bus, devices=None):
+        '''read every register of the devices, each device as one bus batch'''
+        snapshot = cls()
+        for device in devices or SNAPSHOT_DEVICES:
+            address = device["address"]
+            with bus_hold(bus):
+                for first, last in device.get("bytes", []):
+                    for register, value in i2c_dump(bus, address, first, last, dump_mode(device)).items():
+                        snapshot.entries[(address, register, KIND_BYTE)] = value
+                for register, value in i2c_read_words(bus, address, device.get("words", [])).items():
+                    snapshot.entries[(address, register, KIND_WORD)] = value
+                for register, length in device.get("blocks", []):
+                    try:
+                        snapshot.entries[(address, register, KIND_BLOCK)] = list(
+                            bus.read_i2c_block_data(address, register, length))
+                    except (IOError, OSError):
+                        pass
+        return snapshot
+
+    def save(self, path):
+        chunks = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.timestamp, len(self.entries))]
+        for (address, register, kind), value in sorted(self.entries.items()):
+            if kind == KIND_BYTE:
+                data = struct.pack("<B", value)
+            elif kind == KIND_WORD:
+                data = struct.pack("<H", value)
+            else:
+                data = bytes(bytearray(value))
+            chunks.append(SNAPSHOT_ENTRY.pack(address, register, kind, len(data)) + data)
+        with open(path, "wb") as snapshot_file:
+            snapshot_file.write(b"".join(chunks))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as snapshot_file:
+            raw = snapshot_file.read()
+        magic, version, timestamp, count = SNAPSHOT_HEADER.unpack_from(raw, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("{} is not a register snapshot".format(path))
+        entries = {}
+        offset = SNAPSHOT_HEADER.size
+        for i in range(count):
+            address, register, kind, length = SNAPSHOT_ENTRY.unpack_from(raw, offset)
+            offset += SNAPSHOT_ENTRY.size
+            data = bytearray(raw[offset:offset + length])
+            offset += length
+            if kind == KIND_BYTE:
+                value = data[0]
+            elif kind == KIND_WORD:
+                value = data[0] | (data[1] << 8)
+            else:
+                value = list(data)
+            entries[(address, register, kind)] = value
+        return cls(entries, timestamp)
+
+    def addresses(self):
+        return set(key[0] for key in self.entries)
+
+    def only(self, devices):
+        '''return the part of the snapshot of the given devices'''
+        addresses = set(device["address"] for device in devices)
+        return Snapshot(dict((key, value) for key, value in self.entries.items() if key[0] in addresses),
+                        self.timestamp)
+
+
+def snapshot_diff(old, new):
+    '''return [(address, register, kind, old value, new value)] of the entries
+    which differ, None standing for a register missing from one side.
+    Devices missing entirely from one side are left out, see
+    snapshot_missing.'''
+    common = old.addresses() & new.addresses()
+    diff = []
+    for key in sorted(key for key in set(old.entries) | set(new.entries) if key[0] in common):
+        before = old.entries.get(key)
+        after = new.entries.get(key)
+        if before != after:
+            diff.append(key + (before, after))
+    return diff
+
+
+def snapshot_missing(old, new):
+    '''return the device names of old missing from new and of new missing from old'''
+    names = dict((device["address"], device["name"]) for device in SNAPSHOT_DEVICES)
+    gone = sorted(names.get(address, hex(address)) for address in old.addresses() - new.addresses())
+    added = sorted(names.get(address, hex(address)) for address in new.addresses() - old.addresses())
+    return gone, added
+
+
+def format_value(kind, value):
+    if value is None:
+        return "--"
+    if kind == KIND_BYTE:
+        return "0x{0:02x}".format(value)
+    if kind == KIND_WORD:
+        return "0x{0:04x}".format(value)
+    return " ".join("{0:02x}".format(x) for x in value)
+
+
+def format_diff(diff):
+    '''render a snapshot_diff result, one register per line'''
+    names = dict((device["address"], device["name"]) for device in SNAPSHOT_DEVICES)
+    lines = []
+    for address, register, kind, before, after in diff:
+        lines.append("{0:8s} 0x{1:02x} 0x{2:02x}: {3} -> {4}".format(
+            names.get(address, "?"), address, register,
+            format_value(kind, before), format_value(kind, after)))
+    return "\n".join(lines) + "\n" if lines else "no difference\n"
+
+
+def dump_mode(device):
+    '''i2c_dump mode of the byte registers of a device table entry'''
+    return "i" if device.get("auto_increment") else "b"
+
+
+def snapshot_restore(bus, snapshot, devices=None, dry_run=False):
+    '''write back the writable registers of the devices which differ from the
+    snapshot, contiguous registers in one block write when the device
+    auto-increments, one byte write each otherwise; return the
+    [(address, register, bytes)] written, register being the one written.
+    The MAX31790 drivers of this process forget their shadow after a
+    restore wrote the part, so the fan control rewrites its PWM targets.'''
+    writes = []
+    for device in devices or SNAPSHOT_DEVICES:
+        address = device["address"]
+        writable = device.get("writable", [])
+        if not writable:
+            continue
+        with bus_hold(bus):
+            for writable_range in writable:
+                first, last = writable_range[:2]
+                # offset from the register read to the one written
+                shift = writable_range[2] - first if len(writable_range) > 2 else 0
+                current = i2c_dump(bus, address, first, last, dump_mode(device))
+                changed = [register for register in range(first, last + 1)
+                           if (address, register, KIND_BYTE) in snapshot.entries and
+                           current.get(register) != snapshot.entries[(address, register, KIND_BYTE)]]
+                # group consecutive registers into runs
+                runs = []
+                for register in changed:
+                    if runs and runs[-1][-1] == register - 1 and device.get("auto_increment"):
+                        runs[-1].append(register)
+                    else:
+                        runs.append([register])
+                for run in runs:
+                    data = [snapshot.entries[(address, register, KIND_BYTE)] for register in run]
+                    if not dry_run:
+                        if len(data) == 1:
+                            bus.write_byte_data(address, run[0] + shift, data[0])
+                        else:
+                            bus.write_i2c_block_data(address, run[0] + shift, data)
+                    writes.append((address, run[0] + shift, data))
+        if device["name"] == "MAX31790" and not dry_run and any(write[0] == address for write in writes):
+            max31790_invalidate(address)
+    return writes
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import mmap
+import os
+import struct
+import time
+
+# default segment, /dev/shm is a tmpfs so the mapping never touches storage
+STATE_PLANE_PATH = "/dev/shm/openBMC-state"
+STATE_PLANE_MAGIC = b"OBMC"
+STATE_PLANE_VERSION = 1
+# share data type and number of values, in the order of the segment
+STATE_LAYOUT = [("percent", 3),
+                ("temp", 3),
+                ("power", 3),
+                ("user", 3),
+                ("rpm", 6),
+                ("fan_status", 6),
+                ("hsc_power", 4),
+                ("hsc_temp", 4),
+                ("hsc_status", 4)]
+# magic, version, number of values, sequence, time of the last publish
+STATE_HEADER = struct.Struct("<4sHHId")
+STATE_SEQ_OFFSET = 8
+STATE_SEQ = struct.Struct("<I")
+# a reader gives up after this many torn reads in a row
+STATE_READ_RETRIES = 1000
+
+
+def state_slots(layout=STATE_LAYOUT):
+    '''return {(type, index): slot} and the number of slots of a layout'''
+    slots = {}
+    for name, count in layout:
+        for index in range(count):
+            slots[(name, index)] = len(slots)
+    return slots, len(slots)
+
+
+class StatePlane(object):
+    '''Board state published in a shared memory segment.
+
+    The segment is a fixed header followed by one int16 per value, in the
+    order of STATE_LAYOUT. A single writer (the backend) publishes with a
+    seqlock: the sequence is odd while the values are rewritten and even
+    once they are consistent. Readers copy the values between two reads of
+    the sequence and retry when it moved or was odd, so they never take a
+    lock nor make the writer wait.
+    '''
+
+    def __init__(self, path=STATE_PLANE_PATH, writer=False, layout=STATE_LAYOUT):
+        self.path = path
+        self.writer = writer
+        self.layout = layout
+        self.slots, count = state_slots(layout)
+        self.values = struct.Struct("<{}h".format(count))
+        self.size = STATE_HEADER.size + self.values.size
+        if writer:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, self.size)
+                self.mm = mmap.mmap(fd, self.size, access=mmap.ACCESS_WRITE)
+            finally:
+                os.close(fd)
+            self.seq = 0
+            self.current = [-1] * count
+            STATE_HEADER.pack_into(self.mm, 0, STATE_PLANE_MAGIC, STATE_PLANE_VERSION, count, 0, 0.0)
+            self.values.pack_into(self.mm, STATE_HEADER.size, *self.current)
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                self.mm = mmap.mmap(fd, self.size, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+            magic, version, stored, seq, timestamp = STATE_HEADER.unpack_from(self.mm, 0)
+            if magic != STATE_PLANE_MAGIC or version != STATE_PLANE_VERSION or stored != count:
+                self.mm.close()
+                raise ValueError("{} is not a state plane of this layout".format(path))
+
+    def publish(self, state):
+        '''write the (type, index, value) of state, unknown ones are skipped'''
+        for name, index, value in state:
+            slot = self.slots.get((name, index))
+            if slot is not None:
+                self.current[slot] = max(-0x8000, min(0x7fff, int(value)))
+        self.seq += 1
+        STATE_SEQ.pack_into(self.mm, STATE_SEQ_OFFSET, self.seq & 0xffffffff)
+        self.values.pack_into(self.mm, STATE_HEADER.size, *self.current)
+        struct.pack_into("<d", self.mm, STATE_SEQ_OFFSET + STATE_SEQ.size, time.time())
+        self.seq += 1
+        STATE_SEQ.pack_into(self.mm, STATE_SEQ_OFFSET, self.seq & 0xffffffff)
+
+    def read(self):
+        '''return a consistent (timestamp, values) copy of the segment'''
+        mm = self.mm
+        for retry in range(STATE_READ_RETRIES):
+            seq = STATE_SEQ.unpack_from(mm, STATE_SEQ_OFFSET)[0]
+            if not seq & 1:
+                raw = mm[STATE_SEQ_OFFSET:self.size]
+                if STATE_SEQ.unpack_from(mm, STATE_SEQ_OFFSET)[0] == seq:
+                    timestamp = struct.unpack_from("<d", raw, STATE_SEQ.size)[0]
+                    return timestamp, self.values.unpack_from(raw, STATE_HEADER.size - STATE_SEQ_OFFSET)
+            # let the writer finish, the board may have a single core
+            time.sleep(0)
+        raise RuntimeError("{} is being rewritten, no consistent read".format(self.path))
+
+    def snapshot(self):
+        '''return (timestamp, {type: [values]}) of one consistent read'''
+        timestamp, values = self.read()
+        state = {}
+        for (name, index), slot in self.slots.items():
+            state.setdefault(name, [None] * dict(self.layout)[name])[index] = values[slot]
+        return timestamp, state
+
+    def get(self, type, index):
+        return self.read()[1][self.slots[(type, index)]]
+
+    def close(self):
+        self.mm.close()
+
+
+def open_state_plane(path=STATE_PLANE_PATH):
+    '''return a reader of the state plane, None when the backend doesn't publish one'''
+    try:
+        return StatePlane(path)
+    except (OSError, IOError, ValueError):
+        return None
@@ -1,14 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import logging
-from openBMC.smbpbi import smbpbi_read
-import smbus
-from openBMC.fan_control import set_dbus_data,get_dbus_data,pwm_reqest_set,TMP451_7bit_ADDR,GPU0_7bit_ADDR,GPU1_7bit_ADDR
-import dbus
+from openBMC.smbpbi import smbpbi_session,SMBPBI_STATUS_SUCCESS,SMBPBI_STATUS_NOT_SUPPORTED
+from openBMC.i2c_arbiter import i2c_arbiter,PRIORITY_INTERACTIVE,PRIORITY_NAMES
+from openBMC.max31790 import MAX31790_CHANNELS,FAN_STATUS_NAMES
+from openBMC.i2c_tools import i2c_probe,i2c_probe_table,i2c_dump,i2c_dump_table,I2C_PROBE_FIRST,I2C_PROBE_LAST
+from openBMC.snapshot import Snapshot,snapshot_devices,snapshot_diff,snapshot_missing,format_diff,snapshot_restore
+# openBMC.fan_control and openBMC.dbus_backend pull in dbus, glib and gobject,
+# they are imported by the commands which need them so `help` starts fast
+from openBMC.state_plane import open_state_plane
+from openBMC.sensor_cache import read_through,read_through_many,SENSOR_CACHE_MAX_AGE
+from openBMC.pmbus import read_hsc,format_hsc,status_names,HSC_ADDRESSES,HSC_SENSOR_KINDS
+from openBMC.cmd_script import parse_script,ScriptRunner
+from openBMC.watch import watch_fields,DeltaEncoder,WATCH_DEFAULT,WATCH_INTERVAL,WATCH_MIN_INTERVAL,WATCH_BACKLOG_MAX
 import argparse
 import socket
+import subprocess
 import sys
 import os
+import threading
+import time
 
 def show(string,serial):
     if serial:
@@ -46,17 +57,19 @@ class CMDManager(object):
       SMBPBI read from a specific device\n""",
                                 True],
                         "power":[self.smbpbi_sub_command,
-                                1,
-                                """ <gpu index>\n
-      read GPU power for gpu [0-1]\n
+                                2,
+                                """ <gpu index> <max age(ms)>\n
+      read GPU power in W for gpu [0-1]\n
+      the reading of the fan control is used if it is not older than max age(default 2000)\n
       example arguments: \n
         power 0\n
       read specified GPU power""",
                                 True],
                         "temp":[self.i2c_sub_command,
-                                1,
-                                """ <index>\n
+                                2,
+                                """ <index> <max age(ms)>\n
       read temperature for gpu/LR10 [0-2]\n
+      the reading of the fan control is used if it is not older than max age(default 2000)\n
       example arguments: 0 for GPU0, 1 for GPU1, 2 for LR10\n
         temp 0\n
       read specified GPU temperature""",
@@ -89,15 +102,63 @@ class CMDManager(object):
       set GPU1 to 50% duty cycle
       set PWM duty cycle""",
                                 False],
-                        "hsc":[self.i2c_sub_command,
+                        "fan":[self.dbus_command,
+                                1,
+                                """ <fan index[0-6]>\n
+      show fan speed and health of MAX31790 fan[0-5]\n
+      6:ALL\n
+      example arguments: \n
+        fan 6\n
+      show current fan RPM and status(ok, stalled, failed)""",
+                                False],
+                        "watch":[self.watch_command,
+                                3,
+                                """<fields> <interval ms> <count>\n
+      stream the latest board state of the control loop, by default temp,pwm,rpm every 1000 ms\n
+      for count samples, or until a key is pressed on the serial console, Ctrl-C in a shell\n
+      session; without a key to stop it the count is required\n
+      fields are temp, pwm, power, user, rpm, status, or one of them as pwm1\n
+      only the fields which changed are sent, as t0+1 or r3=5400; + counts samples without a\n
+      line, ~ samples dropped while the port was backlogged, = starts a line with every field\n
+      example arguments: \n
+        watch temp,rpm2 500""",
+                                False],
+                        "batch":[self.script_command,
                                 2,
-                                """hsc number([0-3])> <info type(power,temp,alert)>\n
-      ead HS power, temperature, alert state\n
+                                """<--json> <script file>\n
+      run the commands of a script file in this session, one per line or separated by ;\n
+      "repeat N every T ms: cmd; cmd" repeats a line, "repeat N every T ms" ... "end" a block\n
+      --json prints one JSON line per command run and a summary; the command and shell servers\n
+      open no file, from the command line the script is read by the client""",
+                                False],
+                        "run":[self.script_command,
+                                256,
+                                """<--json> <commands>\n
+      run ; separated commands in this session, the same script syntax as batch\n
+      example arguments: \n
+        run repeat 10 every 100 ms: get_pwm 3; fan 6""",
+                                False],
+                        "history":[self.history_command,
+                                3,
+                                """ <series> <seconds> <resolution>\n
+      show the recorded min/avg/max of a series over the last seconds(default 300)\n
+      resolution is the minimum bucket length in seconds(1, 60 or 3600)\n
+      series: temp[0-2], power[0-2], percent[0-2], rpm[0-5]\n
+      example arguments: \n
+        history temp0 600 60\n
+      without argument list the recorded series""",
+                                False],
+                        "hsc":[self.i2c_sub_command,
+                                3,
+                                """<hsc number([0-4])> <info type(power,temp,alert,vin,vout,iout,all)> <max age(ms)>\n
+      read HSC input power, temperature, STATUS_WORD, input/output voltage, output current\n
+      decoded from PMBus LINEAR11/LINEAR16, served by the backend cache when fresh\n
+      4:ALL\n
       example arguments: \n
         hsc 1 power\n
         hsc 1 temp\n
         hsc 1 alert\n
-      read specified HSC power , temp ,alert""",
+        hsc 4 all""",
                                 False],
                         "i2c_block_write":[self.i2c_command,
                                 100,
@@ -130,14 +191,46 @@ class CMDManager(object):
       read the byte data from a specified device's register""",
                                 True],
                         "i2c_dump":[self.i2c_command,
-                                1,
-                                """<i2c_dev_addr>\n
-      dump the data from a specified smbus address""",
+                                4,
+                                """<i2c_dev_addr> <first reg> <last reg> <mode(b,w,i)>\n
+      dump the data from a specified smbus address, registers 0x00-0xff by default\n
+      mode b reads bytes(default), w reads words, i reads bytes in 32 bytes I2C blocks,\n
+      only for a device which auto-increments its register address(e.g. the MAX31790)\n
+      example arguments: \n
+        i2c_dump 0x2c 0x40 0x4f""",
                                 False],
                         "i2c_probe":[self.i2c_command,
+                                3,
+                                """<first addr> <last addr> <mode(auto,quick,read)>\n
+      probe to find physical addresses that ack, 0x03-0x77 by default\n
+      auto mode reads 0x30-0x37 and 0x50-0x5f and quick writes the others like i2cdetect""",
+                                False],
+                        "i2c_stats":[self.i2c_command,
                                 0,
                                 """No agrment need\n
-      probe to find physical addresses that ack""",
+      show the queue depth and wait times of the i2c bus arbiter in this process""",
+                                False],
+                        "snap":[self.snap_command,
+                                2,
+                                """<file> <devices>\n
+      save the registers of the board devices to a snapshot file\n
+      devices is a comma separated list of TMP451,MAX31790,FPGA,HSC0-HSC3,GPU0,GPU1, all by default\n
+      example arguments: \n
+        snap /tmp/before.snap MAX31790,FPGA""",
+                                False],
+                        "snapdiff":[self.snap_command,
+                                3,
+                                """<file> <other file> <devices>\n
+      show the registers which differ between two snapshots, or between a snapshot and the board\n
+      when the other file is omitted or -""",
+                                False],
+                        "snaprestore":[self.snap_command,
+                                3,
+                                """<file> <devices> <dry>\n
+      write back the writable registers(MAX31790 configuration and targets, TMP451 configuration\n
+      and limits) which differ from a snapshot, dry only shows the writes; the fan control of the\n
+      daemon rewrites its own PWM targets on its next cycle, a separate fan_control process on its\n
+      next resync. devices - stands for all of them""",
                                 False],
                         "ip":[self.ip_command,
                                 0,
@@ -145,7 +238,43 @@ class CMDManager(object):
       show the ip address of current openBMC RPI module""",
                                 True],
                         }
+        # dbus client shared by the commands, connected on first use unless
+        # one is given (e.g. an in-process DBusClient of the daemon mode)
+        self._dbus = kwargs.get("dbus_client")
+        # shared memory board state, when the backend publishes one
+        self._state_plane = None
+        # I2C1 at interactive priority, behind the fan control and telemetry
+        self._i2c_bus = None
+        # the shell server runs the commands of several sessions at once
+        self._init_lock = threading.Lock()
      
+    def dbus_client(self):
+        with self._init_lock:
+            if self._dbus is None:
+                from openBMC.dbus_backend import DBusClient
+                self._dbus = DBusClient()
+        return self._dbus
+
+    def i2c_bus(self):
+        with self._init_lock:
+            if self._i2c_bus is None:
+                self._i2c_bus = i2c_arbiter(1).client(PRIORITY_INTERACTIVE)
+        return self._i2c_bus
+
+    def get_state_many(self,requests):
+        # read [(index,type), ...] from the state plane without a dbus round trip,
+        # or from the backend when there is no state plane
+        if self._state_plane is None:
+            self._state_plane = open_state_plane()
+        if self._state_plane is not None:
+            try:
+                values = self._state_plane.read()[1]
+                return [values[self._state_plane.slots[(type,index)]] for index,type in requests]
+            except Exception as err:
+                logging.error(err)
+        from openBMC.fan_control import get_dbus_data_many
+        return get_dbus_data_many(requests,self.dbus_client())
+
     def add_cmd(self,cmd_name,*args):
         if not self.search_cmd(cmd_name):
             self.cmd_list[cmd_name] = []
@@ -171,16 +300,17 @@ class CMDManager(object):
             return False
 
     def apply_cmd(self,cmd_name,serial=None,*args):
+        # return False when the command is unknown, its arguments are not
+        # valid, it raised or returned -1
         if self.search_cmd(cmd_name):
             #print(len(args),args)
             if len(args) <= self.cmd_list[cmd_name][1]:
                 f = self.cmd_list[cmd_name][0]
                 try:
+                    ret = f(cmd_name,serial,*args)
                     if self.cmd_list[cmd_name][3]:
-                        ret = f(cmd_name,serial,*args)
                         show(str(ret),serial)
-                    else:
-                        f(cmd_name,serial,*args)
+                    return ret != -1
                 except Exception as err:
                     logging.error(err)
             else:
@@ -188,6 +318,7 @@ class CMDManager(object):
 
         else:
             show("this {} is not in the commad list\n".format(cmd_name),serial)
+        return False
 
 
     def help_command(self,name,serial=None,cmd_name=None):
@@ -209,7 +340,8 @@ class CMDManager(object):
         return 1.0
 
     def dmesg_command(self,name,serial=None):
-        os.system("dmesg")
+        # captured so the log reaches the serial or socket client, not our stdout
+        show(subprocess.check_output(["dmesg"]).decode("utf-8","replace"),serial)
 
     def smbpbi_command(self,name,serial=None,*args):
         if len(args) <3:
@@ -218,23 +350,30 @@ class CMDManager(object):
         address = int(args[0],0)
         data_in = int(args[1],0)
         command_in = int(args[2],0)
-        dbus_iface = dbus.Interface(dbus.SystemBus().get_object('com.openBMC.RPI','/RPI'),'com.openBMC.RPI')
-        pre_user_status = []
-
-        for i in range(3):
-            pre_user_status.append(get_dbus_data(i,"user",dbus_iface))
-            set_dbus_data(i,"user",1,dbus_iface)
-        val,status = smbpbi_read(address,command_in,None,data_in)
-        for i in range(3):
-            set_dbus_data(i,"user",pre_user_status.pop(0),dbus_iface)
-        if status == 0x1f:
+        val,status = self.smbpbi_read(address,command_in,data_in)
+        if status == SMBPBI_STATUS_SUCCESS:
             return val
-        elif status == 0x08:
+        elif status == SMBPBI_STATUS_NOT_SUPPORTED:
             show("Requested parameter is not supported on given configuration.\n",serial)
         return -1
 
 
+    def smbpbi_read(self,address,command,data_in=0x0):
+        # the bus arbiter keeps the mailbox sequence atomic against the fan
+        # control, which no longer has to be paused around it
+        return smbpbi_session(self.i2c_bus()).read(address,command,data_in)
+
+    def read_hsc_sensors(self,index):
+        # {sensor name: value} of one HSC read in one bus batch
+        values = read_hsc(self.i2c_bus(),HSC_ADDRESSES[index])
+        return dict(("HSC{0}_{1}".format(index,kind),values[kind]) for kind in HSC_SENSOR_KINDS)
+
+    def max_age(self,args,index):
+        # optional max age(ms) argument of the cached sensor commands
+        return float(args[index]) if len(args) > index else SENSOR_CACHE_MAX_AGE
+
     def smbpbi_sub_command(self,name,serial=None,*args):
+        from openBMC.fan_control import smbpbi_power,gpu_power_command,GPU0_7bit_ADDR,GPU1_7bit_ADDR
         if name == "power":
             if len(args) <1:
                 show("Error: invalid argument\n",serial)
@@ -249,17 +388,21 @@ class CMDManager(object):
             else:
                 address = GPU1_7bit_ADDR
             try:
-                val = self.smbpbi_command(None,None,str(address),"0x0","0x80000004")
-                return val
+                # served by the backend cache, the bus is only read when it is stale
+                val = read_through(self.dbus_client(),"GPU{}_POWER".format(gpu_index),
+                                   lambda: smbpbi_power(*self.smbpbi_read(address,gpu_power_command)),
+                                   self.max_age(args,1))
+                return int(val)
             except Exception as err:
                 logging.error(err)
                 return -1
        
     def dbus_command(self,name,serial=None,*args):
+        from openBMC.fan_control import set_dbus_data_many,pwm_reqest_set
         gpu_index = None
         percent = None
-        bus = smbus.SMBus(1)
-        dbus_iface = dbus.Interface(dbus.SystemBus().get_object('com.openBMC.RPI','/RPI'),'com.openBMC.RPI')
+        bus = self.i2c_bus()
+        dbus_iface = self.dbus_client()
         if name == "pwm":
             if len(args) <2:
                 show("error, must specify PWM index 0-3 and duty cycle 0-100\n",serial)
@@ -273,13 +416,7 @@ class CMDManager(object):
                 percent = 100
             elif percent < 0:
                 percent = 0
-            if gpu_index == 3:
-                for i in range(3):
-                    set_dbus_data(i,"user",1,dbus_iface)
-                    pwm_reqest_set(i,percent,bus,dbus_iface)
-            else:
-                set_dbus_data(gpu_index,"user",1,dbus_iface)
-                pwm_reqest_set(gpu_index,percent,bus,dbus_iface)
+            pwm_reqest_set(gpu_index,percent,bus,dbus_iface,user=1)
 
         if name == "pwm_restore":
             if len(args) <1:
@@ -289,11 +426,8 @@ class CMDManager(object):
             if gpu_index > 3 or gpu_index < 0:
                 show("Error: invalid PWM index\n",serial)
                 return -1
-            if gpu_index == 3:
-                for i in range(3):
-                    set_dbus_data(i,"user",0,dbus_iface)
-            else:
-                set_dbus_data(gpu_index,"user",0,dbus_iface)
+            groups = range(3) if gpu_index == 3 else [gpu_index]
+            set_dbus_data_many([(i,"user",0) for i in groups],dbus_iface)
 
         if name == "get_pwm":
             if len(args) <1:
@@ -304,40 +438,144 @@ class CMDManager(object):
                 show("Error: invalid PWM index\n",serial)
                 return -1
             if gpu_index == 3:
+                percents = self.get_state_many([(i,"percent") for i in range(3)])
                 for i in range(3):
-                    show("{0}: {1}%\n".format(i,get_dbus_data(i,"percent",dbus_iface)),serial)
+                    show("{0}: {1}%\n".format(i,percents[i]),serial)
             else:
-                show("{}%".format(get_dbus_data(gpu_index,"percent",dbus_iface)),serial)
+                show("{}%".format(self.get_state_many([(gpu_index,"percent")])[0]),serial)
+
+        if name == "fan":
+            if len(args) <1:
+                show("Error: invalid argument\n",serial)
+                return -1
+            fan_index = int(args[0])
+            if fan_index > MAX31790_CHANNELS or fan_index < 0:
+                show("Error: invalid fan index\n",serial)
+                return -1
+            fans = range(MAX31790_CHANNELS) if fan_index == MAX31790_CHANNELS else [fan_index]
+            values = self.get_state_many([(i,"rpm") for i in fans] + [(i,"fan_status") for i in fans])
+            for i,rpm,status in zip(fans,values[:len(fans)],values[len(fans):]):
+                show("FAN{0}: {1:5d} RPM  {2}\n".format(i,rpm,FAN_STATUS_NAMES.get(status,"unknown")),serial)
     
+    def watch_command(self,name,serial=None,*args):
+        try:
+            fields = watch_fields(args[0] if len(args) > 0 and args[0] != "-" else WATCH_DEFAULT)
+            interval = max(WATCH_MIN_INTERVAL,int(args[1],0)) if len(args) > 1 else WATCH_INTERVAL
+            count = int(args[2],0) if len(args) > 2 else 0
+        except ValueError as err:
+            show("Error: {}\n".format(err),serial)
+            return -1
+        # the serial console nothing else reads stops on any key, a writer which
+        # cancels its command stops on Ctrl-C or when the client goes away
+        keys = getattr(serial,"in_waiting",None) is not None
+        if not count and not keys and not getattr(serial,"cancellable",False):
+            show("Error: watch needs a sample count here\n",serial)
+            return -1
+        requests = [(index,type) for key,type,index in fields]
+        encoder = DeltaEncoder([key for key,type,index in fields])
+        show(encoder.header(interval),serial)
+        ticks = 0
+        dropped = 0
+        sample = 0
+        deadline = time.time()
+        while not count or sample < count:
+            if keys and serial.in_waiting:
+                serial.read(serial.in_waiting)
+                break
+            # the values the control loop published last, no bus access
+            values = self.get_state_many(requests)
+            ticks += 1
+            if getattr(serial,"out_waiting",0) > WATCH_BACKLOG_MAX:
+                # conflate: the next line carries every change since the last one sent
+                dropped += 1
+            else:
+                line = encoder.encode(values,ticks,dropped)
+                if line:
+                    show(line + "\n",serial)
+                    ticks = 0
+                    dropped = 0
+                elif serial:
+                    # nothing to send, but a cancelled command stops on any write
+                    show("",serial)
+            sample += 1
+            deadline = max(deadline + interval / 1000.0,time.time() - interval / 1000.0)
+            time.sleep(max(0,deadline - time.time()))
+
+    def script_command(self,name,serial=None,*args):
+        json_lines = len(args) > 0 and args[0] == "--json"
+        if json_lines:
+            args = args[1:]
+        if len(args) < 1:
+            show("Need {}\n".format("script file" if name == "batch" else "commands"),serial)
+            return -1
+        try:
+            if name == "batch":
+                with open(args[0]) as script_file:
+                    text = script_file.read()
+            else:
+                text = " ".join(args)
+            steps = parse_script(text)
+        except (IOError, OSError, ValueError) as err:
+            show("Error: {}\n".format(err),serial)
+            return -1
+        if not ScriptRunner(self,serial,json_lines).run(steps):
+            return -1
+
+    def history_command(self,name,serial=None,*args):
+        dbus_iface = self.dbus_client()
+        if len(args) < 1:
+            names = dbus_iface.call("get_history_names")
+            show(" ".join(names) + "\n",serial)
+            return
+        seconds = float(args[1]) if len(args) > 1 else 300
+        resolution = float(args[2]) if len(args) > 2 else 0
+        end = time.time()
+        buckets = dbus_iface.call("get_history",args[0],end - seconds,end,resolution)
+        if not buckets:
+            show("no history recorded for {}\n".format(args[0]),serial)
+            return
+        lines = "time          min      avg      max\n"
+        for t,vmin,avg,vmax in buckets:
+            lines += "{0}  {1:7.1f}  {2:7.1f}  {3:7.1f}\n".format(time.strftime("%m-%d %H:%M:%S",time.localtime(t)),vmin,avg,vmax)
+        show(lines,serial)
+
     def i2c_sub_command(self,name,serial=None,*args):
+        from openBMC.fan_control import smbpbi_temp,gpu_temp_command,TMP451_7bit_ADDR,GPU0_7bit_ADDR,GPU1_7bit_ADDR
         if name == "hsc":
-            address_list = [0x40,0x42,0x44,0x46]
+            # info type -> sensor kind, unit
+            info_types = {"power":("PIN","W"),"temp":("TEMP","C"),"vin":("VIN","V"),"vout":("VOUT","V"),
+                          "iout":("IOUT","A"),"alert":("STATUS",None),"all":(None,None)}
             if len(args) <2:
-                show("Need HSC Number([0-3]),info_type(power,temp,alert)\n",serial)
+                show("Need HSC Number([0-4]),info_type(power,temp,alert,vin,vout,iout,all)\n",serial)
                 return -1
-            if int(args[0]) > 3 and int(args[0]) <0:
-                show("Error, HSC parameters wrong. Only support [0-3]\n",serial)
+            index = int(args[0])
+            if index > len(HSC_ADDRESSES) or index < 0:
+                show("Error, HSC parameters wrong. Only support [0-4]\n",serial)
                 return -1
-            address = address_list[int(args[0])]
-            if args[1] == "temp":
-                offset = 0x8d
-            elif args[1] == "power":
-                offset = 0x97
-            elif args[1] == "alert":
-                offset = 0x79
-            else:
-                show("Error, info type parameters wrong. Only support power,temp,alert\n",serial)
+            if args[1] not in info_types:
+                show("Error, info type parameters wrong. Only support power,temp,alert,vin,vout,iout,all\n",serial)
                 return -1
-            try:
-                val = self.i2c_command("i2c_word_read",serial,address,offset)
-                if args[1] == "temp":
-                    show("HSC 0x{0:02x}  0x{1:02x}:   {2} C".format(address,offset,(val&0xff)+((val&0xff00)>>8)*256),serial)
-                elif args[1] == "power":
-                    show("HSC 0x{0:02x}  0x{1:02x}:   {2} w".format(address,offset,(val&0xff)+((val&0xff00)>>8)*256),serial)
-                elif args[1] == "alert":
-                    show("HSC 0x{0:02x}  0x{1:02x}:   0x{3:02X}{2:02X}".format(address,offset,(val&0xff),((val&0xff00)>>8)),serial)          
-            except Exception as err:
-                show(err,serial)
+            kind,unit = info_types[args[1]]
+            hscs = range(len(HSC_ADDRESSES)) if index == len(HSC_ADDRESSES) else [index]
+            for index in hscs:
+                address = HSC_ADDRESSES[index]
+                names = ["HSC{0}_{1}".format(index,sensor_kind) for sensor_kind in HSC_SENSOR_KINDS]
+                try:
+                    # one bus batch refreshes every reading of the HSC in the backend cache
+                    values = dict(zip(HSC_SENSOR_KINDS,read_through_many(
+                        self.dbus_client(),names,lambda index=index: self.read_hsc_sensors(index),
+                        self.max_age(args,2))))
+                except Exception as err:
+                    show("HSC{0} 0x{1:02x}: {2}\n".format(index,address,err),serial)
+                    continue
+                if kind is None:
+                    show(format_hsc(index,address,values),serial)
+                elif kind == "STATUS":
+                    status = int(values[kind])
+                    show("HSC{0} 0x{1:02x}: STATUS_WORD 0x{2:04x} {3}\n".format(
+                        index,address,status," ".join(status_names(status)) or "ok"),serial)
+                else:
+                    show("HSC{0} 0x{1:02x}: {2:.3f} {3}\n".format(index,address,values[kind],unit),serial)
 
         if name == "temp":
             if len(args) <1:
@@ -347,21 +585,17 @@ class CMDManager(object):
             if gpu_index > 3 and gpu_index <0:
                 show("Error: invalid gpu index\n",serial)
                 return -1
-            if gpu_index == 0:
-                address = GPU0_7bit_ADDR
-                offset = 0
-            elif gpu_index == 1:
-                address = GPU1_7bit_ADDR
-                offset = 0
+            if gpu_index == 2:
+                sensor = "LR_TEMP"
+                read = lambda: self.i2c_command("i2c_byte_read",serial,TMP451_7bit_ADDR,1) - 64
             else:
-                address = TMP451_7bit_ADDR
-                offset = 1
+                address = GPU0_7bit_ADDR if gpu_index == 0 else GPU1_7bit_ADDR
+                sensor = "GPU{}_TEMP".format(gpu_index)
+                read = lambda: smbpbi_temp(*self.smbpbi_read(address,gpu_temp_command))
             try:
-                val = self.i2c_command("i2c_byte_read",serial,address,offset)
-                if gpu_index == 2:
-                    show("{0:3d} C".format(val-64),serial)
-                else:
-                    show("{0:3d} C".format(val),serial)          
+                # served by the backend cache, the bus is only read when it is stale
+                val = read_through(self.dbus_client(),sensor,read,self.max_age(args,1))
+                show("{0:3d} C".format(int(val)),serial)
             except Exception as err:
                 show(err,serial)
 
@@ -373,19 +607,41 @@ class CMDManager(object):
         offset = None
         count = None
         # get i2c1 bus
-        bus =  smbus.SMBus(1)
+        bus = self.i2c_bus()
         if name == "i2c_probe":
-            if len(args) > 0:
-                show("error, no need argument\n",serial)
+            first = int(args[0],0) if len(args) > 0 else I2C_PROBE_FIRST
+            last = int(args[1],0) if len(args) > 1 else I2C_PROBE_LAST
+            mode = args[2] if len(args) > 2 else "auto"
+            if first < 0 or last > 0x7f or first > last:
+                show("Error: invalid address range\n",serial)
                 return -1
-            os.system("i2cdetect -y 1")
+            # every address is its own transaction, the fan control can run in between
+            found = i2c_probe(bus,first,last,mode)
+            show(i2c_probe_table(found,first,last),serial)
 
         if name == "i2c_dump":
             if len(args) < 1:
                 show("Need i2c_dev_addr\n",serial)
                 return -1
             address = int(args[0],0)
-            os.system("i2cdump -y 1 {}".format(address))
+            first = int(args[1],0) if len(args) > 1 else 0x00
+            last = int(args[2],0) if len(args) > 2 else 0xff
+            mode = args[3] if len(args) > 3 else "b"
+            if first < 0 or last > 0xff or first > last:
+                show("Error: invalid register range\n",serial)
+                return -1
+            values = i2c_dump(bus,address,first,last,mode)
+            show(i2c_dump_table(values,first,last,mode),serial)
+
+        if name == "i2c_stats":
+            stats = bus.arbiter.stats()
+            lines = "queue depth: {0}  max: {1}  longest hold: {2:.1f} ms\n".format(
+                stats["queue_depth"],stats["max_queue_depth"],stats["hold_max"])
+            for priority in sorted(PRIORITY_NAMES):
+                entry = stats[PRIORITY_NAMES[priority]]
+                lines += "{0:12s} batches: {1:6d}  wait avg: {2:7.2f} ms  max: {3:7.2f} ms\n".format(
+                    PRIORITY_NAMES[priority],entry["batches"],entry["wait_avg"],entry["wait_max"])
+            show(lines,serial)
              
         if name == "i2c_byte_read":
             if len(args) < 2:
@@ -452,6 +708,50 @@ class CMDManager(object):
                 show("the count is not equal to value list num\n",serial)
        
 
+    def snap_command(self,name,serial=None,*args):
+        if len(args) < 1:
+            show("Need snapshot file\n",serial)
+            return -1
+        path = args[0]
+        devices_arg = {"snap":1,"snapdiff":2,"snaprestore":1}[name]
+        try:
+            devices = snapshot_devices(args[devices_arg].split(",") if len(args) > devices_arg and args[devices_arg] != "-" else None)
+        except ValueError as err:
+            show("Error: {}\n".format(err),serial)
+            return -1
+        bus = self.i2c_bus()
+        try:
+            if name == "snap":
+                start = time.time()
+                snapshot = Snapshot.capture(bus,devices)
+                snapshot.save(path)
+                show("{0} registers of {1} devices saved to {2} in {3:.0f} ms\n".format(
+                    len(snapshot.entries),len(devices),path,(time.time() - start) * 1000),serial)
+            elif name == "snapdiff":
+                old = Snapshot.load(path).only(devices)
+                if len(args) > 1 and args[1] != "-":
+                    new = Snapshot.load(args[1]).only(devices)
+                else:
+                    new = Snapshot.capture(bus,devices)
+                gone,added = snapshot_missing(old,new)
+                lines = format_diff(snapshot_diff(old,new))
+                if gone:
+                    lines += "only in {0}: {1}\n".format(path,",".join(gone))
+                if added:
+                    lines += "only in {0}: {1}\n".format(args[1] if len(args) > 1 and args[1] != "-" else "board",",".join(added))
+                show(lines,serial)
+            elif name == "snaprestore":
+                dry_run = len(args) > 2 and args[2] == "dry"
+                writes = snapshot_restore(bus,Snapshot.load(path),devices,dry_run)
+                lines = ""
+                for address,register,data in writes:
+                    lines += "0x{0:02x} 0x{1:02x}: {2}\n".format(
+                        address,register," ".join("{0:02x}".format(value) for value in data))
+                show(lines + "{0} writes{1}\n".format(len(writes)," (dry run)" if dry_run else ""),serial)
+        except (IOError, OSError, ValueError) as err:
+            show("Error: {}\n".format(err),serial)
+            return -1
+
     def ip_command(self,name,serial=None):
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -464,13 +764,54 @@ class CMDManager(object):
 
 if __name__ == '__main__':
     # python terminal_cmd.py cmd_name arg1 arg2 arg3 
-    terminal_command = CMDManager()
-    if len(sys.argv) == 1:
-        terminal_command.apply_cmd("help")
+    # python terminal_cmd.py --serve [socket path] runs the resident command
+    # server, the commands are then forwarded to it instead of run here
+    # python terminal_cmd.py [--json] --batch <script file or - for stdin>
+    # python terminal_cmd.py [--json] -e "cmd arg; cmd arg" run a script in one session
+    from openBMC.cmd_server import CmdServer,CmdClient
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        server = CmdServer(CMDManager(),*sys.argv[2:3])
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        sys.exit(0)
+    argv = sys.argv[1:]
+    json_args = ()
+    if argv and argv[0] == "--json":
+        json_args = ("--json",)
+        argv = argv[1:]
+    if len(argv) == 0:
+        CMDManager().apply_cmd("help")
         sys.exit(0)
-    cmd_name = sys.argv[1]
-    args = tuple(sys.argv[2:])
+    if argv[0] == "batch" and len(argv) > 1:
+        # the batch command too, the command server refuses to open files
+        if argv[1] == "--json":
+            json_args = ("--json",)
+            argv = argv[1:]
+        argv = ["--batch"] + argv[1:]
+    if argv[0] in ("--batch","-e") and len(argv) == 2:
+        # the script is read here and sent as text, so stdin and relative
+        # paths work with the command server too, which reads no file
+        if argv[0] == "-e":
+            text = argv[1]
+        elif argv[1] == "-":
+            text = sys.stdin.read()
+        else:
+            with open(argv[1]) as script_file:
+                text = script_file.read()
+        cmd_name = "run"
+        args = json_args + (text,)
+    else:
+        cmd_name = argv[0]
+        args = tuple(argv[1:])
    # print(sys.argv)
-    terminal_command.apply_cmd(cmd_name,None,*args)
-
-    
+    try:
+        client = CmdClient()
+    except socket.error:
+        ok = CMDManager().apply_cmd(cmd_name,None,*args)
+        sys.exit(0 if ok or cmd_name != "run" else 1)
+    else:
+        output = client.run(cmd_name,*args)
+        client.close()
+        sys.stdout.write(output if output.endswith("\n") else output + "\n")
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+
+class ThermalZone(object):
+    '''One fan group driven from a set of temperature sensors.
+
+    sensors are names of the PollingEngine sensors, the zone temperature is
+    the hottest valid one. channels are the MAX31790 PWM channels of the
+    zone. power_good is the index of the zone in FpgaStatus.pwr_good_set();
+    while the zone is not powered the fans run at off_percent. After
+    fail_limit cycles without any valid reading they go to failsafe_percent.
+    '''
+
+    def __init__(self, name, sensors, channels, curve, power_good=None,
+                 off_percent=20, failsafe_percent=80, fail_limit=5):
+        self.name = name
+        self.sensors = list(sensors)
+        self.channels = list(channels)
+        self.curve = curve
+        self.power_good = power_good
+        self.off_percent = off_percent
+        self.failsafe_percent = failsafe_percent
+        self.fail_limit = fail_limit
+        # runtime state
+        self.fail_times = 0
+        self.temp = -1
+
+    @classmethod
+    def from_config(cls, config, curve):
+        '''build a zone from a dict of the zone table'''
+        return cls(config["name"], config["sensors"], config["channels"], curve,
+                   power_good=config.get("power_good"),
+                   off_percent=config.get("off_percent", 20),
+                   failsafe_percent=config.get("failsafe_percent", 80),
+                   fail_limit=config.get("fail_limit", 5))
+
+    def read_temp(self, sensor_value):
+        '''return the hottest valid sensor value, -1 when none is valid'''
+        temps = [sensor_value(name) for name in self.sensors]
+        valid = [temp for temp in temps if temp != -1]
+        return max(valid) if valid else -1
+
+    def evaluate(self, powered, user, percent, sensor_value):
+        '''return the duty cycle of this cycle, percent is the current one'''
+        # the temperature is tracked in every mode so it can be published
+        self.temp = self.read_temp(sensor_value) if powered else -1
+        if not powered:
+            return self.off_percent
+        if user:
+            return percent
+        temp = self.temp
+        if temp == -1:
+            self.fail_times = self.fail_times + 1
+            if self.fail_times == self.fail_limit:
+                print("{0} reading failed {1} times, set fan speed to {2}%\n".format(
+                    self.name, self.fail_limit, self.failsafe_percent))
+                return self.failsafe_percent
+            return percent
+        print("{0} temp is {1}".format(self.name, temp))
+        if self.fail_times > 0:
+            self.fail_times = 0
+            print("{} reading recovered, and fan control enabled again!\n".format(self.name))
+        return self.curve(temp)
+
+
+class ThermalEngine(object):
+    '''Evaluate every thermal zone in one pass.
+
+    The zone index is its group index in the backend. exchange([(index,
+    type, value), ...], [(index, type), ...]) applies the updates and
+    returns the requested backend values, set_many([(index, type, value),
+    ...]) only updates them, each in one round trip. All zones are
+    evaluated first, then every PWM channel is staged into the MAX31790 and
+    written in a single flush, and only the duty cycles and zone
+    temperatures that changed are published, so a cycle where nothing
+    changed costs a single round trip. expired() tells whether the cycle
+    ran out of its budget; the fans are written anyway, the zone
+    temperatures then wait for the next cycle.
+    '''
+
+    def __init__(self, zones, fan, exchange, set_many, expired=None):
+        self.zones = list(zones)
+        self.fan = fan
+        self.exchange = exchange
+        self.set_many = set_many
+        self.expired = expired if expired is not None else (lambda: False)
+        self.deferred = 0
+        self.published = [None] * len(self.zones)
+        self.published_temp = [None] * len(self.zones)
+
+    def evaluate(self, pwr_good_set, sensor_value, updates=()):
+        '''run one control cycle, return the duty cycle of every zone.
+        updates are other backend updates sent along with the zones state read'''
+        count = len(self.zones)
+        values = self.exchange(list(updates),
+                               [(index, "user") for index in range(count)] +
+                               [(index, "percent") for index in range(count)])
+        users, percents = values[:count], values[count:]
+        duties = []
+        for index, zone in enumerate(self.zones):
+            powered = zone.power_good is None or pwr_good_set[zone.power_good] != 0
+            duty = zone.evaluate(powered, users[index] != 0, percents[index], sensor_value)
+            print("{0} duty percent is {1}".format(zone.name, duty))
+            duties.append(duty)
+        updates = self.apply(duties)
+        if self.expired():
+            # still unpublished, so they go out with the next cycle
+            self.deferred += 1
+        else:
+            for index, zone in enumerate(self.zones):
+                if self.published_temp[index] != zone.temp:
+                    updates.append((index, "temp", zone.temp))
+                    self.published_temp[index] = zone.temp
+        if updates:
+            self.set_many(updates)
+        return duties
+
+    def apply(self, duties):
+        '''write the duty cycles, return the backend updates they need'''
+        for zone, duty in zip(self.zones, duties):
+            if duty is None or duty < 0:
+                # nothing known yet for this zone, leave its fans alone
+                continue
+            for channel in zone.channels:
+                self.fan.set_pwm(channel, duty)
+        # only the channels which changed reach the bus, in as few blocks as possible
+        self.fan.flush()
+        if self.fan.resynced:
+            self.published = [None] * len(self.zones)
+        updates = []
+        for index, duty in enumerate(duties):
+            if duty is not None and duty >= 0 and self.published[index] != duty:
+                updates.append((index, "percent", duty))
+                self.published[index] = duty
+        return updates
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# state types a watch can stream and the letter of their fields
+WATCH_TYPES = [("percent", "p"), ("temp", "t"), ("power", "w"), ("user", "u"), ("rpm", "r"), ("fan_status", "f"),
+               ("hsc_power", "h"), ("hsc_temp", "c"), ("hsc_status", "s")]
+# names accepted for the state types
+WATCH_ALIASES = {"pwm": "percent", "percent": "percent", "temp": "temp", "power": "power", "user": "user",
+                 "rpm": "rpm", "fan": "rpm", "status": "fan_status", "fan_status": "fan_status",
+                 "hsc": "hsc_power", "hsc_power": "hsc_power", "hsc_temp": "hsc_temp", "hsc_status": "hsc_status"}
+WATCH_DEFAULT = "temp,pwm,rpm"
+WATCH_INTERVAL = 1000
+WATCH_MIN_INTERVAL = 100
+# a full line is sent after this many delta lines, so a late reader resyncs
+WATCH_KEYFRAME = 30
+# a sample is dropped while more output than this waits for the UART
+WATCH_BACKLOG_MAX = 256
+
+
+def watch_fields(spec=WATCH_DEFAULT, layout=None):
+    '''parse "temp,pwm1,rpm" into [(key, type, index)], e.g. ("p1", "percent", 1)'''
+    if layout is None:
+        from openBMC.state_plane import STATE_LAYOUT as layout
+    counts = dict(layout)
+    letters = dict(WATCH_TYPES)
+    fields = []
+    for item in spec.split(","):
+        name = item.rstrip("0123456789")
+        type = WATCH_ALIASES.get(name.lower())
+        if type is None:
+            raise ValueError("unknown watch field {}".format(item))
+        if name == item:
+            indexes = range(counts[type])
+        else:
+            indexes = [int(item[len(name):])]
+            if indexes[0] >= counts[type]:
+                raise ValueError("no {0} {1}".format(type, indexes[0]))
+        for index in indexes:
+            field = ("{0}{1}".format(letters[type], index), type, index)
+            if field not in fields:
+                fields.append(field)
+    return fields
+
+
+class DeltaEncoder(object):
+    '''Compact lines of the fields which changed since the last line sent.
+
+    A field is "key=value" or "key+delta"/"key-delta", whichever is
+    shorter. A line starts with "+N" when N samples passed since the last
+    line (1 is left out) and "~N" when N samples were dropped; a line
+    starting with "=" carries every field.
+    '''
+
+    def __init__(self, keys, keyframe=WATCH_KEYFRAME):
+        self.keys = keys
+        self.keyframe = keyframe
+        self.sent = None
+        self._deltas = 0
+
+    def header(self, interval):
+        return "# {0} every {1} ms\n".format(" ".join(self.keys), interval)
+
+    def encode(self, values, ticks=1, dropped=0):
+        '''return the line of values, None when nothing changed'''
+        prefix = []
+        if ticks > 1:
+            prefix.append("+{}".format(ticks))
+        if dropped:
+            prefix.append("~{}".format(dropped))
+        full = ["{0}={1}".format(key, value) for key, value in zip(self.keys, values)]
+        if self.sent is None or self._deltas >= self.keyframe:
+            self.sent = list(values)
+            self._deltas = 0
+            return " ".join(["="] + prefix + full)
+        changes = []
+        for i, (key, value) in enumerate(zip(self.keys, values)):
+            if value == self.sent[i]:
+                continue
+            delta = "{0}{1:+d}".format(key, value - self.sent[i])
+            changes.append(delta if len(delta) < len(full[i]) else full[i])
+        if not changes:
+            return None
+        self.sent = list(values)
+        self._deltas += 1
+        return " ".join(prefix + changes)
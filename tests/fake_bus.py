@@ -0,0 +1,52 @@
+class FakeBus(object):
+    '''smbus.SMBus look-alike over a register file per device address.
+
+    Words are little endian like SMBus, low byte at the register. A block
+    transaction of a device in auto_increment steps the register pointer,
+    any other device reads its first register again and takes every byte
+    written into its first register, like a part without auto-increment.
+    Every transaction is appended to log as (method, address, register,
+    value); an address without registers doesn't answer.
+    '''
+
+    def __init__(self, registers=None, auto_increment=()):
+        self.registers = registers if registers is not None else {}
+        self.auto_increment = set(auto_increment)
+        self.log = []
+        # method names which raise IOError
+        self.failing = set()
+
+    def _device(self, method, address, register, value=None):
+        self.log.append((method, address, register, value))
+        if method in self.failing or address not in self.registers:
+            raise IOError(121, "Remote I/O error")
+        return self.registers[address]
+
+    def writes(self):
+        return [entry for entry in self.log if entry[0].startswith("write")]
+
+    def read_byte_data(self, address, register):
+        return self._device("read_byte_data", address, register).get(register, 0)
+
+    def write_byte_data(self, address, register, value):
+        self._device("write_byte_data", address, register, value)[register] = value
+
+    def read_word_data(self, address, register):
+        device = self._device("read_word_data", address, register)
+        return device.get(register, 0) | (device.get(register + 1, 0) << 8)
+
+    def write_word_data(self, address, register, value):
+        device = self._device("write_word_data", address, register, value)
+        device[register] = value & 0xff
+        device[register + 1] = (value >> 8) & 0xff
+
+    def read_i2c_block_data(self, address, register, length=32):
+        device = self._device("read_i2c_block_data", address, register, length)
+        step = 1 if address in self.auto_increment else 0
+        return [device.get(register + step * i, 0) for i in range(length)]
+
+    def write_i2c_block_data(self, address, register, data):
+        device = self._device("write_i2c_block_data", address, register, list(data))
+        step = 1 if address in self.auto_increment else 0
+        for i, value in enumerate(data):
+            device[register + step * i] = value
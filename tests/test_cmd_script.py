@@ -0,0 +1,41 @@
+import unittest
+
+from openBMC.cmd_script import parse_script
+
+
+class ParseScriptTest(unittest.TestCase):
+
+    def test_commands_and_comments(self):
+        steps = parse_script("i2c_dump 0x48 # temperature\n\n  # a comment\nver; fan_status\n")
+        self.assertEqual(steps, [("cmd", ["i2c_dump", "0x48"], 1),
+                                 ("cmd", ["ver"], 4),
+                                 ("cmd", ["fan_status"], 4)])
+
+    def test_repeat_rest_of_line(self):
+        steps = parse_script("repeat 3 every 100 ms: smbpbi_read 0x4c 0x02; ver")
+        self.assertEqual(steps, [("repeat", 3, 100, [("cmd", ["smbpbi_read", "0x4c", "0x02"], 1),
+                                                     ("cmd", ["ver"], 1)])])
+
+    def test_repeat_after_a_command(self):
+        steps = parse_script("ver; repeat 2: fan_status")
+        self.assertEqual(steps, [("cmd", ["ver"], 1), ("repeat", 2, 0, [("cmd", ["fan_status"], 1)])])
+
+    def test_repeat_block(self):
+        steps = parse_script("repeat 2 every 5ms\n  ver\n  repeat 3\n    fan_status\n  end\nend\nhelp\n")
+        self.assertEqual(steps, [("repeat", 2, 5, [("cmd", ["ver"], 2),
+                                                   ("repeat", 3, 0, [("cmd", ["fan_status"], 4)])]),
+                                 ("cmd", ["help"], 7)])
+
+    def test_errors(self):
+        self.assertRaises(ValueError, parse_script, "ver\nend\n")
+        self.assertRaises(ValueError, parse_script, "repeat 2\nver\n")
+        self.assertRaises(ValueError, parse_script, "repeat twice: ver\n")
+        self.assertRaises(ValueError, parse_script, "repeat 2 every: ver\n")
+
+    def test_empty(self):
+        self.assertEqual(parse_script(""), [])
+        self.assertEqual(parse_script("# nothing\n ; ;\n"), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
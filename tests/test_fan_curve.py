@@ -0,0 +1,125 @@
+import unittest
+
+from openBMC.fan_curve import (CURVE_MAX_TEMP, CURVE_MIN_TEMP, FanCurve, HysteresisCurve, PidController,
+                               RpmLoop, compile_curves, curve_max_percent, zone_controller)
+
+# the default curve of fan_control.DEFAULT_CONFIG
+DEFAULT_POINTS = [[16, 10], [17, 10.2], [34, 20.4], [35, 42], [75, 90]]
+
+
+def profile_get_value(temp):
+    '''the former fan_control.profile_get_value, with the integer division
+    of python2 it ran under'''
+    percent = 90
+    if temp < 35:
+        percent = max(10, min(90, 60 * temp // 100))
+    elif temp < 100:
+        percent = max(10, min(90, 120 * temp // 100))
+    return percent
+
+
+class FanCurveTest(unittest.TestCase):
+
+    def test_default_curve_matches_the_former_profile(self):
+        curve = FanCurve(DEFAULT_POINTS)
+        for temp in range(CURVE_MIN_TEMP, CURVE_MAX_TEMP + 1):
+            self.assertEqual(curve(temp), profile_get_value(temp), "{} C".format(temp))
+
+    def test_default_config_curve(self):
+        try:
+            from openBMC.fan_control import DEFAULT_CONFIG
+        except ImportError as err:
+            self.skipTest("fan_control doesn't import here: {}".format(err))
+        self.assertEqual(DEFAULT_CONFIG["curves"]["default"]["points"], DEFAULT_POINTS)
+
+    def test_out_of_range_temperatures_are_clamped(self):
+        curve = FanCurve(DEFAULT_POINTS)
+        self.assertEqual(curve(-200), 10)
+        self.assertEqual(curve(1000), 90)
+        self.assertEqual(curve(40.9), curve(40))
+
+    def test_rpm_curve(self):
+        curve = FanCurve([(20, 2000), (60, 12000)], unit="rpm")
+        self.assertEqual(curve(40), 7000)
+        self.assertEqual(curve(100), 12000)
+
+    def test_a_curve_needs_points(self):
+        self.assertRaises(ValueError, FanCurve, [])
+
+
+class HysteresisTest(unittest.TestCase):
+
+    def test_falling_temperature_waits_for_the_hysteresis(self):
+        curve = HysteresisCurve(FanCurve(DEFAULT_POINTS), hysteresis=3)
+        self.assertEqual(curve(50), profile_get_value(50))
+        self.assertEqual(curve(48), profile_get_value(50))
+        self.assertEqual(curve(47), profile_get_value(47))
+        self.assertEqual(curve(49), profile_get_value(49))
+
+
+class PidTest(unittest.TestCase):
+
+    def test_proportional_only_has_no_bias(self):
+        pid = PidController(50, kp=2.0, min_percent=0)
+        for temp in (60, 70, 80, 70):
+            pid(temp)
+        self.assertEqual(pid.integral, 0.0)
+        self.assertEqual(pid(55), 10)
+        self.assertEqual(pid(50), 0)
+
+    def test_integral_is_clamped(self):
+        pid = PidController(50, kp=0.0, ki=10.0, max_percent=80, integral_limit=30)
+        for i in range(20):
+            percent = pid(90)
+        self.assertEqual(pid.integral, 30)
+        self.assertEqual(percent, 30)
+        # it unwinds from the limit at once
+        self.assertEqual(pid(49), 20)
+
+    def test_output_is_clamped(self):
+        pid = PidController(50, kp=10.0, min_percent=20, max_percent=70)
+        self.assertEqual(pid(90), 70)
+        self.assertEqual(pid(10), 20)
+
+
+class RpmLoopTest(unittest.TestCase):
+
+    def test_unknown_rpm_holds_the_duty_cycle(self):
+        rpm = [-1]
+        loop = RpmLoop(FanCurve([(20, 2000), (60, 12000)], unit="rpm"), lambda: rpm[0], max_percent=90)
+        self.assertEqual(loop(40), 90)
+        rpm[0] = 7000
+        held = loop(40)
+        rpm[0] = -1
+        self.assertEqual(loop(40), held)
+
+
+class ZoneControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.curves = compile_curves({"curves": {"default": {"points": DEFAULT_POINTS},
+                                                 "quiet": {"points": [[20, 10], [60, 60]]},
+                                                 "rpm": {"points": [[20, 2000], [60, 12000]], "unit": "rpm"}}})
+
+    def test_curve_max_percent(self):
+        self.assertEqual(curve_max_percent(self.curves, "default"), 90)
+        self.assertEqual(curve_max_percent(self.curves, "quiet"), 60)
+        self.assertEqual(curve_max_percent(self.curves, "rpm"), 90)
+        self.assertEqual(curve_max_percent({}, "default"), 100)
+
+    def test_closed_loops_stay_below_the_curve_ceiling(self):
+        pid = zone_controller({"curve": "quiet", "pid": {"setpoint": 50, "kp": 10.0}}, self.curves)
+        self.assertEqual(pid(100), 60)
+        pid = zone_controller({"pid": {"setpoint": 50, "kp": 10.0, "max_percent": 100}}, self.curves)
+        self.assertEqual(pid(100), 100)
+        rpm = zone_controller({"curve": "rpm", "mode": "rpm"}, self.curves, measured_rpm=lambda: -1)
+        self.assertEqual(rpm(40), 90)
+
+    def test_curve_zone(self):
+        zone = zone_controller({"hysteresis": 2}, self.curves)
+        self.assertIsInstance(zone, HysteresisCurve)
+        self.assertEqual(zone(50), profile_get_value(50))
+
+
+if __name__ == '__main__':
+    unittest.main()
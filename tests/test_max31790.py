@@ -0,0 +1,123 @@
+import unittest
+
+from openBMC import max31790
+from openBMC.i2c_arbiter import I2cArbiter, PRIORITY_CONTROL, PRIORITY_INTERACTIVE
+from openBMC.max31790 import (MAX31790, MAX31790_7bit_ADDR, MAX31790_CHANNELS, max31790_device,
+                              max31790_invalidate, max31790_pwm_word)
+from tests.fake_bus import FakeBus
+
+
+def fan_bus():
+    return FakeBus({MAX31790_7bit_ADDR: {}}, auto_increment=[MAX31790_7bit_ADDR])
+
+
+class FlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = fan_bus()
+        self.fan = MAX31790(self.bus, resync_every=0)
+
+    def flush(self, duties):
+        del self.bus.log[:]
+        for channel, percent in duties.items():
+            self.fan.set_pwm(channel, percent)
+        return self.fan.flush()
+
+    def test_adjacent_channels_are_one_block(self):
+        self.assertEqual(self.flush(dict((channel, 50) for channel in range(MAX31790_CHANNELS))), 1)
+        self.assertEqual([entry[:3] for entry in self.bus.writes()],
+                         [("write_i2c_block_data", MAX31790_7bit_ADDR, 0x40)])
+
+    def test_unchanged_channels_are_not_written(self):
+        self.flush({0: 50, 1: 50})
+        self.assertEqual(self.flush({0: 50, 1: 50}), 0)
+        self.assertEqual(self.bus.writes(), [])
+
+    def test_single_channel_is_a_word_write(self):
+        self.assertEqual(self.flush({3: 40}), 1)
+        self.assertEqual(self.bus.writes(),
+                         [("write_word_data", MAX31790_7bit_ADDR, 0x46, max31790_pwm_word(40))])
+
+    def test_known_clean_channel_is_bridged(self):
+        self.flush({0: 50, 1: 50, 2: 50})
+        self.assertEqual(self.flush({0: 60, 2: 60}), 1)
+        self.assertEqual(self.bus.writes()[0][:3], ("write_i2c_block_data", MAX31790_7bit_ADDR, 0x40))
+        self.assertEqual(self.fan._shadow[1], max31790_pwm_word(50))
+
+    def test_unknown_channel_is_not_bridged(self):
+        self.assertEqual(self.flush({0: 50, 2: 50}), 2)
+        self.assertEqual([entry[:3] for entry in self.bus.writes()],
+                         [("write_word_data", MAX31790_7bit_ADDR, 0x40),
+                          ("write_word_data", MAX31790_7bit_ADDR, 0x44)])
+
+    def test_block_carries_the_bytes_of_word_writes(self):
+        duties = {0: 10, 1: 35, 2: 50, 4: 75, 5: 100}
+        self.flush(duties)
+        words = fan_bus()
+        for channel, percent in duties.items():
+            words.write_word_data(MAX31790_7bit_ADDR, 0x40 + 2 * channel, max31790_pwm_word(percent))
+        blocks = self.bus.registers[MAX31790_7bit_ADDR]
+        for register, value in words.registers[MAX31790_7bit_ADDR].items():
+            self.assertEqual(blocks[register], value, hex(register))
+
+    def test_failed_write_drops_the_shadow(self):
+        self.flush({0: 50, 1: 50})
+        self.bus.failing.add("write_i2c_block_data")
+        self.assertRaises(IOError, self.flush, {0: 60, 1: 60})
+        self.assertEqual(self.fan._shadow[:2], [None, None])
+        self.bus.failing.clear()
+        self.assertEqual(self.flush({0: 60, 1: 60}), 1)
+
+    def test_invalidate_rewrites_the_channels(self):
+        self.flush({0: 50, 1: 50})
+        self.fan.invalidate([1])
+        self.assertEqual(self.flush({0: 50, 1: 50}), 1)
+        self.assertEqual(self.bus.writes()[0][:3], ("write_word_data", MAX31790_7bit_ADDR, 0x42))
+
+    def test_resync_rewrites_everything(self):
+        fan = MAX31790(self.bus, resync_every=2)
+        fan.set_pwm(0, 50)
+        fan.set_pwm(1, 50)
+        self.assertEqual(fan.flush(), 1)
+        self.assertFalse(fan.resynced)
+        self.assertEqual(fan.flush(), 1)
+        self.assertTrue(fan.resynced)
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arbiter = I2cArbiter(7, bus=fan_bus(), lock_path=None)
+
+    def tearDown(self):
+        max31790._devices.clear()
+
+    def test_clients_of_one_bus_share_the_driver(self):
+        loop = max31790_device(self.arbiter.client(PRIORITY_CONTROL))
+        shell = max31790_device(self.arbiter.client(PRIORITY_INTERACTIVE))
+        self.assertIs(loop, shell)
+        self.assertIsNot(loop, max31790_device(fan_bus()))
+
+    def test_flush_runs_at_the_priority_of_the_caller(self):
+        fan = max31790_device(self.arbiter.client(PRIORITY_CONTROL))
+        fan.set_pwm(0, 50)
+        fan.flush(self.arbiter.client(PRIORITY_INTERACTIVE))
+        self.assertEqual(self.arbiter.batches[PRIORITY_INTERACTIVE], 1)
+        self.assertEqual(self.arbiter.batches[PRIORITY_CONTROL], 0)
+        # the shared shadow knows the write of the other client
+        fan.set_pwm(0, 50)
+        self.assertEqual(fan.flush(), 0)
+
+    def test_invalidate_drops_every_shadow(self):
+        fans = [max31790_device(fan_bus()), max31790_device(fan_bus())]
+        for fan in fans:
+            fan.set_pwm(0, 50)
+            fan.flush()
+        max31790_invalidate()
+        for fan in fans:
+            fan.set_pwm(0, 50)
+            self.assertEqual(fan.flush(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
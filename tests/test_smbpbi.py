@@ -0,0 +1,126 @@
+import unittest
+
+from openBMC.smbpbi import (SMBPBI_STATUS_ACCEPTED, SMBPBI_STATUS_NOT_SUPPORTED, SMBPBI_STATUS_SUCCESS,
+                            SmbpbiScheduler, SmbpbiSession, smbpbi_frame, smbpbi_read)
+
+GPU0 = 0x4c
+GPU1 = 0x4d
+
+
+class GpuBus(object):
+    '''bus of fake GPUs answering their SMBPBI mailbox. statuses[address] are
+    the status bytes answered by successive 0x5c reads, the last one repeats'''
+
+    def __init__(self, statuses, data=None):
+        self.statuses = dict((address, list(answers)) for address, answers in statuses.items())
+        self.data = data or {}
+        self.log = []
+
+    def write_i2c_block_data(self, address, register, data):
+        self.log.append(("write", address, register, list(data)))
+        if address not in self.statuses:
+            raise IOError(121, "Remote I/O error")
+
+    def read_i2c_block_data(self, address, register, length=32):
+        self.log.append(("read", address, register))
+        if address not in self.statuses:
+            raise IOError(121, "Remote I/O error")
+        if register == 0x5d:
+            return smbpbi_frame(self.data.get(address, 0))
+        answers = self.statuses[address]
+        status = answers.pop(0) if len(answers) > 1 else answers[0]
+        return [0x04, 0, 0, 0, status]
+
+    def posts(self, address):
+        return [entry for entry in self.log if entry[0] == "write" and entry[1] == address and entry[2] == 0x5c]
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def run_one(self, bus, command=0x02, datain=0x0, **kwargs):
+        scheduler = SmbpbiScheduler(SmbpbiSession(bus), **kwargs)
+        key = scheduler.add(GPU0, command, datain)
+        return scheduler.run()[key]
+
+    def test_success(self):
+        bus = GpuBus({GPU0: [SMBPBI_STATUS_SUCCESS]}, {GPU0: 0x12345678})
+        self.assertEqual(self.run_one(bus, 0x02, 0x1), (0x12345678, SMBPBI_STATUS_SUCCESS))
+        self.assertEqual(bus.log[:2], [("write", GPU0, 0x5d, smbpbi_frame(0x1)),
+                                       ("write", GPU0, 0x5c, smbpbi_frame(0x02))])
+
+    def test_accepted_reposts_the_command(self):
+        bus = GpuBus({GPU0: [SMBPBI_STATUS_ACCEPTED, SMBPBI_STATUS_ACCEPTED, SMBPBI_STATUS_SUCCESS]},
+                     {GPU0: 0x2a00})
+        self.assertEqual(self.run_one(bus), (0x2a00, SMBPBI_STATUS_SUCCESS))
+        # the post and one re-post per accepted answer
+        self.assertEqual(bus.posts(GPU0), [("write", GPU0, 0x5c, smbpbi_frame(0x02))] * 3)
+
+    def test_accepted_until_the_deadline(self):
+        bus = GpuBus({GPU0: [SMBPBI_STATUS_ACCEPTED]})
+        self.assertEqual(self.run_one(bus, settle=0.001, poll_interval=0.001, timeout=0.005),
+                         (-1, SMBPBI_STATUS_ACCEPTED))
+        self.assertTrue(2 <= len(bus.posts(GPU0)) <= 7, bus.posts(GPU0))
+
+    def test_bus_error(self):
+        self.assertEqual(self.run_one(GpuBus({})), (-1, -1))
+
+    def test_devices_are_interleaved(self):
+        bus = GpuBus({GPU0: [SMBPBI_STATUS_ACCEPTED, SMBPBI_STATUS_SUCCESS],
+                      GPU1: [SMBPBI_STATUS_SUCCESS]}, {GPU0: 7, GPU1: 9})
+        results = SmbpbiSession(bus).read_many([(GPU0, 0x02, 0x0), (GPU1, 0x02, 0x0), (0x4e, 0x02, 0x0),
+                                                (GPU1, 0x03, 0x0)])
+        self.assertEqual(results, [(7, SMBPBI_STATUS_SUCCESS), (9, SMBPBI_STATUS_SUCCESS), (-1, -1),
+                                   (9, SMBPBI_STATUS_SUCCESS)])
+        # both devices are posted before the first status poll
+        first_read = [entry[0] for entry in bus.log].index("read")
+        self.assertEqual(set(entry[1] for entry in bus.log[:first_read]), set([GPU0, GPU1, 0x4e]))
+
+    def test_one_shot_read_returns_the_second_byte(self):
+        bus = GpuBus({GPU0: [SMBPBI_STATUS_SUCCESS]}, {GPU0: 0x00004100})
+        self.assertEqual(smbpbi_read(GPU0, 0x02, bus), (0x41, SMBPBI_STATUS_SUCCESS))
+
+
+class UnsupportedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bus = GpuBus({GPU0: [SMBPBI_STATUS_NOT_SUPPORTED]})
+        self.session = SmbpbiSession(self.bus, unsupported_ttl=60, clock=self.clock)
+
+    def read(self):
+        # no settle time, the fake clock doesn't move while the scheduler sleeps
+        scheduler = SmbpbiScheduler(self.session, settle=0)
+        key = scheduler.add(GPU0, 0x05)
+        return scheduler.run()[key]
+
+    def test_not_supported_is_cached(self):
+        self.assertEqual(self.read(), (-1, SMBPBI_STATUS_NOT_SUPPORTED))
+        del self.bus.log[:]
+        self.assertEqual(self.read(), (-1, SMBPBI_STATUS_NOT_SUPPORTED))
+        self.assertEqual(self.bus.log, [])
+        # another command of the device still goes to the bus
+        self.assertTrue(self.session.is_supported(GPU0, 0x02))
+
+    def test_not_supported_expires(self):
+        self.read()
+        self.clock.now += 60
+        del self.bus.log[:]
+        self.read()
+        self.assertEqual(len(self.bus.posts(GPU0)), 1)
+
+    def test_forget_unsupported(self):
+        self.read()
+        self.session.forget_unsupported(GPU0)
+        self.assertTrue(self.session.is_supported(GPU0, 0x05))
+
+
+if __name__ == '__main__':
+    unittest.main()
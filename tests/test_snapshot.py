@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from openBMC import max31790
+from openBMC.max31790 import max31790_device
+from openBMC.snapshot import (KIND_BLOCK, KIND_BYTE, KIND_WORD, Snapshot, format_diff, snapshot_devices,
+                              snapshot_diff, snapshot_missing, snapshot_restore)
+from tests.fake_bus import FakeBus
+
+TMP451 = 0x48
+MAX31790 = 0x2c
+HSC0 = 0x40
+GPU0 = 0x4c
+
+
+def board():
+    '''a fake bus with the TMP451, MAX31790, HSC0 and GPU0 of the board'''
+    registers = {
+        TMP451: dict((register, register ^ 0x5a) for register in range(0x100)),
+        MAX31790: dict((register, (register * 3) & 0xff) for register in range(0x60)),
+        HSC0: dict((register, register) for register in range(0x100)),
+        GPU0: dict((register, 0x10 + register) for register in range(0x100)),
+    }
+    return FakeBus(registers, auto_increment=[MAX31790, GPU0])
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = board()
+        self.devices = snapshot_devices(["tmp451", "max31790", "hsc0", "gpu0"])
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        max31790._devices.clear()
+
+    def test_capture_reads_the_board(self):
+        snapshot = Snapshot.capture(self.bus, self.devices)
+        self.assertEqual(snapshot.entries[(TMP451, 0x05, KIND_BYTE)], 0x05 ^ 0x5a)
+        self.assertEqual(snapshot.entries[(TMP451, 0xfe, KIND_BYTE)], 0xfe ^ 0x5a)
+        self.assertEqual(snapshot.entries[(MAX31790, 0x41, KIND_BYTE)], 0x41 * 3 & 0xff)
+        self.assertEqual(snapshot.entries[(HSC0, 0x88, KIND_WORD)], 0x88 | (0x89 << 8))
+        self.assertEqual(snapshot.entries[(GPU0, 0x5d, KIND_BLOCK)], [0x6d, 0x6e, 0x6f, 0x70, 0x71])
+        # FPGA and the other devices don't answer
+        self.assertEqual(snapshot.addresses(), set([TMP451, MAX31790, HSC0, GPU0]))
+
+    def test_tmp451_is_read_one_byte_at_a_time(self):
+        Snapshot.capture(self.bus, snapshot_devices(["tmp451"]))
+        self.assertEqual(set(entry[0] for entry in self.bus.log), set(["read_byte_data"]))
+
+    def test_save_load_round_trip(self):
+        snapshot = Snapshot.capture(self.bus, self.devices)
+        path = os.path.join(self.tmpdir, "board.snap")
+        snapshot.save(path)
+        loaded = Snapshot.load(path)
+        self.assertEqual(loaded.entries, snapshot.entries)
+        self.assertEqual(loaded.timestamp, snapshot.timestamp)
+        self.assertEqual(snapshot_diff(snapshot, loaded), [])
+        self.assertEqual(format_diff([]), "no difference\n")
+
+    def test_load_rejects_another_file(self):
+        path = os.path.join(self.tmpdir, "other")
+        with open(path, "wb") as other:
+            other.write(b"\0" * 64)
+        self.assertRaises(ValueError, Snapshot.load, path)
+
+    def test_diff(self):
+        before = Snapshot.capture(self.bus, self.devices)
+        self.bus.registers[TMP451][0x20] = 0x55
+        del self.bus.registers[GPU0]
+        after = Snapshot.capture(self.bus, self.devices)
+        self.assertEqual(snapshot_diff(before, after), [(TMP451, 0x20, KIND_BYTE, 0x20 ^ 0x5a, 0x55)])
+        self.assertEqual(snapshot_missing(before, after), (["GPU0"], []))
+
+    def test_restore_writes_back_what_changed(self):
+        snapshot = Snapshot.capture(self.bus, self.devices)
+        fan = self.bus.registers[MAX31790]
+        for register in (0x40, 0x41, 0x42, 0x44):
+            fan[register] = 0
+        # a temperature isn't writable
+        fan[0x18] = 0
+        del self.bus.log[:]
+        writes = snapshot_restore(self.bus, snapshot, self.devices)
+        self.assertEqual(writes, [(MAX31790, 0x40, [0x40 * 3 & 0xff, 0x41 * 3 & 0xff, 0x42 * 3 & 0xff]),
+                                  (MAX31790, 0x44, [0x44 * 3 & 0xff])])
+        self.assertEqual([entry[0] for entry in self.bus.writes()], ["write_i2c_block_data", "write_byte_data"])
+        self.assertEqual(snapshot_diff(snapshot, Snapshot.capture(self.bus, self.devices)),
+                         [(MAX31790, 0x18, KIND_BYTE, 0x18 * 3 & 0xff, 0)])
+
+    def test_restore_tmp451_byte_by_byte_at_the_write_address(self):
+        snapshot = Snapshot.capture(self.bus, self.devices)
+        tmp451 = self.bus.registers[TMP451]
+        # configuration and conversion rate, read at 0x03-0x04, written at 0x09-0x0a
+        tmp451[0x03] = 0
+        tmp451[0x04] = 0
+        tmp451[0x21] = 0
+        del self.bus.log[:]
+        writes = snapshot_restore(self.bus, snapshot, snapshot_devices(["tmp451"]))
+        self.assertEqual(writes, [(TMP451, 0x09, [0x03 ^ 0x5a]), (TMP451, 0x0a, [0x04 ^ 0x5a]),
+                                  (TMP451, 0x21, [0x21 ^ 0x5a])])
+        self.assertEqual(set(entry[0] for entry in self.bus.log), set(["read_byte_data", "write_byte_data"]))
+
+    def test_dry_run_writes_nothing(self):
+        snapshot = Snapshot.capture(self.bus, self.devices)
+        self.bus.registers[MAX31790][0x50] = 0
+        del self.bus.log[:]
+        writes = snapshot_restore(self.bus, snapshot, self.devices, dry_run=True)
+        self.assertEqual(writes, [(MAX31790, 0x50, [0x50 * 3 & 0xff])])
+        self.assertEqual(self.bus.writes(), [])
+
+    def test_restore_drops_the_fan_shadow(self):
+        fan = max31790_device(self.bus)
+        fan.set_pwm(0, 50)
+        fan.flush()
+        snapshot = Snapshot.capture(self.bus, self.devices)
+        self.bus.registers[MAX31790][0x02] = 0
+        snapshot_restore(self.bus, snapshot, self.devices)
+        fan.set_pwm(0, 50)
+        self.assertEqual(fan.flush(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()